@@ -0,0 +1,873 @@
+import asyncio
+import zlib
+
+import redis
+import redis.asyncio as aioredis
+import wire_codec
+from quart import Quart, Blueprint, current_app, request, jsonify, stream_with_context
+from quart.wrappers.response import IterableBody
+from rn_cache import RecordCache, listen_invalidations
+from rn_search import filter_records
+from rn_index import (add_to_index, remove_from_index, add_to_sort_index, remove_from_sort_index,
+                      ensure_index, RN_SORT_ISSUE_NUMBER_KEY, RN_SORT_MODIFIED_KEY)
+from table_patch import apply_table_patch
+from rn_fulltext import update_fulltext_index, ensure_fulltext_index
+from rn_common import (FastJSONProvider, APPEND_RN_CHANGE_LUA, RN_FETCH_BATCH_SIZE, RN_WRITE_RETRIES,
+                       RESPONSE_COMPRESS_MIN_SIZE, RN_CHANGELOG_MAXLEN, RN_CHANGES_PAGE_SIZE, RN_CONFLICT_MESSAGE,
+                       RN_RENAME_EXISTS_MESSAGE, RN_IMPORT_BATCH_SIZE, RN_BATCH_MAX_OPERATIONS, BATCH_OPERATION_NAMES,
+                       RN_PAGE_DEFAULT_LIMIT, RN_PAGE_MAX_LIMIT, BatchOperationError, batch_operation_keys,
+                       plan_rn_batch, parse_fields, project_record, rn_candidate_keys, rn_compare_dictionaries,
+                       record_version, parse_import_line, import_message)
+from server_config import load_config
+from user_cache import AsyncUserCache, listen_user_updates
+
+# 与 server.py 路由和 JSON 格式完全一致的 ASGI 版本，单进程内由事件循环并发处理请求：
+#   hypercorn --workers 4 'async_server:create_app()' --bind 0.0.0.0:5002
+bp = Blueprint('async_server', __name__)
+
+# 由 create_app 按配置创建，同一进程内的所有请求共享
+redis_client = None
+append_rn_change = None
+rn_cache = None
+user_cache = None
+# 启动时创建的订阅任务，停止服务时取消
+listener_tasks = []
+
+
+def create_redis_client(config):
+    """所有请求共享一个连接池；连接用尽时排队等待而不是直接报错"""
+    pool = aioredis.BlockingConnectionPool(host=config['REDIS_HOST'], port=config['REDIS_PORT'],
+                                           db=config['REDIS_DB'], max_connections=config['REDIS_MAX_CONNECTIONS'],
+                                           timeout=10)
+    return aioredis.Redis(connection_pool=pool)
+
+
+def create_app(config=None):
+    """应用工厂：config 缺省时按 server_config.load_config() 从环境变量读取，与 server.create_app 相同"""
+    global redis_client, append_rn_change, rn_cache, user_cache
+    config = config or load_config()
+    redis_client = create_redis_client(config)
+    append_rn_change = redis_client.register_script(APPEND_RN_CHANGE_LUA)
+    rn_cache = RecordCache(config['RN_CACHE_MAX_BYTES'])
+    user_cache = AsyncUserCache(redis_client, config['USER_CACHE_TTL'])
+
+    app = Quart(__name__)
+    app.json = FastJSONProvider(app)
+    app.config.update(config)
+    app.register_blueprint(bp)
+    return app
+
+
+@bp.before_app_serving
+async def ensure_indexes():
+    # 索引检查只在启动时执行一次，用同步客户端在线程中运行
+    config = current_app.config
+    sync_client = redis.Redis(host=config['REDIS_HOST'], port=config['REDIS_PORT'], db=config['REDIS_DB'])
+    try:
+        await asyncio.to_thread(ensure_index, sync_client, RN_FETCH_BATCH_SIZE)
+        await asyncio.to_thread(ensure_fulltext_index, sync_client, RN_FETCH_BATCH_SIZE)
+    finally:
+        sync_client.close()
+
+
+@bp.before_app_serving
+async def start_listeners():
+    if rn_cache.max_bytes > 0:
+        listener_tasks.append(asyncio.create_task(listen_invalidations(redis_client, rn_cache)))
+    if user_cache.ttl > 0:
+        listener_tasks.append(asyncio.create_task(listen_user_updates(redis_client, user_cache)))
+
+
+@bp.after_app_serving
+async def close_redis():
+    for task in listener_tasks:
+        task.cancel()
+    await asyncio.gather(*listener_tasks, return_exceptions=True)
+    listener_tasks.clear()
+    await redis_client.aclose()
+
+
+def not_modified(etag):
+    """客户端 If-None-Match 中的 ETag 仍然有效时返回 304 响应，否则返回 None"""
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class('', status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+@bp.after_app_request
+async def compress_response(response):
+    """按客户端的 Accept-Encoding 用 zstd 或 gzip 压缩较大的 JSON 响应"""
+    if (response.status_code != 200 or 'Content-Encoding' in response.headers
+            or response.mimetype != 'application/json'):
+        return response
+    if isinstance(response.response, IterableBody):
+        # 流式响应由 stream_json_response 边生成边压缩，get_data 会把整个响应体读进内存
+        return response
+
+    data = await response.get_data()
+    if len(data) < RESPONSE_COMPRESS_MIN_SIZE:
+        return response
+
+    encoding = wire_codec.negotiate_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    response.set_data(wire_codec.compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+async def log_rn_change(pipe, operation, issue_number, rn_record=None, old_issue_number=None):
+    """在调用方的事务中递增修订号并写入变更日志"""
+    await append_rn_change(keys=['rn_revision', 'rn_changes'],
+                           args=[RN_CHANGELOG_MAXLEN, operation, issue_number, old_issue_number or '',
+                                 wire_codec.dumps(rn_record) if rn_record is not None else ''],
+                           client=pipe)
+
+
+async def load_rn_records_bulk(batch_size=RN_FETCH_BATCH_SIZE):
+    """用增量 SCAN 收集键，再用流水线批量 MGET 读取全部 rn_record"""
+    keys = [key async for key in redis_client.scan_iter(match='rn_record:*', count=batch_size)]
+    if not keys:
+        return []
+
+    pipe = redis_client.pipeline(transaction=False)
+    for start in range(0, len(keys), batch_size):
+        pipe.mget(keys[start:start + batch_size])
+    return [wire_codec.loads(data) for values in await pipe.execute() for data in values if data is not None]
+
+
+async def iter_rn_records_json(batch_size=RN_FETCH_BATCH_SIZE, fields=None):
+    """与 server.iter_rn_records_json 相同：逐批 MGET 产出全部记录组成的 JSON 数组片段"""
+    yield b'['
+    separator = b''
+    async for keys in iter_rn_key_batches(batch_size):
+        values = [data for data in await redis_client.mget(keys) if data is not None]
+        if fields:
+            values = [wire_codec.dumps(project_record(wire_codec.loads(data), fields)).encode('utf-8')
+                      for data in values]
+        if values:
+            yield separator + b','.join(values)
+            separator = b','
+    yield b']'
+
+
+async def compress_chunks(chunks, encoding):
+    """wire_codec.compress_stream 的异步版本"""
+    compressor = wire_codec.stream_compressor(encoding)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_json_response(chunks):
+    """以流式响应返回异步生成的 JSON，按 Accept-Encoding 边生成边压缩"""
+    encoding = wire_codec.negotiate_encoding(request.accept_encodings)
+    if encoding is not None:
+        chunks = compress_chunks(chunks, encoding)
+    response = current_app.response_class(chunks, mimetype='application/json')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+async def load_rn_records_by_issue_numbers(issue_numbers, batch_size=RN_FETCH_BATCH_SIZE):
+    """按问题单号批量 MGET 读取记录"""
+    keys = [f'rn_record:{issue_number}' for issue_number in issue_numbers]
+    pipe = redis_client.pipeline(transaction=False)
+    for start in range(0, len(keys), batch_size):
+        pipe.mget(keys[start:start + batch_size])
+    return [wire_codec.loads(data) for values in await pipe.execute() for data in values if data is not None]
+
+
+async def iter_rn_key_batches(batch_size=RN_FETCH_BATCH_SIZE):
+    """增量 SCAN rn_record:* 键，每凑满 batch_size 个产出一批"""
+    keys = []
+    async for key in redis_client.scan_iter(match='rn_record:*', count=batch_size):
+        keys.append(key)
+        if len(keys) >= batch_size:
+            yield keys
+            keys = []
+    if keys:
+        yield keys
+
+
+async def write_rn_record(pipe, issue_number, data, old_record=None, old_issue_number=None):
+    """与 server.write_rn_record 相同，在调用方已进入 MULTI 的事务中排队写入，返回操作类型"""
+    data['version'] = record_version(old_record) + 1
+    if old_record is None:
+        operation = 'post'
+    elif old_issue_number and old_issue_number != issue_number:
+        operation = 'update_with_rename'
+    else:
+        operation = 'update'
+    old_issue_number = old_issue_number or issue_number
+    if old_record is not None:
+        remove_from_index(pipe, old_issue_number, old_record)
+    if old_issue_number != issue_number:
+        pipe.delete(f'rn_record:{old_issue_number}')
+        remove_from_sort_index(pipe, old_issue_number)
+    pipe.set(f'rn_record:{issue_number}', wire_codec.dumps(data))
+    add_to_index(pipe, issue_number, data)
+    add_to_sort_index(pipe, issue_number)
+    update_fulltext_index(pipe, issue_number, old_record, data, old_issue_number)
+    await log_rn_change(pipe, operation, issue_number, data,
+                        old_issue_number if operation == 'update_with_rename' else None)
+    return operation
+
+
+async def remove_rn_record(pipe, issue_number, record):
+    """在调用方已进入 MULTI 的事务中排队删除记录及其索引并追加变更日志"""
+    pipe.delete(f'rn_record:{issue_number}')
+    remove_from_index(pipe, issue_number, record)
+    remove_from_sort_index(pipe, issue_number)
+    update_fulltext_index(pipe, issue_number, old_record=record)
+    await log_rn_change(pipe, 'delete', issue_number)
+
+
+@bp.route('/rn_record_exists', methods=['POST'])
+async def check_issue_number_exists():
+    request_data = await request.get_json()
+    issue_number = request_data.get('issue_number')
+
+    if not issue_number:
+        return jsonify({"error": "issue_number 是必填项"}), 400
+
+    exists = await redis_client.exists(f'rn_record:{issue_number}') > 0
+    return jsonify({"exists": exists})
+
+
+@bp.route('/save_rn_record', methods=['POST'])
+async def save_rn_record():
+    data = await request.get_json()
+    issue_number = data.get('issue_number')
+    client_id = data.get('client_id')
+    save_username_key = data.get('username')
+
+    save_username = await user_cache.display_name(save_username_key)
+    if not save_username:
+        return jsonify({"error": "未找到对应的中文名字"}), 404
+
+    old_issue_number = data.pop('old_issue_number', None)
+    base_version = data.pop('base_version', None)
+
+    if not issue_number:
+        return jsonify({"error": "issue_number 是必填项"}), 400
+
+    source_issue_number = old_issue_number or issue_number
+    try:
+        for _ in range(RN_WRITE_RETRIES):
+            async with redis_client.pipeline(transaction=True) as pipe:
+                try:
+                    await pipe.watch(f'rn_record:{source_issue_number}', f'rn_record:{issue_number}')
+                    existing_record = await pipe.get(f'rn_record:{source_issue_number}')
+                    existing_record = wire_codec.loads(existing_record) if existing_record else None
+                    if old_issue_number and existing_record is None:
+                        if old_issue_number == issue_number:
+                            return jsonify({"error": "未找到对应的问题单号"}), 404
+                        return jsonify({"error": "未找到旧的问题单号"}), 404
+                    if base_version is not None and record_version(existing_record) != base_version:
+                        return jsonify({"status": "conflict", "error": RN_CONFLICT_MESSAGE,
+                                        "current": existing_record}), 409
+                    if source_issue_number != issue_number and await pipe.exists(f'rn_record:{issue_number}'):
+                        return jsonify({"status": "conflict", "error": RN_RENAME_EXISTS_MESSAGE}), 409
+
+                    summary = rn_compare_dictionaries(existing_record or {}, data)
+                    pipe.multi()
+                    operation = await write_rn_record(pipe, issue_number, data, old_record=existing_record,
+                                                      old_issue_number=source_issue_number)
+                    revision = (await pipe.execute())[-1]
+                    break
+                except redis.WatchError:
+                    continue
+        else:
+            return jsonify({"error": "记录正被其他用户修改，请稍后重试"}), 409
+
+        message = {
+            'client_id': client_id,
+            'operation': operation,
+            'new_issue_number': issue_number,
+            'rn_record': data,
+            'username': save_username,
+            'summary': summary,
+            'revision': revision
+        }
+        if operation == 'update_with_rename':
+            message['old_issue_number'] = old_issue_number
+        # 本进程的缓存立即失效，其他 worker 通过 rn_channel 收到广播后失效
+        rn_cache.invalidate(issue_number, old_issue_number)
+        await redis_client.publish('rn_channel', wire_codec.dumps(message))
+
+        return jsonify({"status": "success", "issue_number": issue_number, "revision": revision,
+                        "version": data['version']})
+
+    except Exception as e:
+        print(f"Error processing record: {e}")
+        return jsonify({"error": "处理记录时出错", "details": str(e)}), 500
+
+
+@bp.route('/get_rn_record_by_issue_number', methods=['GET'])
+async def get_rn_record_by_issue_number():
+    issue_number = request.args.get('issue_number')
+    if not issue_number:
+        return jsonify({"error": "issue_number 是必填项"}), 400
+
+    data = await redis_client.get(f'rn_record:{issue_number}')
+    if data:
+        return jsonify(wire_codec.loads(data))
+    return jsonify({"error": "Record not found"}), 404
+
+
+@bp.route('/delete_rn_record', methods=['DELETE'])
+async def delete_rn_record():
+    request_data = await request.get_json()
+    issue_number = request_data.get('issue_number')
+    client_id = request_data.get('client_id')
+    del_username_key = request_data.get('username')
+    base_version = request_data.get('base_version')
+
+    if not issue_number or not client_id:
+        return jsonify({"error": "issue_number 和 client_id 是必填项"}), 400
+
+    del_username = await user_cache.display_name(del_username_key)
+    if not del_username:
+        return jsonify({"error": "未找到对应的中文名字"}), 404
+
+    for _ in range(RN_WRITE_RETRIES):
+        async with redis_client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(f'rn_record:{issue_number}')
+                delete_data = await pipe.get(f'rn_record:{issue_number}')
+                if not delete_data:
+                    return jsonify({"error": "issue_number不存在"})
+                delete_data = wire_codec.loads(delete_data)
+                if base_version is not None and record_version(delete_data) != base_version:
+                    return jsonify({"status": "conflict", "error": RN_CONFLICT_MESSAGE, "current": delete_data}), 409
+                summary = rn_compare_dictionaries(delete_data, {})
+                pipe.multi()
+                await remove_rn_record(pipe, issue_number, delete_data)
+                revision = (await pipe.execute())[-1]
+                break
+            except redis.WatchError:
+                continue
+    else:
+        return jsonify({"error": "记录正被其他用户修改，请稍后重试"}), 409
+
+    message = {
+        'client_id': client_id,
+        'operation': 'delete',
+        'issue_number': issue_number,
+        'username': del_username,
+        'summary': summary,
+        'revision': revision
+    }
+    rn_cache.invalidate(issue_number)
+    await redis_client.publish('rn_channel', wire_codec.dumps(message))
+    return jsonify({"status": "success", "revision": revision})
+
+
+async def rn_page_issue_numbers(sort, cursor, limit):
+    """与 server.rn_page_issue_numbers 相同：按排序索引取一页问题单号，返回 (issue_numbers, next_cursor)"""
+    if sort == 'issue_number':
+        start = f'({cursor}' if cursor else '-'
+        members = await redis_client.zrangebylex(RN_SORT_ISSUE_NUMBER_KEY, start, '+', start=0, num=limit + 1)
+        issue_numbers = [member.decode('utf-8') for member in members]
+        has_more = len(issue_numbers) > limit
+        issue_numbers = issue_numbers[:limit]
+        return issue_numbers, issue_numbers[-1] if has_more else None
+
+    if cursor:
+        score, _, last_issue_number = cursor.partition(':')
+        score = float(score)
+        ties = await redis_client.zcount(RN_SORT_MODIFIED_KEY, score, score)
+        entries = await redis_client.zrevrangebyscore(RN_SORT_MODIFIED_KEY, score, '-inf', start=0,
+                                                      num=limit + 1 + ties, withscores=True)
+        entries = [(member.decode('utf-8'), entry_score) for member, entry_score in entries]
+        entries = [(member, entry_score) for member, entry_score in entries
+                   if entry_score != score or member < last_issue_number]
+    else:
+        entries = await redis_client.zrevrangebyscore(RN_SORT_MODIFIED_KEY, '+inf', '-inf', start=0, num=limit + 1,
+                                                      withscores=True)
+        entries = [(member.decode('utf-8'), entry_score) for member, entry_score in entries]
+
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    next_cursor = f'{entries[-1][1]!r}:{entries[-1][0]}' if has_more else None
+    return [member for member, _ in entries], next_cursor
+
+
+@bp.route('/get_all_rn_records', methods=['GET'])
+async def get_all_rn_records():
+    if 'limit' in request.args or 'cursor' in request.args:
+        return await get_rn_records_page()
+
+    fields = parse_fields(request.args.get('fields'))
+    if fields:
+        # 投影结果不进入快照缓存；字段名含中文，ETag 中用其校验和区分不同投影
+        revision = int(await redis_client.get('rn_revision') or 0)
+        etag = f'rn-{revision}-{zlib.crc32(",".join(fields).encode("utf-8")):08x}'
+        response = not_modified(etag)
+        if response is None:
+            response = stream_json_response(iter_rn_records_json(fields=fields))
+            response.set_etag(etag)
+        response.headers['X-RN-Revision'] = str(revision)
+        return response
+
+    snapshot = rn_cache.get_snapshot()
+    if snapshot is not None:
+        revision, body = snapshot
+    else:
+        # 先读修订号再读记录，客户端据此增量同步时最多重复应用少量变更
+        generation = rn_cache.generation
+        revision = int(await redis_client.get('rn_revision') or 0)
+        body = None
+
+    etag = f'rn-{revision}'
+    response = not_modified(etag)
+    if response is None:
+        if body is None:
+            # 逐批读取并流式输出，每个请求只占用一批记录的内存；语料不超过缓存上限时顺便存为快照
+            response = stream_json_response(rn_cache.tee_snapshot_async(revision, iter_rn_records_json(), generation))
+        else:
+            response = current_app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+    response.headers['X-RN-Revision'] = str(revision)
+    return response
+
+
+async def get_rn_records_page():
+    """分页读取：?limit=&cursor=&sort=issue_number|modified&fields=，返回一页记录和下一页的游标"""
+    sort = request.args.get('sort', 'issue_number')
+    limit = request.args.get('limit', RN_PAGE_DEFAULT_LIMIT, type=int)
+    if sort not in ('issue_number', 'modified'):
+        return jsonify({"error": "sort 只能是 issue_number 或 modified"}), 400
+    if not limit or not 0 < limit <= RN_PAGE_MAX_LIMIT:
+        return jsonify({"error": f"limit 必须是 1 到 {RN_PAGE_MAX_LIMIT} 之间的整数"}), 400
+
+    revision = int(await redis_client.get('rn_revision') or 0)
+    try:
+        issue_numbers, next_cursor = await rn_page_issue_numbers(sort, request.args.get('cursor'), limit)
+    except ValueError:
+        return jsonify({"error": "cursor 无效"}), 400
+
+    records = await load_rn_records_by_issue_numbers(issue_numbers)
+    fields = parse_fields(request.args.get('fields'))
+    if fields:
+        records = [project_record(record, fields) for record in records]
+
+    response = jsonify({
+        "records": records,
+        "next_cursor": next_cursor,
+        "total": await redis_client.zcard(RN_SORT_ISSUE_NUMBER_KEY),
+        "revision": revision
+    })
+    response.headers['X-RN-Revision'] = str(revision)
+    return response
+
+
+@bp.route('/rn_records/batch', methods=['POST'])
+async def batch_rn_records():
+    """与 server.batch_rn_records 相同：在一个事务中按顺序执行多个保存和删除，只广播一条汇总消息"""
+    request_data = await request.get_json() or {}
+    client_id = request_data.get('client_id')
+    operations = request_data.get('operations') or []
+
+    batch_username = await user_cache.display_name(request_data.get('username'))
+    if not batch_username:
+        return jsonify({"error": "未找到对应的中文名字"}), 404
+    if len(operations) > RN_BATCH_MAX_OPERATIONS:
+        return jsonify({"error": f"单次最多 {RN_BATCH_MAX_OPERATIONS} 个操作"}), 400
+    try:
+        issue_numbers = batch_operation_keys(operations)
+    except ValueError as e:
+        return jsonify({"error": "批量操作无效", "details": str(e)}), 400
+    if not issue_numbers:
+        return jsonify({"status": "success", "count": 0, "revision": int(await redis_client.get('rn_revision') or 0)})
+
+    keys = [f'rn_record:{issue_number}' for issue_number in issue_numbers]
+    for _ in range(RN_WRITE_RETRIES):
+        async with redis_client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(*keys)
+                current = {issue_number: wire_codec.loads(data) if data else None
+                           for issue_number, data in zip(issue_numbers, await pipe.mget(keys))}
+                try:
+                    changes = plan_rn_batch(operations, current)
+                except BatchOperationError as e:
+                    status_code = 409 if e.conflict else 404
+                    return jsonify({"status": "conflict" if e.conflict else "error", "error": "批量操作失败",
+                                    "details": str(e), "index": e.index, "current": e.current}), status_code
+
+                pipe.multi()
+                for name, issue_number, old_issue_number, old_record, record in changes:
+                    if name == 'delete':
+                        await remove_rn_record(pipe, issue_number, old_record)
+                    else:
+                        await write_rn_record(pipe, issue_number, record, old_record=old_record,
+                                              old_issue_number=old_issue_number)
+                revision = (await pipe.execute())[-1]
+                break
+            except redis.WatchError:
+                continue
+    else:
+        return jsonify({"error": "记录正被其他用户修改，请稍后重试"}), 409
+
+    rn_cache.invalidate(*issue_numbers)
+    counts = {}
+    for change in changes:
+        name = BATCH_OPERATION_NAMES[change[0]]
+        counts[name] = counts.get(name, 0) + 1
+    message = {
+        'client_id': client_id,
+        'operation': 'batch',
+        'count': len(changes),
+        'issue_numbers': issue_numbers,
+        'username': batch_username,
+        'summary': "批量操作：" + "，".join(f"{name} {count} 条" for name, count in counts.items()) + "。",
+        'revision': revision
+    }
+    await redis_client.publish('rn_channel', wire_codec.dumps(message))
+
+    return jsonify({"status": "success", "count": len(changes), "revision": revision})
+
+
+async def import_rn_batch(records):
+    """与 server.import_rn_batch 相同，在一个 WATCH/MULTI 事务中写入一批记录，多次冲突后返回 None"""
+    keys = [f'rn_record:{issue_number}' for issue_number in records]
+    for _ in range(RN_WRITE_RETRIES):
+        async with redis_client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(*keys)
+                old_records = await pipe.mget(keys)
+                pipe.multi()
+                for (issue_number, record), old_record in zip(records.items(), old_records):
+                    await write_rn_record(pipe, issue_number, record,
+                                          old_record=wire_codec.loads(old_record) if old_record else None)
+                return (await pipe.execute())[-1]
+            except redis.WatchError:
+                continue
+    return None
+
+
+@bp.route('/rn_records/export', methods=['GET'])
+async def export_rn_records():
+    """以 NDJSON 流式导出全部记录，每行一条；X-RN-Revision 为开始导出时的修订号"""
+    async def generate():
+        async for keys in iter_rn_key_batches():
+            yield b''.join(data + b'\n' for data in await redis_client.mget(keys) if data is not None)
+
+    revision = int(await redis_client.get('rn_revision') or 0)
+    response = current_app.response_class(generate(), mimetype='application/x-ndjson')
+    response.headers['X-RN-Revision'] = str(revision)
+    return response
+
+
+@bp.route('/rn_records/import', methods=['POST'])
+async def import_rn_records():
+    """与 server.import_rn_records 相同：分批写入，以 NDJSON 流式返回进度，结束时只广播一条 import 消息"""
+    client_id = request.args.get('client_id')
+    import_username = await user_cache.display_name(request.args.get('username'))
+    if not import_username:
+        return jsonify({"error": "未找到对应的中文名字"}), 404
+
+    @stream_with_context
+    async def generate():
+        imported, failed, revision = 0, 0, None
+        failed_lines = []
+        batch = {}
+        line_number = 0
+
+        async def flush():
+            nonlocal imported, failed, revision
+            try:
+                batch_revision = await import_rn_batch(batch)
+            finally:
+                # 事务出错时无法确定是否已提交，同样使缓存失效
+                rn_cache.invalidate(*batch)
+            if batch_revision is None:
+                failed += len(batch)
+            else:
+                imported += len(batch)
+                revision = batch_revision
+            batch.clear()
+            return wire_codec.dumps({"imported": imported, "failed": failed}) + '\n'
+
+        def add_line(line):
+            nonlocal failed
+            line = line.strip()
+            if not line:
+                return
+            try:
+                issue_number, record = parse_import_line(line)
+            except ValueError:
+                failed += 1
+                if len(failed_lines) < 100:
+                    failed_lines.append(line_number)
+                return
+            batch.pop(issue_number, None)
+            batch[issue_number] = record
+
+        error = None
+        try:
+            # 请求体按块到达，按换行切分后逐行解析
+            pending = b''
+            async for chunk in request.body:
+                pending += chunk
+                *lines, pending = pending.split(b'\n')
+                for line in lines:
+                    line_number += 1
+                    add_line(line)
+                    if len(batch) >= RN_IMPORT_BATCH_SIZE:
+                        yield await flush()
+            if pending:
+                line_number += 1
+                add_line(pending)
+            if batch:
+                yield await flush()
+        except redis.RedisError as e:
+            error = e
+        finally:
+            if imported:
+                try:
+                    await redis_client.publish('rn_channel', wire_codec.dumps(
+                        import_message(client_id, import_username, imported, revision)))
+                except redis.RedisError as e:
+                    print(f"Error publishing import message: {e}")
+
+        if error is not None:
+            yield wire_codec.dumps({"status": "error", "error": "导入中断", "details": str(error),
+                                    "imported": imported, "failed": failed}) + '\n'
+            return
+
+        yield wire_codec.dumps({"status": "success", "imported": imported, "failed": failed,
+                                "failed_lines": failed_lines, "revision": revision}) + '\n'
+
+    return current_app.response_class(generate(), mimetype='application/x-ndjson')
+
+
+@bp.route('/rn_changes', methods=['GET'])
+async def get_rn_changes():
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({"error": "since 是必填项"}), 400
+
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.get('rn_revision')
+    pipe.xrange('rn_changes', min=f'{since + 1}-0', max='+', count=RN_CHANGES_PAGE_SIZE)
+    pipe.xrange('rn_changes', count=1)
+    revision, entries, oldest = await pipe.execute()
+    revision = int(revision or 0)
+
+    oldest_revision = int(oldest[0][0].split(b'-')[0]) if oldest else revision + 1
+    if since > revision or (since < revision and oldest_revision > since + 1):
+        return jsonify({"reset": True, "revision": revision, "changes": []})
+
+    changes = []
+    for entry_id, fields in entries:
+        fields = {key.decode('utf-8'): value.decode('utf-8') for key, value in fields.items()}
+        changes.append({
+            'revision': int(entry_id.split(b'-')[0]),
+            'operation': fields['operation'],
+            'issue_number': fields['issue_number'],
+            'old_issue_number': fields['old_issue_number'] or None,
+            'rn_record': wire_codec.loads(fields['rn_record']) if fields['rn_record'] else None
+        })
+
+    return jsonify({
+        "reset": False,
+        "revision": changes[-1]['revision'] if changes else revision,
+        "has_more": len(changes) == RN_CHANGES_PAGE_SIZE,
+        "changes": changes
+    })
+
+
+@bp.route('/search_rn_records', methods=['POST'])
+async def search_rn_records():
+    request_data = await request.get_json() or {}
+    filters = request_data.get('filters') or []
+
+    try:
+        candidate_keys = rn_candidate_keys(filters)
+        if candidate_keys:
+            members = await redis_client.sinter(candidate_keys)
+            rn_records = await load_rn_records_by_issue_numbers(sorted(member.decode('utf-8') for member in members))
+        else:
+            rn_records = await load_rn_records_bulk()
+        matched_records = filter_records(rn_records, filters)
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": "过滤条件无效", "details": str(e)}), 400
+
+    # 过滤基于完整记录，投影只作用于返回结果
+    fields = parse_fields(request_data.get('fields'))
+    if fields:
+        matched_records = [project_record(record, fields) for record in matched_records]
+    return jsonify(matched_records)
+
+
+@bp.route('/save_all', methods=['POST'])
+async def save_all_route():
+    request_data = await request.get_json()
+    table_name = request_data['table_name']
+    client_id = request_data.get('client_id')
+
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.set(f'{table_name}_data', wire_codec.dumps(request_data['data']))
+    pipe.set(f'{table_name}_merged_cells', wire_codec.dumps(request_data['merged_cells']))
+    pipe.incr(f'{table_name}_version')
+    version = (await pipe.execute())[-1]
+
+    message_data = {
+        'table_name': table_name,
+        'client_id': client_id,
+        'message': '数据已更新',
+        'version': version
+    }
+    await redis_client.publish('table_updates', wire_codec.dumps(message_data))
+
+    return jsonify({"status": "success", "version": version})
+
+
+@bp.route('/get_all', methods=['POST'])
+async def get_all_route():
+    request_data = await request.get_json()
+    table_name = request_data['table_name']
+
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.get(f'{table_name}_version')
+    pipe.get(f'{table_name}_data')
+    pipe.get(f'{table_name}_merged_cells')
+    version, table_data_json, merged_cells_json = await pipe.execute()
+    version = int(version or 0)
+    etag = f'{table_name}-{version}'
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    result = {
+        "table_data": wire_codec.loads(table_data_json) if table_data_json else [],
+        "merged_cells": wire_codec.loads(merged_cells_json) if merged_cells_json else []
+    }
+    response = jsonify({"status": "success", "data": result, "version": version})
+    response.set_etag(etag)
+    return response
+
+
+@bp.route('/patch_table', methods=['POST'])
+async def patch_table_route():
+    request_data = await request.get_json()
+    table_name = request_data['table_name']
+    client_id = request_data.get('client_id')
+    base_version = request_data.get('base_version')
+    ops = request_data.get('ops') or []
+
+    version_key = f'{table_name}_version'
+    async with redis_client.pipeline(transaction=True) as pipe:
+        try:
+            await pipe.watch(version_key)
+            current_version = int(await pipe.get(version_key) or 0)
+            if base_version != current_version:
+                return jsonify({"status": "conflict", "error": "表格已被其他用户修改",
+                                "version": current_version}), 409
+
+            table_data_json = await pipe.get(f'{table_name}_data')
+            merged_cells_json = await pipe.get(f'{table_name}_merged_cells')
+            try:
+                table_data, merged_cells = apply_table_patch(
+                    wire_codec.loads(table_data_json) if table_data_json else [],
+                    wire_codec.loads(merged_cells_json) if merged_cells_json else [],
+                    ops
+                )
+            except ValueError as e:
+                return jsonify({"status": "error", "error": "补丁无效", "details": str(e)}), 400
+
+            pipe.multi()
+            pipe.set(f'{table_name}_data', wire_codec.dumps(table_data))
+            pipe.set(f'{table_name}_merged_cells', wire_codec.dumps(merged_cells))
+            pipe.incr(version_key)
+            version = (await pipe.execute())[-1]
+        except redis.WatchError:
+            return jsonify({"status": "conflict", "error": "表格已被其他用户修改",
+                            "version": int(await redis_client.get(version_key) or 0)}), 409
+
+    message_data = {
+        'table_name': table_name,
+        'client_id': client_id,
+        'message': '数据已更新',
+        'base_version': base_version,
+        'version': version,
+        'patch': ops
+    }
+    await redis_client.publish('table_updates', wire_codec.dumps(message_data))
+
+    return jsonify({"status": "success", "version": version})
+
+
+@bp.route('/save_table', methods=['POST'])
+async def save_table_route():
+    request_data = await request.get_json()
+    table_name = request_data['table_name']
+
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.set(f'{table_name}_data', wire_codec.dumps(request_data['data']))
+    pipe.incr(f'{table_name}_version')
+    version = (await pipe.execute())[-1]
+
+    return jsonify({"status": "success", "version": version})
+
+
+@bp.route('/get_table', methods=['POST'])
+async def get_table_route():
+    request_data = await request.get_json()
+    table_name = request_data['table_name']
+
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.get(f'{table_name}_version')
+    pipe.get(f'{table_name}_data')
+    version, table_data_json = await pipe.execute()
+    version = int(version or 0)
+    etag = f'{table_name}-{version}'
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    response = jsonify({"status": "success", "data": wire_codec.loads(table_data_json) if table_data_json else [],
+                        "version": version})
+    response.set_etag(etag)
+    return response
+
+
+@bp.route('/save_merged_cells', methods=['POST'])
+async def save_merged_cells_route():
+    request_data = await request.get_json()
+    table_name = request_data['table_name']
+
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.set(f'{table_name}_merged_cells', wire_codec.dumps(request_data['merged_cells']))
+    pipe.incr(f'{table_name}_version')
+    version = (await pipe.execute())[-1]
+
+    return jsonify({"status": "success", "version": version})
+
+
+@bp.route('/get_permissions', methods=['POST'])
+async def get_permissions_route():
+    request_data = await request.get_json()
+    permission_username = request_data.get('username')
+
+    permissions = await user_cache.permissions(permission_username)
+    if permissions is not None:
+        return jsonify({"status": "success", "permissions": permissions})
+    else:
+        return jsonify({"status": "error", "message": "No permissions found for user"})
+
+
+if __name__ == '__main__':
+    # 用户与权限用 seed_data.py 写入
+    config = load_config()
+    create_app(config).run(host=config['SERVER_HOST'], port=config['SERVER_PORT'])
@@ -0,0 +1,57 @@
+"""对比每次新建连接的 requests.get/post 与 http_session 共享连接池的单次调用延迟
+
+先启动服务端（python serve.py --port 5002），再运行：
+    python bench_client.py http://127.0.0.1:5002 --requests 500 --threads 8
+"""
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import http_session
+import requests
+
+
+def bare_call(base_url):
+    return requests.post(f'{base_url}/rn_record_exists', json={'issue_number': 'BENCH-CLIENT'}, timeout=10)
+
+
+def pooled_call(base_url):
+    return http_session.request('POST', f'{base_url}/rn_record_exists', idempotent=True,
+                                json={'issue_number': 'BENCH-CLIENT'})
+
+
+def bench(name, call, base_url, request_count, threads):
+    latencies, lock = [], threading.Lock()
+
+    def worker(count):
+        for _ in range(count):
+            start = time.perf_counter()
+            call(base_url).raise_for_status()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for future in [executor.submit(worker, request_count // threads) for _ in range(threads)]:
+            future.result()
+    total = time.perf_counter() - start
+
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    print(f"{name}: {len(latencies)} 次调用，{threads} 线程，耗时 {total:.2f}s，"
+          f"平均 {statistics.mean(latencies) * 1000:.2f}ms，"
+          f"p50 {quantiles[49] * 1000:.2f}ms，p95 {quantiles[94] * 1000:.2f}ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='客户端 HTTP 连接复用压测')
+    parser.add_argument('url', help='服务端地址')
+    parser.add_argument('--requests', type=int, default=500, help='总请求数')
+    parser.add_argument('--threads', type=int, default=1, help='并发线程数')
+    args = parser.parse_args()
+
+    url = args.url.rstrip('/')
+    bench('每次新建连接', bare_call, url, args.requests, args.threads)
+    bench('共享连接池', pooled_call, url, args.requests, args.threads)
@@ -0,0 +1,83 @@
+"""对比 Flask 版（server.py）与 ASGI 版（async_server.py）服务端的吞吐和延迟
+
+先分别启动两个服务端，例如：
+    python serve.py --port 5002                                 # Flask
+    hypercorn 'async_server:create_app()' --bind 0.0.0.0:5003  # ASGI
+再运行：
+    python bench_server.py http://127.0.0.1:5002 http://127.0.0.1:5003 --clients 200 --requests 20
+"""
+import argparse
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_USERNAME = 'c50039964'
+
+
+def make_record(issue_number):
+    return {
+        'issue_number': issue_number,
+        '问题单号': issue_number,
+        '标题': f'压测记录 {issue_number}',
+        '严重级别': '一般',
+        '问题描述': '用于服务端压测的记录',
+        'username': BENCH_USERNAME,
+        'client_id': 'bench'
+    }
+
+
+def run_client(base_url, client_index, request_count, latencies, errors, lock):
+    """模拟一个客户端：交替执行读记录、检查单号、保存记录和读权限"""
+    session = requests.Session()
+    issue_number = f'BENCH-{client_index}-{uuid.uuid4().hex[:6]}'
+    calls = [
+        lambda: session.post(f'{base_url}/save_rn_record', json=make_record(issue_number)),
+        lambda: session.get(f'{base_url}/get_rn_record_by_issue_number', params={'issue_number': issue_number}),
+        lambda: session.post(f'{base_url}/rn_record_exists', json={'issue_number': issue_number}),
+        lambda: session.post(f'{base_url}/get_permissions', json={'username': BENCH_USERNAME}),
+    ]
+    for i in range(request_count):
+        start = time.perf_counter()
+        try:
+            response = calls[i % len(calls)]()
+            ok = response.status_code < 500
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors.append(elapsed)
+
+    session.delete(f'{base_url}/delete_rn_record',
+                   json={'issue_number': issue_number, 'client_id': 'bench', 'username': BENCH_USERNAME})
+
+
+def bench(base_url, clients, request_count):
+    latencies, errors, lock = [], [], threading.Lock()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        for client_index in range(clients):
+            executor.submit(run_client, base_url, client_index, request_count, latencies, errors, lock)
+    total = time.perf_counter() - start
+
+    latencies.sort()
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    print(f"{base_url}: {len(latencies)} 次请求，{len(errors)} 次失败，耗时 {total:.2f}s，"
+          f"吞吐 {len(latencies) / total:.0f} req/s，"
+          f"p50 {quantiles[49] * 1000:.1f}ms，p95 {quantiles[94] * 1000:.1f}ms，p99 {quantiles[98] * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='RN 服务端并发压测')
+    parser.add_argument('urls', nargs='+', help='要对比的服务端地址')
+    parser.add_argument('--clients', type=int, default=200, help='并发客户端数')
+    parser.add_argument('--requests', type=int, default=20, help='每个客户端发送的请求数')
+    args = parser.parse_args()
+
+    for url in args.urls:
+        bench(url.rstrip('/'), args.clients, args.requests)
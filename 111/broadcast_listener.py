@@ -6,6 +6,7 @@ from redis import Redis, ConnectionPool
 
 class BroadcastListener(QThread):
     update_table_signal = Signal(dict, str)  # 定义信号，传递 rn_record 和操作类型
+    user_updated_signal = Signal(list)  # 用户中文名或权限变化，传递用户名列表
 
     def __init__(self, client_id, redis_url, parent=None):
         super().__init__(parent)
@@ -19,12 +20,15 @@ class BroadcastListener(QThread):
     def run(self):
         redis_client = Redis(connection_pool=self.pool)
         pubsub = redis_client.pubsub()
-        pubsub.subscribe('rn_channel')  # 订阅频道
+        pubsub.subscribe('rn_channel', 'user_updates')  # 订阅频道
         print("Subscribed to rn_channel.")
         while self.is_running:
             message = pubsub.get_message(ignore_subscribe_messages=True, timeout=1)
             if message and message['type'] == 'message':
                 data = json.loads(message['data'])
+                if message['channel'] == b'user_updates':
+                    self.user_updated_signal.emit(data.get('usernames', []))
+                    continue
                 if data['client_id'] != self.client_id:  # 忽略本客户端的消息
                     operation = data.get('operation')
                     if operation:
@@ -0,0 +1,51 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+POOL_MAXSIZE = 20  # 每个服务器地址保持的 keep-alive 连接数，不小于客户端的并发线程数
+RETRY_ATTEMPTS = 3  # 幂等请求最多尝试的次数
+RETRY_BACKOFF = 0.2  # 第 n 次重试前等待 RETRY_BACKOFF * 2 ** (n - 1) 秒
+RETRY_STATUSES = frozenset({502, 503, 504})
+
+# 各类请求的 (连接超时, 读取超时) 秒数
+READ_TIMEOUT = (3.05, 10)
+WRITE_TIMEOUT = (3.05, 30)
+TRANSFER_TIMEOUT = (3.05, 300)  # 导入导出等长时间的流式传输
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """返回进程内共享的 Session；urllib3 连接池是线程安全的，各线程复用同一批 keep-alive 连接"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def request(method, url, idempotent=False, timeout=READ_TIMEOUT, **kwargs):
+    """通过共享 Session 发送请求
+
+    idempotent 为 True 时，连接失败、超时和 502/503/504 会按指数退避重试；写操作只发送一次，避免重复执行。
+    """
+    attempts = RETRY_ATTEMPTS if idempotent else 1
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+        try:
+            response = get_session().request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == attempts - 1:
+                raise
+            continue
+        if response.status_code not in RETRY_STATUSES or attempt == attempts - 1:
+            return response
+        response.close()
@@ -0,0 +1,109 @@
+import sqlite3
+import threading
+
+import wire_codec
+
+
+class LocalCache:
+    """客户端本地的 SQLite 缓存，保存列表中的记录及其对应的服务器修订号
+
+    启动时先用缓存显示列表，再从该修订号增量同步。按问题单号分页加载的页依次写入，同时记下下一页的游标；
+    没加载完就退出时，下次启动先显示已缓存的页，再从该游标继续分页。增量同步衔接不上时清空缓存。
+    另外保存离线期间排队的写操作，按写入顺序重放。
+    可以在工作线程和 GUI 线程中同时调用。
+    """
+
+    def __init__(self, path, server_url):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS rn_records '
+                               '(issue_number TEXT PRIMARY KEY, record TEXT NOT NULL)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS pending_writes '
+                               '(id INTEGER PRIMARY KEY AUTOINCREMENT, operation TEXT NOT NULL)')
+        # 缓存属于哪个服务器，换了服务器地址则清空；排队的写操作是发给原服务器的，一并丢弃
+        if self._get_meta('server_url') != server_url:
+            self.clear()
+            with self._lock, self._conn:
+                self._conn.execute('DELETE FROM pending_writes')
+                self._set_meta('server_url', server_url)
+
+    def load_rn_records(self):
+        """返回 (修订号, 按问题单号排序的记录列表, 下一页的游标)，全部加载过时游标为 None；没有缓存时返回 None"""
+        with self._lock:
+            meta = dict(self._conn.execute('SELECT key, value FROM meta'))
+            if 'rn_revision' not in meta or 'rn_cursor' not in meta:
+                return None
+            rows = self._conn.execute('SELECT record FROM rn_records ORDER BY issue_number').fetchall()
+        return int(meta['rn_revision']), [wire_codec.loads(record) for record, in rows], meta['rn_cursor'] or None
+
+    def add_rn_page(self, records, cursor, next_cursor, revision=None):
+        """写入按问题单号分页加载的一页；cursor 为 None 表示第一页，先清空旧缓存并记下 revision
+
+        cursor 不是缓存记下的下一页游标时（中间缺页）不写入。
+        """
+        with self._lock, self._conn:
+            if cursor is None:
+                self._conn.execute('DELETE FROM rn_records')
+                self._set_meta('rn_revision', str(revision))
+            elif self._get_meta('rn_cursor') != cursor:
+                return
+            self._upsert(records)
+            self._set_meta('rn_cursor', next_cursor or '')
+
+    def apply_rn_changes(self, since, revision, changes):
+        """应用修订号 since 之后的变更日志；缓存的修订号不是 since 时无法衔接，清空缓存"""
+        with self._lock, self._conn:
+            if self._get_meta('rn_revision') != str(since):
+                self._clear_rn_records()
+                return
+            for change in changes:
+                operation = change.get('operation')
+                if operation in ('delete', 'update_with_rename'):
+                    key = change.get('issue_number') if operation == 'delete' else change.get('old_issue_number')
+                    self._conn.execute('DELETE FROM rn_records WHERE issue_number = ?', (key,))
+                if operation in ('post', 'update', 'update_with_rename') and change.get('rn_record'):
+                    self._upsert([change['rn_record']])
+            self._set_meta('rn_revision', str(revision))
+
+    def add_pending_write(self, operation):
+        """把一个 /rn_records/batch 格式的操作追加到离线队列末尾"""
+        with self._lock, self._conn:
+            self._conn.execute('INSERT INTO pending_writes (operation) VALUES (?)', (wire_codec.dumps(operation),))
+
+    def pending_writes(self, limit=-1):
+        """按写入顺序返回 [(id, 操作)]"""
+        with self._lock:
+            rows = self._conn.execute('SELECT id, operation FROM pending_writes ORDER BY id LIMIT ?',
+                                      (limit,)).fetchall()
+        return [(entry_id, wire_codec.loads(operation)) for entry_id, operation in rows]
+
+    def remove_pending_writes(self, ids):
+        with self._lock, self._conn:
+            self._conn.executemany('DELETE FROM pending_writes WHERE id = ?', [(entry_id,) for entry_id in ids])
+
+    def pending_write_count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM pending_writes').fetchone()[0]
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._clear_rn_records()
+
+    def _clear_rn_records(self):
+        self._conn.execute('DELETE FROM rn_records')
+        self._conn.execute("DELETE FROM meta WHERE key IN ('rn_revision', 'rn_cursor')")
+
+    def _upsert(self, records):
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO rn_records (issue_number, record) VALUES (?, ?)',
+            [(record['问题单号'], wire_codec.dumps(record)) for record in records if record.get('问题单号')]
+        )
+
+    def _get_meta(self, key):
+        row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
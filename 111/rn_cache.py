@@ -0,0 +1,197 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+import wire_codec
+
+
+class RecordCache:
+    """进程内的 rn_record 缓存，按 LRU 淘汰，缓存的 JSON 总字节数不超过 max_bytes
+
+    缓存 Redis 中存放的原始 JSON，命中时直接作为响应体返回；另外缓存一份全量记录的响应体及其修订号。
+    只有订阅 rn_channel 成功后才启用，订阅断开期间不读也不写缓存。
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.enabled = False
+        # 每次失效都加一；填充缓存前先记下它，读 Redis 期间若有失效则放弃写入，避免缓存并发修改前的旧值
+        self.generation = 0
+        self._records = OrderedDict()
+        self._size = 0
+        self._snapshot = None
+        # 同一时刻只允许一个请求收集全量快照，其余冷请求直接转发，避免每个请求各缓冲 max_bytes
+        self._building_snapshot = False
+        self._lock = threading.Lock()
+
+    def get(self, issue_number):
+        with self._lock:
+            data = self._records.get(issue_number)
+            if data is not None:
+                self._records.move_to_end(issue_number)
+            return data
+
+    def put(self, issue_number, data, generation):
+        with self._lock:
+            if not self.enabled or generation != self.generation or len(data) > self.max_bytes:
+                return
+            old_data = self._records.pop(issue_number, None)
+            if old_data is not None:
+                self._size -= len(old_data)
+            self._records[issue_number] = data
+            self._size += len(data)
+            self._evict()
+
+    def get_snapshot(self):
+        """返回 (revision, 全部记录的 JSON)，没有缓存时返回 None"""
+        with self._lock:
+            return self._snapshot
+
+    def put_snapshot(self, revision, body, generation):
+        with self._lock:
+            if not self.enabled or generation != self.generation or len(body) > self.max_bytes:
+                return
+            self._snapshot = (revision, body)
+            self._evict()
+
+    def tee_snapshot(self, revision, chunks, generation):
+        """原样转发流式响应的分块，同时收集不超过 max_bytes 的部分，完整时存为全量快照
+
+        已有其他请求在收集时只转发不收集；请求中途断开时释放收集权，下一个冷请求重新收集。
+        """
+        if not self._claim_snapshot():
+            yield from chunks
+            return
+        try:
+            collected, size = [], 0
+            for chunk in chunks:
+                if collected is not None:
+                    size += len(chunk)
+                    if size <= self.max_bytes:
+                        collected.append(chunk)
+                    else:
+                        collected = None
+                yield chunk
+            if collected is not None:
+                self.put_snapshot(revision, b''.join(collected), generation)
+        finally:
+            self._release_snapshot()
+
+    async def tee_snapshot_async(self, revision, chunks, generation):
+        """tee_snapshot 的 asyncio 版本，chunks 为异步迭代器"""
+        if not self._claim_snapshot():
+            async for chunk in chunks:
+                yield chunk
+            return
+        try:
+            collected, size = [], 0
+            async for chunk in chunks:
+                if collected is not None:
+                    size += len(chunk)
+                    if size <= self.max_bytes:
+                        collected.append(chunk)
+                    else:
+                        collected = None
+                yield chunk
+            if collected is not None:
+                self.put_snapshot(revision, b''.join(collected), generation)
+        finally:
+            self._release_snapshot()
+
+    def _claim_snapshot(self):
+        """取得收集全量快照的权利，已有其他请求在收集时返回 False"""
+        with self._lock:
+            building, self._building_snapshot = self._building_snapshot, True
+        return not building
+
+    def _release_snapshot(self):
+        with self._lock:
+            self._building_snapshot = False
+
+    def invalidate(self, *issue_numbers):
+        """使指定记录和全量快照失效"""
+        with self._lock:
+            self.generation += 1
+            self._snapshot = None
+            for issue_number in issue_numbers:
+                data = self._records.pop(issue_number, None)
+                if data is not None:
+                    self._size -= len(data)
+
+    def reset(self, enabled):
+        """清空缓存，并按订阅状态启用或停用"""
+        with self._lock:
+            self.generation += 1
+            self._records.clear()
+            self._size = 0
+            self._snapshot = None
+            self.enabled = enabled
+
+    def _evict(self):
+        limit = self.max_bytes - (len(self._snapshot[1]) if self._snapshot else 0)
+        while self._size > limit and self._records:
+            _, data = self._records.popitem(last=False)
+            self._size -= len(data)
+
+
+def start_invalidation_listener(redis_client, cache, channel='rn_channel', retry_interval=1):
+    """在后台线程订阅 rn_channel，按其他 worker 广播的变更使缓存失效
+
+    收到订阅确认后才启用缓存；连接断开时清空并停用缓存，重连成功后再启用，不会漏掉断线期间的变更。
+    """
+    def listen():
+        while True:
+            pubsub = redis_client.pubsub()
+            try:
+                pubsub.subscribe(channel)
+                for message in pubsub.listen():
+                    apply_invalidation(cache, message)
+            except redis.RedisError as e:
+                print(f"rn_channel subscription lost: {e}")
+            finally:
+                cache.reset(enabled=False)
+                pubsub.close()
+            time.sleep(retry_interval)
+
+    thread = threading.Thread(target=listen, name='rn-cache-invalidation', daemon=True)
+    thread.start()
+    return thread
+
+
+async def listen_invalidations(redis_client, cache, channel='rn_channel', retry_interval=1):
+    """start_invalidation_listener 的 asyncio 版本，作为后台任务运行直到被取消"""
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(channel)
+            async for message in pubsub.listen():
+                apply_invalidation(cache, message)
+        except redis.RedisError as e:
+            print(f"rn_channel subscription lost: {e}")
+        finally:
+            cache.reset(enabled=False)
+            await pubsub.aclose()
+        await asyncio.sleep(retry_interval)
+
+
+def apply_invalidation(cache, message):
+    """按 rn_channel 上的一条 pubsub 消息使缓存失效；收到订阅确认时启用缓存"""
+    if message['type'] == 'subscribe':
+        cache.reset(enabled=True)
+        return
+    if message['type'] != 'message':
+        return
+    try:
+        data = wire_codec.loads(message['data'])
+    except ValueError:
+        # 无法解析的消息无法确定影响范围，整体清空
+        cache.reset(enabled=True)
+        return
+    if data.get('operation') in ('post', 'update', 'update_with_rename', 'delete'):
+        cache.invalidate(data.get('issue_number'), data.get('new_issue_number'), data.get('old_issue_number'))
+    elif data.get('operation') == 'batch':
+        cache.invalidate(*data.get('issue_numbers', []))
+    else:
+        cache.reset(enabled=True)
@@ -1,62 +1,259 @@
+import threading
+import time
+from collections import OrderedDict
+
+import http_session
+from local_cache import LocalCache
 import requests
-from PySide6.QtWidgets import QMessageBox
+import wire_codec
+
+PERMISSION_CACHE_TTL = 300  # 权限检查结果的缓存秒数
+FULL_RECORD_CACHE_SIZE = 50  # 按需获取的完整记录最多缓存条数
+REPLAY_BATCH_SIZE = 100  # 重放离线队列时每个批量请求包含的操作数
+# 方法在工作线程中调用，不能弹窗；没有权限时返回此结果，由界面提示
+PERMISSION_DENIED = {"status": "error", "error": "您没有权限执行此操作"}
+PERMISSION_UNKNOWN = {"status": "error", "error": "无法连接服务器确认权限，请稍后重试"}
 
 class RN_Client:
-    def __init__(self, server_url, client_id, username):
+    def __init__(self, server_url, client_id, username, cache_path=None):
         self.server_url = server_url
         self.client_id = client_id  # 使用传入的client_id
         self.username = username
+        # 可选的本地 SQLite 缓存，分页加载和增量同步的结果都会写入，启动时先用它显示列表
+        self.local_cache = LocalCache(cache_path, server_url) if cache_path else None
+        self.revision = None  # 本地数据对应的服务器修订号，用于增量同步
+        self._records_etag = None  # 上次全量记录的 ETag 及本地副本，用于条件请求
+        self._records_cache = []
+        self._permission_cache = None  # (是否有权限, 过期时间)
+        self._full_records = OrderedDict()  # 问题单号 -> 完整记录，LRU
+        self._full_records_lock = threading.Lock()  # 工作线程读取、GUI 线程失效
+        self._replay_lock = threading.Lock()  # 同一时间只有一个线程重放离线队列
+
+    def invalidate_permissions(self, usernames=None):
+        """收到 user_updates 广播时调用，涉及当前用户则丢弃权限缓存"""
+        if usernames is None or self.username in usernames:
+            self._permission_cache = None
 
     def check_permissions(self):
-        """向服务器请求权限"""
-        return True
+        """向服务器请求权限，结果缓存 PERMISSION_CACHE_TTL 秒，写操作前无需每次请求
+
+        连不上服务器时沿用上次获取的结果（即使已过期），以便离线时继续排队写操作；从未获取过时返回 None。
+        """
+        if self._permission_cache is not None and self._permission_cache[1] > time.monotonic():
+            return self._permission_cache[0]
         try:
-            response = requests.post(
+            response = http_session.request(
+                'POST',
                 f"{self.server_url}/get_permissions",
+                idempotent=True,
                 json={'username': self.username}  # 使用 POST 请求，参数放在请求体中
             )
             response.raise_for_status()
-            result = response.json()
-            if result['status'] == 'success' and result['permissions'] == 1:
-                return True
-            else:
-                return False
-        except requests.RequestException as e:
+            result = wire_codec.loads(response.content)
+            allowed = result['status'] == 'success' and result['permissions'] == 1
+            self._permission_cache = (allowed, time.monotonic() + PERMISSION_CACHE_TTL)
+            return allowed
+        except (requests.RequestException, ValueError) as e:
             print(f"Error checking permissions: {e}")
-            return False
+            return self._permission_cache[0] if self._permission_cache is not None else None
+
+    def _permission_error(self):
+        """写操作前检查权限：有权限时返回 None，否则返回交给界面提示的错误结果"""
+        allowed = self.check_permissions()
+        if allowed is None:
+            return dict(PERMISSION_UNKNOWN)
+        return None if allowed else dict(PERMISSION_DENIED)
 
     def get_all_rn_records(self):
+        headers = {'If-None-Match': self._records_etag} if self._records_etag else {}
         try:
-            response = requests.get(
+            response = http_session.request(
+                'GET',
                 f"{self.server_url}/get_all_rn_records",
+                idempotent=True,
                 json={'client_id': self.client_id},  # 使用 GET 请求，参数放在请求体中
-                timeout=10
+                headers=headers
             )
             response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
+            revision = response.headers.get('X-RN-Revision')
+            self.revision = int(revision) if revision is not None else None
+            if response.status_code == 304:
+                # 服务器数据未变化，直接使用本地副本
+                return self._records_cache
+            self._records_cache = wire_codec.loads(response.content)
+            self._records_etag = response.headers.get('ETag')
+            return self._records_cache
+        except (requests.RequestException, ValueError) as e:
             print(f"Error fetching RN records: {e}")
             return []
 
+    def get_rn_records_page(self, cursor=None, limit=200, sort='issue_number', fields=None):
+        """分页获取记录，返回 {'records', 'next_cursor', 'total', 'revision'}；第一页的修订号作为增量同步的起点
+
+        fields 为字段名列表时只返回这些字段（始终包含问题单号），完整记录用 get_full_rn_record 按需获取。
+        """
+        params = {'limit': limit, 'sort': sort}
+        if cursor:
+            params['cursor'] = cursor
+        if fields:
+            params['fields'] = ','.join(fields)
+        try:
+            response = http_session.request('GET', f"{self.server_url}/get_all_rn_records",
+                                            idempotent=True, params=params)
+            response.raise_for_status()
+            page = wire_codec.loads(response.content)
+            if cursor is None:
+                self.revision = page.get('revision')
+            if self.local_cache is not None and sort == 'issue_number':
+                # 本地缓存按问题单号排序，只缓存同一顺序的分页
+                self.local_cache.add_rn_page(page['records'], cursor, page.get('next_cursor'), page.get('revision'))
+            return page
+        except (requests.RequestException, ValueError) as e:
+            print(f"Error fetching RN records page: {e}")
+            return None
+
+    def get_rn_changes(self, since):
+        """获取修订号 since 之后的变更日志"""
+        try:
+            response = http_session.request(
+                'GET',
+                f"{self.server_url}/rn_changes",
+                idempotent=True,
+                params={'since': since}
+            )
+            response.raise_for_status()
+            result = wire_codec.loads(response.content)
+            if self.local_cache is not None and not result.get('reset'):
+                self.local_cache.apply_rn_changes(since, result['revision'], result.get('changes', []))
+            return result
+        except (requests.RequestException, ValueError) as e:
+            print(f"Error fetching RN changes since {since}: {e}")
+            return None
+
+    def load_cached_rn_records(self):
+        """读取本地缓存的列表并以其修订号作为增量同步的起点，返回 (记录列表, 下一页的游标)；没有可用缓存时返回 None
+
+        游标不为 None 表示上次没有加载完，从该游标继续分页即可补齐。
+        """
+        cached = self.local_cache.load_rn_records() if self.local_cache is not None else None
+        if cached is None:
+            return None
+        self.revision, records, next_cursor = cached
+        return records, next_cursor
+
+    def record_broadcast_change(self, revision, change):
+        """广播恰好是下一个修订号时，不再请求变更日志，直接推进修订号并写入本地缓存"""
+        if self.local_cache is not None:
+            self.local_cache.apply_rn_changes(self.revision, revision, [change])
+        self.revision = revision
+
+    def search_rn_records(self, filters, fields=None):
+        """在服务器端按 [key=value] / {key=value} / 关键字 条件搜索，只返回命中的记录；fields 同 get_rn_records_page"""
+        request_data = {'filters': filters, 'client_id': self.client_id}
+        if fields:
+            request_data['fields'] = list(fields)
+        try:
+            response = http_session.request(
+                'POST',
+                f"{self.server_url}/search_rn_records",
+                idempotent=True,
+                json=request_data
+            )
+            response.raise_for_status()
+            return wire_codec.loads(response.content)
+        except (requests.RequestException, ValueError) as e:
+            print(f"Error searching RN records: {e}")
+            return []
+
+    def export_rn_records(self, path):
+        """把服务器上的全部记录以 NDJSON 流式下载到 path，返回写入的记录数"""
+        try:
+            with http_session.request('GET', f"{self.server_url}/rn_records/export", idempotent=True,
+                                      timeout=http_session.TRANSFER_TIMEOUT, stream=True) as response:
+                response.raise_for_status()
+                count = 0
+                with open(path, 'wb') as f:
+                    for line in response.iter_lines():
+                        if line:
+                            f.write(line + b'\n')
+                            count += 1
+                return count
+        except (requests.RequestException, OSError) as e:
+            print(f"Error exporting RN records: {e}")
+            return None
+
+    def import_rn_records(self, path, progress_callback=None):
+        """把 NDJSON 文件流式上传导入，每批写入后以 {'imported', 'failed'} 调用 progress_callback，返回汇总结果"""
+        try:
+            with open(path, 'rb') as f:
+                with http_session.request(
+                    'POST',
+                    f"{self.server_url}/rn_records/import",
+                    timeout=http_session.TRANSFER_TIMEOUT,
+                    params={'client_id': self.client_id, 'username': self.username},
+                    data=f,
+                    headers={'Content-Type': 'application/x-ndjson'},
+                    stream=True
+                ) as response:
+                    response.raise_for_status()
+                    result = None
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        result = wire_codec.loads(line)
+                        if 'status' not in result and progress_callback:
+                            progress_callback(result)
+                    return result
+        except (requests.RequestException, OSError, ValueError) as e:
+            print(f"Error importing RN records: {e}")
+            return None
+
     def get_rn_record(self, issue_number):
         try:
-            response = requests.post(
+            response = http_session.request(
+                'GET',
                 f"{self.server_url}/get_rn_record_by_issue_number",
-                json={
-                    'issue_number': issue_number,  # 使用 POST 请求，参数放在请求体中
-                    'client_id': self.client_id  # 添加 client_id
-                }
+                idempotent=True,
+                params={'issue_number': issue_number}
             )
             response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
+            return wire_codec.loads(response.content)
+        except (requests.RequestException, ValueError) as e:
             print(f"Error fetching RN record with issue number {issue_number}: {e}")
             return None
 
-    def save_rn_record(self, record_data, old_issue_number=None):
-        if not self.check_permissions():
-            QMessageBox.warning(None, "权限错误", "您没有权限执行此操作")
-            return None
+    def get_full_rn_record(self, issue_number):
+        """获取完整记录，优先使用本地缓存；列表只加载了摘要字段，查看和编辑时调用"""
+        with self._full_records_lock:
+            record = self._full_records.get(issue_number)
+            if record is not None:
+                self._full_records.move_to_end(issue_number)
+                return record
+        record = self.get_rn_record(issue_number)
+        if record is not None:
+            with self._full_records_lock:
+                self._full_records[issue_number] = record
+                if len(self._full_records) > FULL_RECORD_CACHE_SIZE:
+                    self._full_records.popitem(last=False)
+        return record
+
+    def forget_rn_record(self, *issue_numbers):
+        """记录被修改或删除后使本地完整记录缓存失效，不传问题单号时全部清空"""
+        with self._full_records_lock:
+            if not issue_numbers:
+                self._full_records.clear()
+            for issue_number in issue_numbers:
+                self._full_records.pop(issue_number, None)
+
+    def save_rn_record(self, record_data, old_issue_number=None, base_version=None):
+        """保存记录；base_version 为修改所基于的记录版本（新建为 0），与服务器不符时返回 status 为 conflict 的结果
+
+        连不上服务器或离线队列中还有未提交的操作时，写入离线队列并返回 {'status': 'queued', 'change'}，
+        change 为变更日志格式的乐观更新，界面可以先应用它。
+        """
+        error = self._permission_error()
+        if error:
+            return error
 
         try:
             issue_number = record_data.get('问题单号')
@@ -67,46 +264,222 @@ class RN_Client:
             record_data['username'] = self.username
             record_data['issue_number'] = issue_number
 
-            if old_issue_number:
-                record_data['old_issue_number'] = old_issue_number
+            self.forget_rn_record(issue_number, old_issue_number)
+            operation = self._save_operation(dict(record_data), old_issue_number, base_version)
+            if self.pending_write_count():
+                # 排在离线队列之后，保证写操作按顺序到达服务器
+                return self._queue_write(operation)
 
-            response = requests.post(f"{self.server_url}/save_rn_record", json=record_data)
+            payload = dict(record_data)
+            if old_issue_number:
+                payload['old_issue_number'] = old_issue_number
+            if base_version is not None:
+                payload['base_version'] = base_version
+            try:
+                response = http_session.request('POST', f"{self.server_url}/save_rn_record",
+                                                timeout=http_session.WRITE_TIMEOUT, json=payload)
+            except requests.ConnectionError:
+                if self.local_cache is None:
+                    raise
+                return self._queue_write(operation)
+            if response.status_code == 409:
+                return wire_codec.loads(response.content)
             response.raise_for_status()
-            return response.json()
+            return wire_codec.loads(response.content)
         except (requests.RequestException, ValueError) as e:
             print(f"Error saving RN record: {e}")
             if hasattr(e, 'response') and e.response is not None:
                 print(f"Response content: {e.response.content}")
             return None
 
-    def delete_rn_record(self, issue_number):
-        if not self.check_permissions():
-            QMessageBox.warning(None, "权限错误", "您没有权限执行此操作")
+    def delete_rn_record(self, issue_number, base_version=None):
+        """删除记录；base_version 和离线时的处理同 save_rn_record"""
+        error = self._permission_error()
+        if error:
+            return error
+
+        self.forget_rn_record(issue_number)
+        operation = {'op': 'delete', 'issue_number': issue_number}
+        if base_version is not None:
+            operation['base_version'] = base_version
+        if self.pending_write_count():
+            return self._queue_write(operation)
+        try:
+            try:
+                response = http_session.request(
+                    'DELETE',
+                    f"{self.server_url}/delete_rn_record",
+                    timeout=http_session.WRITE_TIMEOUT,
+                    json={
+                        'issue_number': issue_number,  # 参数放在请求体中
+                        'client_id': self.client_id,  # 添加 client_id
+                        'username': self.username,  # 添加 username
+                        'base_version': base_version
+                    }
+                )
+            except requests.ConnectionError:
+                if self.local_cache is None:
+                    raise
+                return self._queue_write(operation)
+            if response.status_code == 409:
+                return wire_codec.loads(response.content)
+            response.raise_for_status()
+            return wire_codec.loads(response.content)
+        except (requests.RequestException, ValueError) as e:
+            print(f"Error deleting RN record with issue number {issue_number}: {e}")
             return None
 
+    def batch_rn_records(self, saves=(), deletes=()):
+        """一次请求提交多条保存和删除，服务器在一个事务中执行并只广播一次
+
+        saves 为记录列表，需要改名的记录可带 'old_issue_number'；deletes 为问题单号列表。
+        """
+        error = self._permission_error()
+        if error:
+            return error
+
+        operations = []
+        for record_data in saves:
+            record = dict(record_data)
+            operations.append(self._save_operation(record, record.pop('old_issue_number', None),
+                                                   record.pop('base_version', None)))
+        operations.extend({'op': 'delete', 'issue_number': issue_number} for issue_number in deletes)
+        for operation in operations:
+            issue_number = operation.get('issue_number') or operation['record']['issue_number']
+            self.forget_rn_record(issue_number, operation.get('old_issue_number'))
+
         try:
-            response = requests.delete(
-                f"{self.server_url}/delete_rn_record",
-                json={
-                    'issue_number': issue_number,  # 参数放在请求体中
-                    'client_id': self.client_id,  # 添加 client_id
-                    'username': self.username  # 添加 username
-                }
+            response = http_session.request(
+                'POST',
+                f"{self.server_url}/rn_records/batch",
+                timeout=http_session.WRITE_TIMEOUT,
+                json={'operations': operations, 'client_id': self.client_id, 'username': self.username}
             )
             response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
-            print(f"Error deleting RN record with issue number {issue_number}: {e}")
+            return wire_codec.loads(response.content)
+        except (requests.RequestException, ValueError) as e:
+            print(f"Error applying RN batch: {e}")
+            if hasattr(e, 'response') and e.response is not None:
+                print(f"Response content: {e.response.content}")
             return None
 
+    def pending_write_count(self):
+        return self.local_cache.pending_write_count() if self.local_cache is not None else 0
+
+    def pending_changes(self):
+        """离线队列中的操作按变更日志的格式返回，启动时用于在缓存的列表上显示未提交的修改"""
+        if self.local_cache is None:
+            return []
+        return [self._optimistic_change(operation) for _, operation in self.local_cache.pending_writes()]
+
+    def replay_pending_writes(self):
+        """按顺序把离线队列合并为批量请求重放，每批最多 REPLAY_BATCH_SIZE 个操作
+
+        服务器整批回滚并指出失败的操作（版本冲突或记录已不存在）时，把该操作移出队列放入 conflicts，
+        其余操作继续重放；仍连不上服务器时保留队列等待下次重放。
+        返回 {'applied', 'conflicts': [{'operation', 'current', 'error', 'records'}], 'remaining'}，
+        records 为该操作涉及的问题单号（改名时包括旧单号）重放结束时在服务器上的记录，已不存在时为 None，用于恢复界面；
+        已有其他线程在重放时返回 None。
+        """
+        if self.local_cache is None or not self._replay_lock.acquire(blocking=False):
+            return None
+        applied, conflicts = 0, []
+        try:
+            while True:
+                entries = self.local_cache.pending_writes(REPLAY_BATCH_SIZE)
+                if not entries:
+                    break
+                try:
+                    response = http_session.request(
+                        'POST',
+                        f"{self.server_url}/rn_records/batch",
+                        timeout=http_session.WRITE_TIMEOUT,
+                        json={'operations': [operation for _, operation in entries],
+                              'client_id': self.client_id, 'username': self.username}
+                    )
+                    result = wire_codec.loads(response.content)
+                except (requests.RequestException, ValueError) as e:
+                    print(f"Error replaying pending RN writes: {e}")
+                    break
+                if response.status_code == 200:
+                    self.local_cache.remove_pending_writes([entry_id for entry_id, _ in entries])
+                    applied += len(entries)
+                elif response.status_code in (404, 409) and result.get('index') is not None:
+                    entry_id, operation = entries[result['index']]
+                    self.local_cache.remove_pending_writes([entry_id])
+                    conflicts.append({'operation': operation, 'current': result.get('current'),
+                                      'error': result.get('details') or result.get('error')})
+                else:
+                    # 写冲突重试次数用尽或服务器出错，下次再试
+                    print(f"Error replaying pending RN writes: {result}")
+                    break
+            # 其余操作重放完后再读取，得到的是服务器上的最终状态
+            for conflict in conflicts:
+                conflict['records'] = self._server_records(self._operation_keys(conflict['operation']))
+        finally:
+            self._replay_lock.release()
+        return {'applied': applied, 'conflicts': conflicts, 'remaining': self.local_cache.pending_write_count()}
+
+    @staticmethod
+    def _operation_keys(operation):
+        if operation['op'] == 'delete':
+            return [operation['issue_number']]
+        issue_number = operation['record']['问题单号']
+        old_issue_number = operation.get('old_issue_number')
+        return [issue_number] + ([old_issue_number] if old_issue_number and old_issue_number != issue_number else [])
+
+    def _server_records(self, issue_numbers):
+        """返回 {问题单号: 服务器上的记录，已不存在时为 None}；请求失败的问题单号不在结果中"""
+        records = {}
+        for issue_number in issue_numbers:
+            self.forget_rn_record(issue_number)
+            try:
+                response = http_session.request('GET', f"{self.server_url}/get_rn_record_by_issue_number",
+                                                idempotent=True, params={'issue_number': issue_number})
+                if response.status_code == 404:
+                    records[issue_number] = None
+                    continue
+                response.raise_for_status()
+                records[issue_number] = wire_codec.loads(response.content)
+            except (requests.RequestException, ValueError) as e:
+                print(f"Error fetching RN record with issue number {issue_number}: {e}")
+        return records
+
+    def _save_operation(self, record, old_issue_number=None, base_version=None):
+        operation = {'op': 'save', 'record': record}
+        if old_issue_number:
+            operation['old_issue_number'] = old_issue_number
+        if base_version is not None:
+            operation['base_version'] = base_version
+        return operation
+
+    def _queue_write(self, operation):
+        self.local_cache.add_pending_write(operation)
+        return {"status": "queued", "change": self._optimistic_change(operation)}
+
+    @staticmethod
+    def _optimistic_change(operation):
+        """把离线队列中的操作转换成变更日志的格式，版本号按服务器规则加一，界面据此先显示修改"""
+        if operation['op'] == 'delete':
+            return {'operation': 'delete', 'issue_number': operation['issue_number']}
+        record = dict(operation['record'])
+        if 'base_version' in operation:
+            record['version'] = operation['base_version'] + 1
+        old_issue_number = operation.get('old_issue_number')
+        renamed = bool(old_issue_number) and old_issue_number != record['问题单号']
+        return {'operation': 'update_with_rename' if renamed else 'update', 'issue_number': record['问题单号'],
+                'old_issue_number': old_issue_number, 'rn_record': record}
+
     def check_issue_number_exists(self, issue_number):
         try:
-            response = requests.post(
+            response = http_session.request(
+                'POST',
                 f"{self.server_url}/rn_record_exists",
+                idempotent=True,
                 json={'issue_number': issue_number}  # 使用 POST 请求，参数放在请求体中
             )
             response.raise_for_status()
-            return response.json().get('exists', False)
-        except requests.RequestException as e:
+            return wire_codec.loads(response.content).get('exists', False)
+        except (requests.RequestException, ValueError) as e:
             print(f"Error checking if issue number exists: {e}")
             return False
@@ -0,0 +1,222 @@
+"""Flask 版（server.py）与 ASGI 版（async_server.py）服务端共用的常量、JSON 序列化和与 Redis 无关的辅助函数"""
+import os
+
+import wire_codec
+from flask.json.provider import DefaultJSONProvider
+from rn_search import unescape_filter_value
+from rn_index import RN_INDEXED_FIELDS, index_key
+from rn_fulltext import gram_key, query_grams
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """不排序键、不转义中文，可用时交给 orjson 序列化响应"""
+    ensure_ascii = False
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if wire_codec.orjson is not None and not kwargs:
+            return wire_codec.dumps(obj)
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if wire_codec.orjson is not None and not kwargs:
+            return wire_codec.loads(s)
+        return super().loads(s, **kwargs)
+
+
+# 批量读取 rn_record 时每批 SCAN/MGET 的键数量
+RN_FETCH_BATCH_SIZE = int(os.environ.get('RN_FETCH_BATCH_SIZE', 500))
+
+# 乐观事务（WATCH/MULTI）因并发修改失败时的最大重试次数
+RN_WRITE_RETRIES = 5
+
+# 响应体不小于该字节数时才按 Accept-Encoding 压缩
+RESPONSE_COMPRESS_MIN_SIZE = int(os.environ.get('RESPONSE_COMPRESS_MIN_SIZE', 1024))
+
+# 变更日志 Stream 的近似长度上限，以及 /rn_changes 单次最多返回的条数
+RN_CHANGELOG_MAXLEN = int(os.environ.get('RN_CHANGELOG_MAXLEN', 10000))
+RN_CHANGES_PAGE_SIZE = 1000
+
+# NDJSON 批量导入时每个事务写入的记录数
+RN_IMPORT_BATCH_SIZE = int(os.environ.get('RN_IMPORT_BATCH_SIZE', 500))
+
+# 分页列表每页的默认与最大条数
+RN_PAGE_DEFAULT_LIMIT = 200
+RN_PAGE_MAX_LIMIT = 1000
+
+# /rn_records/batch 单次最多包含的操作数
+RN_BATCH_MAX_OPERATIONS = 1000
+BATCH_OPERATION_NAMES = {'post': '新增', 'update': '修改', 'update_with_rename': '改名', 'delete': '删除'}
+RN_CONFLICT_MESSAGE = "记录已被其他用户修改"
+RN_RENAME_EXISTS_MESSAGE = "新的问题单号已存在"
+
+# 修订号自增与变更日志追加放在同一个脚本里，保证 Stream ID（<rev>-0）严格递增
+APPEND_RN_CHANGE_LUA = """
+local revision = redis.call('INCR', KEYS[1])
+redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[1], revision .. '-0',
+           'operation', ARGV[2], 'issue_number', ARGV[3], 'old_issue_number', ARGV[4], 'rn_record', ARGV[5])
+return revision
+"""
+
+
+def parse_fields(fields):
+    """解析 fields 投影参数（逗号分隔的字符串或列表），始终包含问题单号；未指定时返回 None"""
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    fields = [field.strip() for field in fields or [] if field and field.strip()]
+    if not fields:
+        return None
+    return ['问题单号'] + [field for field in dict.fromkeys(fields) if field != '问题单号']
+
+
+def project_record(record, fields):
+    return {field: record[field] for field in fields if field in record}
+
+
+class BatchOperationError(LookupError):
+    """批量操作中第 index 个操作无法执行：记录不存在，或 conflict 为 True 时记录版本与 base_version 不符"""
+
+    def __init__(self, message, index, current=None, conflict=False):
+        super().__init__(message)
+        self.index = index
+        self.current = current
+        self.conflict = conflict
+
+
+def record_version(record):
+    """记录的版本号，每次写入加一；不存在的记录为 0，引入版本号之前写入的记录视为 1"""
+    return 0 if record is None else record.get('version', 1)
+
+
+def batch_operation_keys(operations):
+    """校验批量操作的格式，返回涉及的全部问题单号；格式错误时抛出 ValueError"""
+    issue_numbers = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise ValueError(f"第 {index} 个操作格式错误")
+        if operation.get('op') == 'save':
+            record = operation.get('record')
+            if not isinstance(record, dict) or not record.get('issue_number'):
+                raise ValueError(f"第 {index} 个操作缺少 record.issue_number")
+            issue_numbers.append(record['issue_number'])
+            if operation.get('old_issue_number'):
+                issue_numbers.append(operation['old_issue_number'])
+        elif operation.get('op') == 'delete':
+            if not operation.get('issue_number'):
+                raise ValueError(f"第 {index} 个操作缺少 issue_number")
+            issue_numbers.append(operation['issue_number'])
+        else:
+            raise ValueError(f"第 {index} 个操作类型未知: {operation.get('op')}")
+    return list(dict.fromkeys(issue_numbers))
+
+
+def plan_rn_batch(operations, current):
+    """按顺序模拟批量操作，current 为 {问题单号: 记录或 None}，会被就地更新
+
+    返回 [(operation, issue_number, old_issue_number, old_record, new_record)]；
+    改名或删除的记录不存在、改名的目标已存在、或操作带的 base_version 与记录当前版本不符时抛出 BatchOperationError。
+    """
+    changes = []
+    for index, operation in enumerate(operations):
+        base_version = operation.get('base_version')
+        if operation['op'] == 'delete':
+            issue_number = operation['issue_number']
+            old_record = current.get(issue_number)
+            if old_record is None:
+                raise BatchOperationError(f"第 {index} 个操作：问题单号 {issue_number} 不存在", index)
+            if base_version is not None and record_version(old_record) != base_version:
+                raise BatchOperationError(f"第 {index} 个操作：问题单号 {issue_number} {RN_CONFLICT_MESSAGE}",
+                                          index, old_record, conflict=True)
+            changes.append(('delete', issue_number, None, old_record, None))
+            current[issue_number] = None
+            continue
+
+        record = operation['record']
+        issue_number = record['issue_number']
+        source_issue_number = operation.get('old_issue_number') or issue_number
+        old_record = current.get(source_issue_number)
+        if operation.get('old_issue_number') and old_record is None:
+            raise BatchOperationError(f"第 {index} 个操作：问题单号 {source_issue_number} 不存在", index)
+        if base_version is not None and record_version(old_record) != base_version:
+            raise BatchOperationError(f"第 {index} 个操作：问题单号 {source_issue_number} {RN_CONFLICT_MESSAGE}",
+                                      index, old_record, conflict=True)
+        if source_issue_number != issue_number and current.get(issue_number) is not None:
+            raise BatchOperationError(f"第 {index} 个操作：{RN_RENAME_EXISTS_MESSAGE} {issue_number}",
+                                      index, current[issue_number], conflict=True)
+        # 与 write_rn_record 一致地推进版本，同一批中对同一记录的后续操作据此比较
+        record['version'] = record_version(old_record) + 1
+        if old_record is None:
+            name = 'post'
+        elif source_issue_number != issue_number:
+            name = 'update_with_rename'
+        else:
+            name = 'update'
+        changes.append((name, issue_number, source_issue_number, old_record, record))
+        current[source_issue_number] = None
+        current[issue_number] = record
+    return changes
+
+
+def parse_import_line(line):
+    """解析 NDJSON 导入的一行，返回 (问题单号, 记录)；格式错误或缺少问题单号时抛出 ValueError"""
+    try:
+        record = wire_codec.loads(line)
+        issue_number = record.get('issue_number') or record.get('问题单号')
+    except (ValueError, AttributeError):
+        raise ValueError("格式错误")
+    if not issue_number:
+        raise ValueError("缺少问题单号")
+    record['issue_number'] = issue_number
+    return issue_number, record
+
+
+def import_message(client_id, username, imported, revision):
+    return {
+        'client_id': client_id,
+        'operation': 'import',
+        'count': imported,
+        'username': username,
+        'summary': f"批量导入了 {imported} 条记录。",
+        'revision': revision
+    }
+
+
+def rn_candidate_keys(filters):
+    """收集能缩小候选集的索引键：精确条件用字段索引，包含/关键字条件用覆盖全部字段的 n-gram 倒排索引"""
+    keys = []
+    for filter_type, filter_key, filter_value in filters:
+        value = unescape_filter_value(filter_value)
+        if filter_type == 'exact' and filter_key in RN_INDEXED_FIELDS:
+            keys.append(index_key(filter_key, value))
+        elif filter_type in ('free', 'contains'):
+            keys.extend(gram_key(gram) for gram in query_grams(value))
+    return keys
+
+
+def rn_compare_dictionaries(original, modified):
+    changes = []
+
+    keys_to_ignore = ['client_id','issue_number','version']
+
+    all_keys = set(original.keys()).union(modified.keys()).difference(keys_to_ignore)
+
+    for key in all_keys:
+        original_value = original.get(key, None)
+        modified_value = modified.get(key, None)
+
+        if original_value != modified_value:
+            if original_value is None:
+                changes.append(f"'{key}' 新增了值 '{modified_value}'。")
+            elif modified_value is None or modified_value == "":
+                changes.append(f"'{key}' 被删除，原来的值是 '{original_value}'。")
+            elif original_value == "":
+                changes.append(f"'{key}' 添加了值 '{modified_value}'。")
+            else:
+                changes.append(f"'{key}' 从 '{original_value}' 变为 '{modified_value}'。")
+
+    if changes:
+        summary = "检测到以下变化：\n" + "\n".join(changes)
+    else:
+        summary = "未检测到任何变化。"
+
+    return summary
@@ -0,0 +1,104 @@
+import re
+
+import wire_codec
+
+# n-gram 倒排索引覆盖记录的全部字段，与自由搜索逐字段匹配的范围一致；中文没有分词边界，按字符二元/三元组切分
+# 索引覆盖范围变化时递增版本号，启动时发现旧版本的索引会自动重建
+RN_FULLTEXT_SCHEMA = 2
+RN_FULLTEXT_SCHEMA_KEY = 'rn_fulltext_schema'
+RN_FULLTEXT_REBUILD_LOCK = 'rn_fulltext_rebuild_lock'
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def gram_key(gram):
+    return f'ftx:{gram}'
+
+
+def text_grams(text):
+    """返回文本中所有的二元组和三元组（不跨越空白）"""
+    grams = set()
+    for token in _WHITESPACE.split(str(text).lower()):
+        for n in (2, 3):
+            for i in range(len(token) - n + 1):
+                grams.add(token[i:i + n])
+    return grams
+
+
+def record_grams(record):
+    grams = set()
+    for value in record.values():
+        grams |= text_grams(value)
+    return grams
+
+
+def query_grams(term):
+    """查询词必须命中的 n-gram：长度不小于 3 的片段取三元组，长度为 2 的片段取二元组
+
+    单个字符无法用索引缩小范围，不产生任何 n-gram。
+    """
+    grams = set()
+    for token in _WHITESPACE.split(str(term).lower()):
+        n = 3 if len(token) >= 3 else 2
+        for i in range(len(token) - n + 1):
+            grams.add(token[i:i + n])
+    return grams
+
+
+def update_fulltext_index(pipe, issue_number, old_record=None, new_record=None, old_issue_number=None):
+    """增量维护倒排索引：只增删新旧记录之间有差异的 n-gram"""
+    old_issue_number = old_issue_number or issue_number
+    old_grams = record_grams(old_record) if old_record else set()
+    new_grams = record_grams(new_record) if new_record else set()
+
+    if old_issue_number != issue_number:
+        for gram in old_grams:
+            pipe.srem(gram_key(gram), old_issue_number)
+        for gram in new_grams:
+            pipe.sadd(gram_key(gram), issue_number)
+        return
+
+    for gram in old_grams - new_grams:
+        pipe.srem(gram_key(gram), issue_number)
+    for gram in new_grams - old_grams:
+        pipe.sadd(gram_key(gram), issue_number)
+
+
+def rebuild_fulltext_index(redis_client, batch_size=500):
+    """清空并根据现有 rn_record:* 重建倒排索引"""
+    pipe = redis_client.pipeline(transaction=False)
+    for key in redis_client.scan_iter(match='ftx:*', count=batch_size):
+        pipe.delete(key)
+    pipe.execute()
+
+    count = 0
+    keys = list(redis_client.scan_iter(match='rn_record:*', count=batch_size))
+    for start in range(0, len(keys), batch_size):
+        batch_keys = keys[start:start + batch_size]
+        for key, data in zip(batch_keys, redis_client.mget(batch_keys)):
+            if data is None:
+                continue
+            issue_number = key.decode('utf-8').split(':', 1)[1]
+            update_fulltext_index(pipe, issue_number, new_record=wire_codec.loads(data))
+            count += 1
+        pipe.execute()
+    redis_client.set(RN_FULLTEXT_SCHEMA_KEY, RN_FULLTEXT_SCHEMA)
+    return count
+
+
+def ensure_fulltext_index(redis_client, batch_size=500):
+    """已有记录但倒排索引是旧版本（或从未建立）时重建，返回重建的记录数，无需重建时返回 None
+
+    多个 worker 同时启动时只有取得锁的进程重建。
+    """
+    if int(redis_client.get(RN_FULLTEXT_SCHEMA_KEY) or 0) >= RN_FULLTEXT_SCHEMA:
+        return None
+    if next(redis_client.scan_iter(match='rn_record:*', count=batch_size), None) is None:
+        redis_client.set(RN_FULLTEXT_SCHEMA_KEY, RN_FULLTEXT_SCHEMA)
+        return None
+    if not redis_client.set(RN_FULLTEXT_REBUILD_LOCK, 1, nx=True, ex=600):
+        return None
+    try:
+        return rebuild_fulltext_index(redis_client, batch_size)
+    finally:
+        redis_client.delete(RN_FULLTEXT_REBUILD_LOCK)
@@ -0,0 +1,86 @@
+import time
+
+import wire_codec
+
+# 建立精确匹配二级索引的字段，索引键形如 idx:严重级别:严重，集合成员为问题单号
+RN_INDEXED_FIELDS = ['问题单号', '严重级别', '涉及制式', '涉及网元', '代码合入版本', 'RN呈现点', '写作人信息']
+
+# 分页列表的排序索引：按问题单号的有序集合分值全为 0，用 ZRANGEBYLEX 按字典序翻页；
+# 按最后修改时间的有序集合以写入时的时间戳为分值
+RN_SORT_ISSUE_NUMBER_KEY = 'rn_sort:issue_number'
+RN_SORT_MODIFIED_KEY = 'rn_sort:modified'
+RN_INDEX_REBUILD_LOCK = 'rn_index_rebuild_lock'
+
+
+def index_key(field, value):
+    return f'idx:{field}:{value}'
+
+
+def add_to_index(pipe, issue_number, record):
+    """把记录的索引字段写入对应的集合（在调用方的 pipeline 中执行）"""
+    for field in RN_INDEXED_FIELDS:
+        if field in record:
+            pipe.sadd(index_key(field, record[field]), issue_number)
+
+
+def remove_from_index(pipe, issue_number, record):
+    """从索引集合中移除旧记录，空集合由 Redis 自动删除"""
+    for field in RN_INDEXED_FIELDS:
+        if field in record:
+            pipe.srem(index_key(field, record[field]), issue_number)
+
+
+def add_to_sort_index(pipe, issue_number, modified=None):
+    pipe.zadd(RN_SORT_ISSUE_NUMBER_KEY, {issue_number: 0})
+    pipe.zadd(RN_SORT_MODIFIED_KEY, {issue_number: time.time() if modified is None else modified})
+
+
+def remove_from_sort_index(pipe, issue_number):
+    pipe.zrem(RN_SORT_ISSUE_NUMBER_KEY, issue_number)
+    pipe.zrem(RN_SORT_MODIFIED_KEY, issue_number)
+
+
+def rebuild_index(redis_client, batch_size=500):
+    """清空并根据现有 rn_record:* 重建全部二级索引和排序索引
+
+    最后修改时间无法从记录中恢复，已有的时间戳保留，缺失的记为 0（排在最早），记录已不存在的成员被移除。
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    for key in redis_client.scan_iter(match='idx:*', count=batch_size):
+        pipe.delete(key)
+    pipe.delete(RN_SORT_ISSUE_NUMBER_KEY)
+    pipe.execute()
+
+    count = 0
+    keys = list(redis_client.scan_iter(match='rn_record:*', count=batch_size))
+    for start in range(0, len(keys), batch_size):
+        batch_keys = keys[start:start + batch_size]
+        for key, data in zip(batch_keys, redis_client.mget(batch_keys)):
+            if data is None:
+                continue
+            issue_number = key.decode('utf-8').split(':', 1)[1]
+            add_to_index(pipe, issue_number, wire_codec.loads(data))
+            pipe.zadd(RN_SORT_ISSUE_NUMBER_KEY, {issue_number: 0})
+            pipe.zadd(RN_SORT_MODIFIED_KEY, {issue_number: 0}, nx=True)
+            count += 1
+        pipe.execute()
+    # 与按问题单号的索引取交集，去掉已删除记录的成员；权重为 0 使分值仍是原来的时间戳
+    redis_client.zinterstore(RN_SORT_MODIFIED_KEY, {RN_SORT_MODIFIED_KEY: 1, RN_SORT_ISSUE_NUMBER_KEY: 0})
+    return count
+
+
+def ensure_index(redis_client, batch_size=500):
+    """已有记录但还没有排序索引（引入分页之前部署的库）时重建，返回重建的记录数，无需重建时返回 None
+
+    多个 worker 同时启动时只有取得锁的进程重建。
+    """
+    if redis_client.exists(RN_SORT_ISSUE_NUMBER_KEY):
+        return None
+    if next(redis_client.scan_iter(match='rn_record:*', count=batch_size), None) is None:
+        return None
+    if not redis_client.set(RN_INDEX_REBUILD_LOCK, 1, nx=True, ex=600):
+        return None
+    try:
+        return rebuild_index(redis_client, batch_size)
+    finally:
+        redis_client.delete(RN_INDEX_REBUILD_LOCK)
@@ -0,0 +1,56 @@
+import re
+
+FILTER_TYPES = ('exact', 'contains', 'free')
+
+
+def unescape_filter_value(filter_value):
+    """还原客户端 re.escape 过的过滤值"""
+    return re.sub(r'\\(.)', r'\1', filter_value, flags=re.DOTALL)
+
+
+def compile_filters(filters):
+    """校验并预编译 RN_summary_Window.search_records 生成的过滤条件列表
+
+    每个条件为 (filter_type, filter_key, filter_value)，filter_value 已经过 re.escape。
+    服务器不信任客户端的转义：先还原再重新转义，只按字面匹配，避免无效或回溯爆炸的正则。
+    """
+    compiled = []
+    for item in filters:
+        if not isinstance(item, (list, tuple)) or len(item) != 3:
+            raise ValueError(f"无效的过滤条件: {item}")
+        filter_type, filter_key, filter_value = item
+        if filter_type not in FILTER_TYPES:
+            raise ValueError(f"未知的过滤类型: {filter_type}")
+        if filter_type != 'free' and not filter_key:
+            raise ValueError(f"过滤类型 {filter_type} 需要指定字段")
+        if not isinstance(filter_value, str):
+            raise ValueError(f"过滤值必须是字符串: {filter_value}")
+        pattern = re.escape(unescape_filter_value(filter_value))
+        if filter_type == 'exact':
+            compiled.append((filter_type, filter_key, pattern))
+        else:
+            compiled.append((filter_type, filter_key, re.compile(pattern, re.IGNORECASE)))
+    return compiled
+
+
+def match_record(record, compiled_filters):
+    """判断记录是否满足全部过滤条件（条件之间为“与”关系）"""
+    for filter_type, filter_key, filter_value in compiled_filters:
+        if filter_type == 'exact':
+            # 精确匹配
+            if filter_key not in record or re.escape(str(record[filter_key])) != filter_value:
+                return False
+        elif filter_type == 'contains':
+            # 模糊匹配
+            if filter_key not in record or not filter_value.search(str(record[filter_key])):
+                return False
+        else:
+            # 自由形式搜索，搜索所有字段
+            if not any(filter_value.search(str(value)) for value in record.values()):
+                return False
+    return True
+
+
+def filter_records(records, filters):
+    compiled_filters = compile_filters(filters)
+    return [record for record in records if match_record(record, compiled_filters)]
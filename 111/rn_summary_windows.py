@@ -1,19 +1,27 @@
 import sys
 from PySide6.QtGui import QFont
 from PySide6.QtWidgets import QApplication, QHBoxLayout, QTableWidgetItem, QMessageBox, QSplitter, \
-    QVBoxLayout, QLineEdit, QPushButton, QWidget, QSystemTrayIcon, QStyle, QLabel, QTextEdit, QScrollArea, QFrame
+    QVBoxLayout, QLineEdit, QPushButton, QWidget, QSystemTrayIcon, QStyle, QLabel, QTextEdit, QScrollArea, QFrame, \
+    QProgressBar
 from rn_client import RN_Client
+from task_runner import TaskRunner
 from html_tab_widget import HtmlTabWidget
-from table_widget import TableWidget
+from table_widget import TableWidget, PARTIAL_RECORD_ROLE
 from data_dialog import DataDialog
 from html_generator import generate_html
 import re
 from broadcast_listener import BroadcastListener
 from PySide6.QtCore import Qt, QTimer, QRect, QPropertyAnimation, QEvent
 from html_manager import HtmlManager
+import json
+import os
 import uuid
 from datetime import datetime
 
+# 本地列表缓存，启动时先显示缓存再增量同步
+LOCAL_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.rn_summary_cache.sqlite3')
+REPLAY_INTERVAL_MS = 10000  # 有离线修改时尝试重放的间隔
+
 class NotificationWindow(QWidget):
     def __init__(self, message, parent=None):
         super().__init__(parent)
@@ -56,7 +64,9 @@ class RN_summary_Window(QWidget):
         self.client_id = str(uuid.uuid4())
         self.server_url = "http://127.0.0.1:5000"
         self.username = "c50039964"
-        self.client = RN_Client(self.server_url, self.client_id, self.username)
+        self.client = RN_Client(self.server_url, self.client_id, self.username, cache_path=LOCAL_CACHE_PATH)
+        # 所有网络请求都在工作线程中执行，避免慢网络下界面卡死
+        self.tasks = TaskRunner(self)
 
         self.setWindowTitle("Redis表格管理示例")
         self.setGeometry(100, 100, 1200, 800)
@@ -76,9 +86,18 @@ class RN_summary_Window(QWidget):
         self.search_button = QPushButton("搜索", self)
         self.search_button.clicked.connect(self.search_records)
 
+        # 有未完成的网络请求时显示忙碌指示
+        self.busy_indicator = QProgressBar(self)
+        self.busy_indicator.setRange(0, 0)
+        self.busy_indicator.setTextVisible(False)
+        self.busy_indicator.setMaximumWidth(80)
+        self.busy_indicator.setVisible(False)
+        self.tasks.busy_changed.connect(self.busy_indicator.setVisible)
+
         search_layout = QHBoxLayout()
         search_layout.addWidget(self.search_input)
         search_layout.addWidget(self.search_button)
+        search_layout.addWidget(self.busy_indicator)
 
         search_widget = QWidget()
         search_widget.setLayout(search_layout)
@@ -120,8 +139,15 @@ class RN_summary_Window(QWidget):
 
         self.broadcast_listener = BroadcastListener(self.client_id, self.server_url)
         self.broadcast_listener.update_table_signal.connect(self.update_table_based_on_broadcast)
+        self.broadcast_listener.user_updated_signal.connect(self.client.invalidate_permissions)
         self.broadcast_listener.start()
-        self.table.load_table_data()
+        self.load_initial_data()
+
+        # 定时重放离线期间排队的写操作，启动时先试一次
+        self.replay_timer = QTimer(self)
+        self.replay_timer.timeout.connect(self.replay_pending_writes)
+        self.replay_timer.start(REPLAY_INTERVAL_MS)
+        self.replay_pending_writes()
         # 定义提示信息字符串
         tooltip_text = (
             "除了单独搜索之外，用户还可以在搜索框中输入组合搜索条件，\n例如 [严重级别=严重,问题单号=12345] {问题描述=网络,根因分析=硬件故障} 优化。\n"
@@ -134,6 +160,56 @@ class RN_summary_Window(QWidget):
         # 调用函数设置搜索框提示
         self.add_search_input_tooltip(self.search_input, tooltip_text)
 
+    def load_initial_data(self):
+        """有本地缓存时立即显示，再在后台从缓存的修订号增量同步，没加载完的页随滚动继续加载；否则分页加载"""
+        cached = self.client.load_cached_rn_records()
+        if cached is None:
+            self.table.load_table_data()
+            return
+        records, next_cursor = cached
+        self.table.show_records(records, next_cursor)
+        self.apply_pending_changes()
+        self.sync_changes()
+
+    def apply_pending_changes(self):
+        """列表只含服务器上的数据，叠加离线队列中尚未提交的修改；重复应用结果不变，每加载一页都调用"""
+        for change in self.client.pending_changes():
+            self.apply_change(change)
+
+    def replay_pending_writes(self):
+        if self.client.pending_write_count():
+            # 不用 key：重放中的请求不能被新的请求取代，客户端保证同一时间只有一个线程在重放
+            self.tasks.run(None, self.client.replay_pending_writes, on_done=self.on_replayed)
+
+    def on_replayed(self, result):
+        """离线修改重放完成；与服务器冲突的修改被丢弃，表格恢复为服务器上的记录并通知用户"""
+        if result is None:
+            return
+        for conflict in result['conflicts']:
+            operation = conflict['operation']
+            issue_number = operation.get('issue_number') or operation['record']['问题单号']
+            # 操作涉及的每个问题单号（改名时包括旧单号）都恢复为服务器上的状态
+            for key, record in conflict['records'].items():
+                if record is None:
+                    self.delete_record_from_table({'问题单号': key})
+                else:
+                    self.add_record_to_table(record)
+            self.show_notification(f"问题单号 {issue_number} 的离线修改未能提交：{conflict.get('error')}",
+                                   detail=json.dumps(operation, ensure_ascii=False, indent=2))
+        if result['applied']:
+            self.show_notification(f"已提交 {result['applied']} 条离线修改。")
+        if result['conflicts'] and result['remaining']:
+            # 恢复的记录上可能还有排在后面、尚未提交的修改
+            self.apply_pending_changes()
+        if result['applied'] or result['conflicts']:
+            self.sync_changes()
+
+    def apply_queued_change(self, change):
+        """保存或删除因连不上服务器而进入离线队列时，先在表格中显示修改"""
+        self.apply_change(change)
+        self.show_notification(f"无法连接服务器，问题单号 {change['issue_number']} 的修改已保存在本地，"
+                               f"恢复连接后自动提交。")
+
     def show_notification(self, message, detail=None):
         """在右下角显示自定义通知窗口"""
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -232,15 +308,24 @@ class RN_summary_Window(QWidget):
         dialog = DataDialog(self)
         if dialog.exec():
             data = dialog.get_data()
-            issue_number = data.get('问题单号')
-
-            if self.client.check_issue_number_exists(issue_number):
-                QMessageBox.warning(self, "错误", f"问题单号 '{issue_number}' 已存在，请使用不同的单号。")
-                return
-
-            result = self.client.save_rn_record(data)
-            if result and result.get("status") == "success":
-                self.table.load_table_data()
+            self.tasks.run(None, self.create_record, data,
+                           on_done=lambda result: self.on_record_created(data.get('问题单号'), result))
+
+    def create_record(self, data):
+        """在工作线程中执行：单号不存在时才保存"""
+        if self.client.check_issue_number_exists(data.get('问题单号')):
+            return {"status": "exists"}
+        return self.client.save_rn_record(data, base_version=0)
+
+    def on_record_created(self, issue_number, result):
+        if result and result.get("status") == "exists":
+            QMessageBox.warning(self, "错误", f"问题单号 '{issue_number}' 已存在，请使用不同的单号。")
+        elif result and result.get("status") == "success":
+            self.sync_changes()
+        elif result and result.get("status") == "queued":
+            self.apply_queued_change(result['change'])
+        else:
+            QMessageBox.warning(self, "错误", (result or {}).get("error") or "保存记录时出错。")
 
     def edit_item(self):
         selected_row = self.table.currentRow()  # 从表格对象中获取当前选中的行
@@ -251,56 +336,73 @@ class RN_summary_Window(QWidget):
                 print("Error: No item found in the selected row.")
                 return
 
-            old_record = item.data(Qt.UserRole)
-            print(f"Data found in selected row: {old_record}")
-
-            if old_record is None:
+            if item.data(Qt.UserRole) is None:
                 print("Error: No data found for selected row.")
                 return
 
-            old_issue_number = old_record.get('问题单号')
-            print(f"Old issue number: {old_issue_number}")
-
-            dialog = DataDialog(self, old_record)
-            if dialog.exec():
-                new_data = dialog.get_data()
-                new_issue_number = new_data.get('问题单号')
-                print(f"New issue number: {new_issue_number}")
-
-                if new_issue_number != old_issue_number:
-                    # 检查新问题单号是否已存在
-                    if self.client.check_issue_number_exists(new_issue_number):
-                        print(f"Error: Issue number '{new_issue_number}' already exists.")
-                        QMessageBox.warning(self, "错误", f"问题单号 '{new_issue_number}' 已存在，请使用不同的单号。")
-                        return
-
-                    # 尝试保存新记录，并传入旧单号
-                    print(f"Saving new record with issue number: {new_issue_number}")
-                    save_result = self.client.save_rn_record(new_data, old_issue_number=old_issue_number)
-                    if save_result and save_result.get("status") == "success":
-                        print("New record saved successfully.")
-                        self.table.load_table_data()  # 调用 TableWidget 的 load_table_data 方法
-                        self.html_manager.close_html(old_issue_number)
-                        self.html_manager.open_html(new_issue_number, generate_html(new_data))
-                    else:
-                        print("Error saving new record.")
-                        QMessageBox.warning(self, "错误", "保存新记录时出错。")
-                else:
-                    # 如果问题单号未改变，只更新记录
-                    print(f"Updating record for issue number: {new_issue_number}")
-                    save_result = self.client.save_rn_record(new_data)
-                    if save_result and save_result.get("status") == "success":
-                        print("Record updated successfully.")
-                        self.table.setItem(selected_row, 0, QTableWidgetItem(new_data.get('问题单号')))
-                        self.table.setItem(selected_row, 1, QTableWidgetItem(new_data.get('问题描述')))
-                        self.table.item(selected_row, 0).setData(Qt.UserRole, new_data)
-                        self.html_manager.reload_html(old_issue_number, generate_html(new_data))
-                    else:
-                        print("Error updating record.")
-                        QMessageBox.warning(self, "错误", "更新记录时出错。")
+            # 编辑后会整条保存，只有摘要字段的行必须取到完整记录
+            self.fetch_full_record(item, self.show_edit_dialog, allow_partial=False)
         else:
             print("Error: No row selected for editing.")
 
+    def show_edit_dialog(self, old_record):
+        print(f"Data found in selected row: {old_record}")
+        old_issue_number = old_record.get('问题单号')
+        print(f"Old issue number: {old_issue_number}")
+
+        dialog = DataDialog(self, old_record)
+        if dialog.exec():
+            new_data = dialog.get_data()
+            print(f"New issue number: {new_data.get('问题单号')}")
+            self.tasks.run(None, self.update_record, new_data, old_issue_number, old_record.get('version', 1),
+                           on_done=lambda result: self.on_record_updated(new_data, old_issue_number, result))
+
+    def update_record(self, new_data, old_issue_number, base_version):
+        """在工作线程中执行：改了单号时先检查新单号是否已存在，再连同旧单号一起保存；
+        base_version 为打开编辑时的记录版本，期间被其他用户修改过则服务器拒绝保存"""
+        new_issue_number = new_data.get('问题单号')
+        if new_issue_number != old_issue_number:
+            if self.client.check_issue_number_exists(new_issue_number):
+                return {"status": "exists"}
+            print(f"Saving new record with issue number: {new_issue_number}")
+            return self.client.save_rn_record(new_data, old_issue_number=old_issue_number, base_version=base_version)
+        print(f"Updating record for issue number: {new_issue_number}")
+        return self.client.save_rn_record(new_data, base_version=base_version)
+
+    def on_record_updated(self, new_data, old_issue_number, result):
+        new_issue_number = new_data.get('问题单号')
+        renamed = new_issue_number != old_issue_number
+        if result and result.get("status") == "exists":
+            print(f"Error: Issue number '{new_issue_number}' already exists.")
+            QMessageBox.warning(self, "错误", f"问题单号 '{new_issue_number}' 已存在，请使用不同的单号。")
+        elif result and result.get("status") == "success":
+            if renamed:
+                print("New record saved successfully.")
+                self.sync_changes()
+                self.html_manager.close_html(old_issue_number)
+                self.html_manager.open_html(new_issue_number, generate_html(new_data))
+            else:
+                # 请求期间表格可能已有增删，按单号而不是行号更新
+                print("Record updated successfully.")
+                new_data['version'] = result.get('version')
+                self.add_record_to_table(new_data)
+                self.html_manager.reload_html(old_issue_number, generate_html(new_data))
+        elif result and result.get("status") == "queued":
+            self.apply_queued_change(result['change'])
+            if renamed:
+                self.html_manager.close_html(old_issue_number)
+                self.html_manager.open_html(new_issue_number, generate_html(new_data))
+            else:
+                self.html_manager.reload_html(old_issue_number, generate_html(new_data))
+        elif result and result.get("status") == "conflict":
+            # 拉取其他用户的修改，用户重新打开编辑后再保存
+            QMessageBox.warning(self, "错误", f"{result.get('error')}，请重新打开后再修改。")
+            self.sync_changes()
+        else:
+            print("Error saving new record." if renamed else "Error updating record.")
+            default_message = "保存新记录时出错。" if renamed else "更新记录时出错。"
+            QMessageBox.warning(self, "错误", (result or {}).get("error") or default_message)
+
     def delete_item(self):
         selected_row = self.table.currentRow()
         if selected_row >= 0:
@@ -319,17 +421,26 @@ class RN_summary_Window(QWidget):
 
                 if reply == QMessageBox.Yes:
                     # 删除数据库中的记录
-                    result = self.client.delete_rn_record(issue_number)
-                    if result and result.get("status") == "success":
-                        # 删除成功后，刷新表格数据
-                        self.table.load_table_data()
+                    self.tasks.run(None, self.client.delete_rn_record, issue_number, record.get('version', 1),
+                                   on_done=lambda result: self.on_record_deleted(issue_number, result))
+
+    def on_record_deleted(self, issue_number, result):
+        if result and result.get("status") in ("success", "queued"):
+            if result.get("status") == "success":
+                # 删除成功后，增量同步表格数据
+                self.sync_changes()
+            else:
+                self.apply_queued_change(result['change'])
 
-                        # 如果有对应的HTML页面，关闭它
-                        if issue_number in self.html_manager.get_opened_html_list():
-                            self.html_manager.close_html(issue_number)
+            # 如果有对应的HTML页面，关闭它
+            if issue_number in self.html_manager.get_opened_html_list():
+                self.html_manager.close_html(issue_number)
 
-                    else:
-                        QMessageBox.warning(self, "错误", "删除记录时出错。")
+        elif result and result.get("status") == "conflict":
+            QMessageBox.warning(self, "错误", f"{result.get('error')}，请确认后再删除。")
+            self.sync_changes()
+        else:
+            QMessageBox.warning(self, "错误", (result or {}).get("error") or "删除记录时出错。")
 
     def open_html_viewer(self, index):
         row = index.row()
@@ -339,18 +450,41 @@ class RN_summary_Window(QWidget):
                 print(f"Error: No item found in table at row {row}")
                 return  # 避免 AttributeError
 
-            record = item.data(Qt.UserRole)
-            if not record:
+            if not item.data(Qt.UserRole):
                 print(f"Error: No data found for item at row {row}")
                 return  # 避免 AttributeError
 
-            issue_number = record.get('问题单号')
-            if not issue_number:
-                print(f"Error: No '问题单号' found in record {record}")
-                return  # 避免 KeyError
+            self.fetch_full_record(item, self.show_html)
+
+    def show_html(self, record):
+        issue_number = record.get('问题单号')
+        if not issue_number:
+            print(f"Error: No '问题单号' found in record {record}")
+            return  # 避免 KeyError
+
+        html_content = generate_html(record)
+        self.html_manager.open_html(issue_number, html_content)
+
+    def fetch_full_record(self, item, callback, allow_partial=True):
+        """分页加载的行只存了摘要字段，查看和编辑前在工作线程中获取完整记录再回调；获取失败时退回行中的数据
+
+        广播、变更日志和离线修改写入的行已是完整记录（可能尚未提交到服务器），直接使用。
+        allow_partial 为 False 时，只有摘要字段的行取不到完整记录则提示错误而不回调。连续点击不同的行时只处理最后一次。
+        """
+        record = item.data(Qt.UserRole)
+        if not record.get('问题单号') or not item.data(PARTIAL_RECORD_ROLE):
+            callback(record)
+            return
+
+        def fallback(*_):
+            if not allow_partial:
+                QMessageBox.warning(self, "错误", "无法获取完整记录，请稍后重试。")
+            else:
+                callback(record)
 
-            html_content = generate_html(record)
-            self.html_manager.open_html(issue_number, html_content)
+        self.tasks.run('full_record', self.client.get_full_rn_record, record['问题单号'],
+                       on_done=lambda full_record: callback(full_record) if full_record else fallback(),
+                       on_error=fallback)
 
     def delete_record_from_table(self, rn_record):
         """从表格中删除记录"""
@@ -359,6 +493,7 @@ class RN_summary_Window(QWidget):
         if not issue_number:
             print(f"Error: Received rn_record without '问题单号': {rn_record}")
             return  # 如果数据不包含 '问题单号' 键，直接返回
+        self.client.forget_rn_record(issue_number)
 
         for row in range(self.table.rowCount()):
             item = self.table.item(row, 0)
@@ -427,11 +562,73 @@ class RN_summary_Window(QWidget):
                 self.html_manager.reload_html(issue_number, generate_html(data['rn_record']))
             self.show_notification(f"新问题单号 {issue_number} 已被 {username} 创建。", detail=summary)
 
+        elif operation == 'batch':
+            print(f"Received batch operation of {data.get('count')} changes by {username}")
+            self.show_notification(f"{username} 批量修改了 {data.get('count')} 条记录。", detail=summary)
+
+        elif operation == 'import':
+            # 批量导入只有一条汇总广播，具体记录由下面的增量同步拉取
+            print(f"Received import operation of {data.get('count')} records by {username}")
+            self.show_notification(f"{username} 批量导入了 {data.get('count')} 条记录。", detail=summary)
+
         else:
             print(f"Unknown operation: {operation}")
 
-        # 刷新表格以确保同步
-        self.table.load_table_data()
+        # 按修订号增量同步，确保没有漏掉的变更
+        self.sync_changes(data.get('revision'), self.broadcast_change(data, operation))
+
+    @staticmethod
+    def broadcast_change(data, operation):
+        """把单条记录的广播转换成变更日志的格式；批量和导入的广播不含记录内容，返回 None"""
+        if operation == 'delete':
+            return {'operation': operation, 'issue_number': data.get('issue_number')}
+        if operation in ('update_with_rename', 'update', 'post'):
+            return {'operation': operation, 'issue_number': data.get('new_issue_number'),
+                    'old_issue_number': data.get('old_issue_number'), 'rn_record': data.get('rn_record')}
+        return None
+
+    def sync_changes(self, broadcast_revision=None, broadcast_change=None):
+        """在工作线程中拉取本地修订号之后的变更，返回后应用到表格，必要时退回全量加载"""
+        revision = self.client.revision
+        if revision is None:
+            self.client.forget_rn_record()
+            self.table.load_table_data()
+            return
+
+        # 单条记录的广播恰好是下一个修订号，消息本身已应用，无需再请求变更日志
+        if broadcast_change is not None and broadcast_revision == revision + 1:
+            self.client.record_broadcast_change(broadcast_revision, broadcast_change)
+            return
+
+        # 新的同步请求从同一或更新的修订号开始，覆盖尚未返回的旧请求
+        self.tasks.run('rn_sync', self.client.get_rn_changes, revision,
+                       on_done=lambda result: self.on_changes_loaded(revision, result))
+
+    def on_changes_loaded(self, revision, result):
+        if result is None or result.get('reset'):
+            self.client.forget_rn_record()
+            self.table.load_table_data()
+            return
+
+        for change in result.get('changes', []):
+            self.apply_change(change)
+        self.client.revision = result.get('revision', revision)
+
+        if result.get('has_more'):
+            self.sync_changes()
+
+    def apply_change(self, change):
+        """把一条变更日志应用到表格"""
+        operation = change.get('operation')
+        if operation == 'delete':
+            self.delete_record_from_table({'问题单号': change.get('issue_number')})
+        elif operation == 'update_with_rename':
+            self.delete_record_from_table({'问题单号': change.get('old_issue_number')})
+            self.add_record_to_table(change['rn_record'])
+        elif operation in ('update', 'post'):
+            self.add_record_to_table(change['rn_record'])
+        else:
+            print(f"Unknown change operation: {operation}")
 
     def add_record_to_table(self, rn_record):
         """添加或更新记录到表格"""
@@ -441,19 +638,24 @@ class RN_summary_Window(QWidget):
         if not issue_number:
             print(f"Error: Received rn_record without '问题单号': {rn_record}")
             return  # 如果数据不包含 '问题单号' 键，直接返回
+        self.client.forget_rn_record(issue_number)
 
         # 首先检查表格中是否已有此记录
         for row in range(self.table.rowCount()):
             item = self.table.item(row, 0)
             if item and item.text() == issue_number:
                 # 如果存在，更新记录
+                item.setData(Qt.UserRole, rn_record)
+                item.setData(PARTIAL_RECORD_ROLE, False)
                 self.table.setItem(row, 1, QTableWidgetItem(description))
                 return
 
         # 如果不存在，插入新记录
         row_position = self.table.rowCount()
         self.table.insertRow(row_position)
-        self.table.setItem(row_position, 0, QTableWidgetItem(issue_number))
+        issue_number_item = QTableWidgetItem(issue_number)
+        issue_number_item.setData(Qt.UserRole, rn_record)
+        self.table.setItem(row_position, 0, issue_number_item)
         self.table.setItem(row_position, 1, QTableWidgetItem(description))
 
 
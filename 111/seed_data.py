@@ -0,0 +1,38 @@
+"""写入用户中文名与权限，独立于服务端启动执行：
+
+    python seed_data.py               # 只补充缺失的用户和权限
+    python seed_data.py --overwrite   # 以种子文件为准覆盖已有值
+"""
+import argparse
+import json
+
+from server import create_redis_client
+from server_config import load_config
+from user_cache import publish_user_update
+
+
+def seed_users(redis_client, seed, overwrite=False):
+    """按种子数据写入 kpi_username 与 permissions_{用户}；默认不覆盖已有值，重复执行结果不变"""
+    pipe = redis_client.pipeline(transaction=True)
+    for username, name in seed.get('kpi_username', {}).items():
+        if overwrite:
+            pipe.hset('kpi_username', username, name)
+        else:
+            pipe.hsetnx('kpi_username', username, name)
+    for username, permissions in seed.get('permissions', {}).items():
+        pipe.set(f'permissions_{username}', permissions, nx=not overwrite)
+    pipe.execute()
+    publish_user_update(redis_client, set(seed.get('kpi_username', {})) | set(seed.get('permissions', {})))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='写入用户与权限种子数据')
+    parser.add_argument('--seed-file', help='种子文件路径，默认取配置项 SEED_FILE')
+    parser.add_argument('--overwrite', action='store_true', help='覆盖 Redis 中已有的值')
+    args = parser.parse_args()
+
+    config = load_config()
+    with open(args.seed_file or config['SEED_FILE'], encoding='utf-8') as f:
+        seed = json.load(f)
+    seed_users(create_redis_client(config), seed, overwrite=args.overwrite)
+    print(f"Seeded {len(seed.get('kpi_username', {}))} users and {len(seed.get('permissions', {}))} permissions.")
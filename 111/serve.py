@@ -0,0 +1,45 @@
+"""生产环境启动入口：用 gunicorn 预先 fork 多个 worker 进程，每个进程调用一次 server.create_app()
+
+    python serve.py                      # worker 数默认为 CPU 核数，见 server_config
+    SERVER_WORKERS=8 python serve.py --port 5002
+
+等价于 gunicorn -w 8 -k gthread --threads 4 -b 0.0.0.0:5002 'server:create_app()'。
+ASGI 版本可直接用 hypercorn --workers 8 'async_server:create_app()' 启动。
+"""
+import argparse
+
+from gunicorn.app.base import BaseApplication
+
+from server_config import load_config
+
+
+class ServerApplication(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # 在每个 worker 进程里创建应用，Redis 连接池不会跨进程共享
+        from server import create_app
+        return create_app()
+
+
+if __name__ == '__main__':
+    config = load_config()
+    parser = argparse.ArgumentParser(description='多进程启动 RN 服务端')
+    parser.add_argument('--host', default=config['SERVER_HOST'])
+    parser.add_argument('--port', type=int, default=config['SERVER_PORT'])
+    parser.add_argument('--workers', type=int, default=config['SERVER_WORKERS'])
+    parser.add_argument('--threads', type=int, default=config['SERVER_THREADS'])
+    args = parser.parse_args()
+
+    ServerApplication({
+        'bind': f'{args.host}:{args.port}',
+        'workers': args.workers,
+        'worker_class': 'gthread',
+        'threads': args.threads,
+    }).run()
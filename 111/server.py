@@ -1,48 +1,275 @@
+import sys
+import zlib
 import redis
-import json
-from flask import Flask, request, jsonify
-from concurrent.futures import ThreadPoolExecutor
-from readerwriterlock import rwlock
-
-app = Flask(__name__)
-executor = ThreadPoolExecutor(max_workers=10)
-
-redis_client = redis.Redis(host='localhost', port=6379, db=0)
-
-# 初始化读写锁
-rw_lock = rwlock.RWLockWrite()
-
-
-def rn_compare_dictionaries(original, modified):
-    changes = []
-
-    keys_to_ignore = ['client_id','issue_number']
-
-    all_keys = set(original.keys()).union(modified.keys()).difference(keys_to_ignore)
-
-    for key in all_keys:
-        original_value = original.get(key, None)
-        modified_value = modified.get(key, None)
-
-        if original_value != modified_value:
-            if original_value is None:
-                changes.append(f"'{key}' 新增了值 '{modified_value}'。")
-            elif modified_value is None or modified_value == "":
-                changes.append(f"'{key}' 被删除，原来的值是 '{original_value}'。")
-            elif original_value == "":
-                changes.append(f"'{key}' 添加了值 '{modified_value}'。")
-            else:
-                changes.append(f"'{key}' 从 '{original_value}' 变为 '{modified_value}'。")
-
-    if changes:
-        summary = "检测到以下变化：\n" + "\n".join(changes)
+import wire_codec
+from flask import Flask, Blueprint, current_app, request, jsonify, stream_with_context
+from rn_search import filter_records
+from rn_index import (RN_SORT_ISSUE_NUMBER_KEY, RN_SORT_MODIFIED_KEY, add_to_index, remove_from_index,
+                      add_to_sort_index, remove_from_sort_index, rebuild_index, ensure_index)
+from table_patch import apply_table_patch
+from rn_fulltext import update_fulltext_index, rebuild_fulltext_index, ensure_fulltext_index
+from rn_common import (FastJSONProvider, APPEND_RN_CHANGE_LUA, RN_FETCH_BATCH_SIZE, RN_WRITE_RETRIES,
+                       RESPONSE_COMPRESS_MIN_SIZE, RN_CHANGELOG_MAXLEN, RN_CHANGES_PAGE_SIZE, RN_IMPORT_BATCH_SIZE,
+                       RN_PAGE_DEFAULT_LIMIT, RN_PAGE_MAX_LIMIT, RN_BATCH_MAX_OPERATIONS, BATCH_OPERATION_NAMES,
+                       RN_CONFLICT_MESSAGE, RN_RENAME_EXISTS_MESSAGE, BatchOperationError, record_version,
+                       batch_operation_keys, plan_rn_batch, parse_fields, project_record, parse_import_line,
+                       import_message, rn_candidate_keys, rn_compare_dictionaries)
+from server_config import load_config
+from rn_cache import RecordCache, start_invalidation_listener
+from user_cache import UserCache, start_user_invalidation_listener
+
+
+bp = Blueprint('server', __name__)
+
+# 由 create_app 按配置创建，同一进程内的所有请求共享
+redis_client = None
+append_rn_change = None
+rn_cache = None
+user_cache = None
+
+
+def create_redis_client(config):
+    """按配置创建带连接池的 Redis 客户端；连接用尽时排队等待而不是直接报错"""
+    pool = redis.BlockingConnectionPool(host=config['REDIS_HOST'], port=config['REDIS_PORT'],
+                                        db=config['REDIS_DB'], max_connections=config['REDIS_MAX_CONNECTIONS'],
+                                        timeout=10)
+    return redis.Redis(connection_pool=pool)
+
+
+def create_app(config=None):
+    """应用工厂：config 缺省时按 server_config.load_config() 从环境变量读取
+
+    Redis 客户端是进程级的，每个 worker 进程调用一次即可。
+    """
+    global redis_client, append_rn_change, rn_cache, user_cache
+    config = config or load_config()
+    redis_client = create_redis_client(config)
+    append_rn_change = redis_client.register_script(APPEND_RN_CHANGE_LUA)
+    ensure_index(redis_client, RN_FETCH_BATCH_SIZE)
+    ensure_fulltext_index(redis_client, RN_FETCH_BATCH_SIZE)
+    rn_cache = RecordCache(config['RN_CACHE_MAX_BYTES'])
+    if rn_cache.max_bytes > 0:
+        start_invalidation_listener(redis_client, rn_cache)
+    user_cache = UserCache(redis_client, config['USER_CACHE_TTL'])
+    if user_cache.ttl > 0:
+        start_user_invalidation_listener(redis_client, user_cache)
+
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    app.config.update(config)
+    app.register_blueprint(bp)
+    return app
+
+
+def get_rn_revision():
+    revision = redis_client.get('rn_revision')
+    return int(revision) if revision else 0
+
+
+def get_table_version(table_name):
+    version = redis_client.get(f'{table_name}_version')
+    return int(version) if version else 0
+
+
+def not_modified(etag):
+    """客户端 If-None-Match 中的 ETag 仍然有效时返回 304 响应，否则返回 None"""
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+@bp.after_app_request
+def compress_response(response):
+    """按客户端的 Accept-Encoding 用 zstd 或 gzip 压缩较大的 JSON 响应"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype != 'application/json'):
+        return response
+
+    data = response.get_data()
+    if len(data) < RESPONSE_COMPRESS_MIN_SIZE:
+        return response
+
+    encoding = wire_codec.negotiate_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    response.set_data(wire_codec.compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def log_rn_change(pipe, operation, issue_number, rn_record=None, old_issue_number=None):
+    """在调用方的事务中递增修订号并写入变更日志"""
+    append_rn_change(keys=['rn_revision', 'rn_changes'],
+                     args=[RN_CHANGELOG_MAXLEN, operation, issue_number, old_issue_number or '',
+                           wire_codec.dumps(rn_record) if rn_record is not None else ''],
+                     client=pipe)
+
+
+def load_rn_records_bulk(batch_size=RN_FETCH_BATCH_SIZE):
+    """用增量 SCAN 收集键，再用流水线批量 MGET 读取全部 rn_record"""
+    keys = list(redis_client.scan_iter(match='rn_record:*', count=batch_size))
+    if not keys:
+        return []
+
+    pipe = redis_client.pipeline(transaction=False)
+    for start in range(0, len(keys), batch_size):
+        pipe.mget(keys[start:start + batch_size])
+
+    rn_records = []
+    for values in pipe.execute():
+        for data in values:
+            # SCAN 与 MGET 之间被删除的键会返回 None
+            if data is not None:
+                rn_records.append(wire_codec.loads(data))
+    return rn_records
+
+
+def iter_rn_key_batches(batch_size=RN_FETCH_BATCH_SIZE):
+    """增量 SCAN rn_record:* 键，每凑满 batch_size 个产出一批"""
+    keys = []
+    for key in redis_client.scan_iter(match='rn_record:*', count=batch_size):
+        keys.append(key)
+        if len(keys) >= batch_size:
+            yield keys
+            keys = []
+    if keys:
+        yield keys
+
+
+def iter_rn_records_json(batch_size=RN_FETCH_BATCH_SIZE, fields=None):
+    """逐批 MGET 产出全部记录组成的 JSON 数组片段
+
+    不做投影时 Redis 中存的记录 JSON 直接拼接而不解析；指定 fields 时逐条解析后只保留这些字段。
+    """
+    yield b'['
+    separator = b''
+    for keys in iter_rn_key_batches(batch_size):
+        values = [data for data in redis_client.mget(keys) if data is not None]
+        if fields:
+            values = [wire_codec.dumps(project_record(wire_codec.loads(data), fields)).encode('utf-8')
+                      for data in values]
+        if values:
+            yield separator + b','.join(values)
+            separator = b','
+    yield b']'
+
+
+def stream_json_response(chunks):
+    """以流式响应返回逐块生成的 JSON，按 Accept-Encoding 边生成边压缩"""
+    encoding = wire_codec.negotiate_encoding(request.accept_encodings)
+    if encoding is not None:
+        chunks = wire_codec.compress_stream(chunks, encoding)
+    response = current_app.response_class(chunks, mimetype='application/json')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def load_rn_records_by_issue_numbers(issue_numbers, batch_size=RN_FETCH_BATCH_SIZE):
+    """按问题单号批量 MGET 读取记录"""
+    keys = [f'rn_record:{issue_number}' for issue_number in issue_numbers]
+    pipe = redis_client.pipeline(transaction=False)
+    for start in range(0, len(keys), batch_size):
+        pipe.mget(keys[start:start + batch_size])
+    return [wire_codec.loads(data) for values in pipe.execute() for data in values if data is not None]
+
+
+def write_rn_record(pipe, issue_number, data, old_record=None, old_issue_number=None):
+    """在调用方已进入 MULTI 的事务中排队写入记录、维护索引并追加变更日志，返回操作类型
+
+    old_issue_number 不同于 issue_number 时视为改名；事务执行结果的最后一项是新的修订号。
+    data 的 version 会被设为旧记录的版本加一，客户端据此检测并发修改。
+    """
+    data['version'] = record_version(old_record) + 1
+    if old_record is None:
+        operation = 'post'
+    elif old_issue_number and old_issue_number != issue_number:
+        operation = 'update_with_rename'
+    else:
+        operation = 'update'
+    old_issue_number = old_issue_number or issue_number
+    if old_record is not None:
+        remove_from_index(pipe, old_issue_number, old_record)
+    if old_issue_number != issue_number:
+        pipe.delete(f'rn_record:{old_issue_number}')
+        remove_from_sort_index(pipe, old_issue_number)
+    pipe.set(f'rn_record:{issue_number}', wire_codec.dumps(data))
+    add_to_index(pipe, issue_number, data)
+    add_to_sort_index(pipe, issue_number)
+    update_fulltext_index(pipe, issue_number, old_record, data, old_issue_number)
+    log_rn_change(pipe, operation, issue_number, data,
+                  old_issue_number if operation == 'update_with_rename' else None)
+    return operation
+
+
+def remove_rn_record(pipe, issue_number, record):
+    """在调用方已进入 MULTI 的事务中排队删除记录及其索引并追加变更日志"""
+    pipe.delete(f'rn_record:{issue_number}')
+    remove_from_index(pipe, issue_number, record)
+    remove_from_sort_index(pipe, issue_number)
+    update_fulltext_index(pipe, issue_number, old_record=record)
+    log_rn_change(pipe, 'delete', issue_number)
+
+
+def import_rn_batch(records):
+    """在一个 WATCH/MULTI 事务中写入一批 {问题单号: 记录}，返回新的修订号；多次冲突后返回 None"""
+    keys = [f'rn_record:{issue_number}' for issue_number in records]
+    for _ in range(RN_WRITE_RETRIES):
+        with redis_client.pipeline(transaction=True) as pipe:
+            try:
+                pipe.watch(*keys)
+                old_records = pipe.mget(keys)
+                pipe.multi()
+                for (issue_number, record), old_record in zip(records.items(), old_records):
+                    write_rn_record(pipe, issue_number, record,
+                                    old_record=wire_codec.loads(old_record) if old_record else None)
+                return pipe.execute()[-1]
+            except redis.WatchError:
+                continue
+    return None
+
+
+def rn_page_issue_numbers(sort, cursor, limit):
+    """按排序索引取一页问题单号，返回 (issue_numbers, next_cursor)，没有下一页时 next_cursor 为 None
+
+    sort 为 issue_number（按单号升序）或 modified（最近修改在前）。modified 的游标形如
+    "<时间戳>:<问题单号>"，时间戳相同的记录按单号继续排序，翻页时不会重复或遗漏。
+    """
+    if sort == 'issue_number':
+        start = f'({cursor}' if cursor else '-'
+        members = redis_client.zrangebylex(RN_SORT_ISSUE_NUMBER_KEY, start, '+', start=0, num=limit + 1)
+        issue_numbers = [member.decode('utf-8') for member in members]
+        has_more = len(issue_numbers) > limit
+        issue_numbers = issue_numbers[:limit]
+        return issue_numbers, issue_numbers[-1] if has_more else None
+
+    if cursor:
+        score, _, last_issue_number = cursor.partition(':')
+        score = float(score)
+        # 与游标同分的记录中，ZREVRANGEBYSCORE 按单号降序返回，不小于游标单号的已在前几页返回过
+        ties = redis_client.zcount(RN_SORT_MODIFIED_KEY, score, score)
+        entries = redis_client.zrevrangebyscore(RN_SORT_MODIFIED_KEY, score, '-inf', start=0, num=limit + 1 + ties,
+                                                withscores=True)
+        entries = [(member.decode('utf-8'), entry_score) for member, entry_score in entries]
+        entries = [(member, entry_score) for member, entry_score in entries
+                   if entry_score != score or member < last_issue_number]
     else:
-        summary = "未检测到任何变化。"
+        entries = redis_client.zrevrangebyscore(RN_SORT_MODIFIED_KEY, '+inf', '-inf', start=0, num=limit + 1,
+                                                withscores=True)
+        entries = [(member.decode('utf-8'), entry_score) for member, entry_score in entries]
 
-    return summary
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    next_cursor = f'{entries[-1][1]!r}:{entries[-1][0]}' if has_more else None
+    return [member for member, _ in entries], next_cursor
 
 
-@app.route('/rn_record_exists', methods=['POST'])
+@bp.route('/rn_record_exists', methods=['POST'])
 def check_issue_number_exists():
     request_data = request.json
     issue_number = request_data.get('issue_number')
@@ -50,268 +277,611 @@ def check_issue_number_exists():
     if not issue_number:
         return jsonify({"error": "issue_number 是必填项"}), 400
 
-    with rw_lock.gen_rlock():
-        exists = redis_client.exists(f'rn_record:{issue_number}') > 0
+    exists = redis_client.exists(f'rn_record:{issue_number}') > 0
 
     return jsonify({"exists": exists})
 
 
-@app.route('/save_rn_record', methods=['POST'])
+@bp.route('/save_rn_record', methods=['POST'])
 def save_rn_record():
     data = request.json
     issue_number = data.get('issue_number')
     client_id = data.get('client_id')
     save_username_key = data.get('username')
 
-    save_username = redis_client.hget('kpi_username', save_username_key)
-    if save_username:
-        save_username = save_username.decode('utf-8')
-    else:
+    save_username = user_cache.display_name(save_username_key)
+    if not save_username:
         return jsonify({"error": "未找到对应的中文名字"}), 404
 
     old_issue_number = data.pop('old_issue_number', None)
+    # 客户端修改所基于的记录版本（新建为 0），不传则不检查
+    base_version = data.pop('base_version', None)
 
     if not issue_number:
         return jsonify({"error": "issue_number 是必填项"}), 400
 
+    source_issue_number = old_issue_number or issue_number
     try:
-        with rw_lock.gen_wlock():
-            if old_issue_number:
-                existing_record = redis_client.get(f'rn_record:{old_issue_number}')
-                if existing_record:
-                    existing_record = json.loads(existing_record)
-                    summary = rn_compare_dictionaries(existing_record, data)
-                if old_issue_number == issue_number:
-                    if existing_record:
-                        redis_client.set(f'rn_record:{issue_number}', json.dumps(data))
-                        message = {
-                            'client_id': client_id,
-                            'operation': 'update',
-                            'new_issue_number': issue_number,
-                            'rn_record': data,
-                            'username': save_username,
-                            'summary': summary
-                        }
-                        redis_client.publish('rn_channel', json.dumps(message))
-                    else:
-                        return jsonify({"error": "未找到对应的问题单号"}), 404
-                else:
-                    if existing_record:
-                        redis_client.delete(f'rn_record:{old_issue_number}')
-                        redis_client.set(f'rn_record:{issue_number}', json.dumps(data))
-                        message = {
-                            'client_id': client_id,
-                            'operation': 'update_with_rename',
-                            'old_issue_number': old_issue_number,
-                            'new_issue_number': issue_number,
-                            'rn_record': data,
-                            'username': save_username,
-                            'summary': summary
-                        }
-                        redis_client.publish('rn_channel', json.dumps(message))
-                    else:
+        for _ in range(RN_WRITE_RETRIES):
+            with redis_client.pipeline(transaction=True) as pipe:
+                try:
+                    # 只 WATCH 本次涉及的记录键，不同问题单号的保存可以并行执行
+                    pipe.watch(f'rn_record:{source_issue_number}', f'rn_record:{issue_number}')
+                    existing_record = pipe.get(f'rn_record:{source_issue_number}')
+                    existing_record = wire_codec.loads(existing_record) if existing_record else None
+                    if old_issue_number and existing_record is None:
+                        if old_issue_number == issue_number:
+                            return jsonify({"error": "未找到对应的问题单号"}), 404
                         return jsonify({"error": "未找到旧的问题单号"}), 404
-            else:
-                existing_record = redis_client.get(f'rn_record:{issue_number}')
-                if existing_record:
-                    existing_record = json.loads(existing_record)
-                    summary = rn_compare_dictionaries(existing_record, data)
-                    redis_client.set(f'rn_record:{issue_number}', json.dumps(data))
-                    message = {
-                        'client_id': client_id,
-                        'operation': 'update',
-                        'new_issue_number': issue_number,
-                        'rn_record': data,
-                        'username': save_username,
-                        'summary': summary
-                    }
-                    redis_client.publish('rn_channel', json.dumps(message))
-                else:
-                    summary = rn_compare_dictionaries({}, data)
-                    redis_client.set(f'rn_record:{issue_number}', json.dumps(data))
-                    message = {
-                        'client_id': client_id,
-                        'operation': 'post',
-                        'new_issue_number': issue_number,
-                        'rn_record': data,
-                        'username': save_username,
-                        'summary': summary
-                    }
-                    redis_client.publish('rn_channel', json.dumps(message))
-
-        return jsonify({"status": "success", "issue_number": issue_number})
+                    if base_version is not None and record_version(existing_record) != base_version:
+                        return jsonify({"status": "conflict", "error": RN_CONFLICT_MESSAGE,
+                                        "current": existing_record}), 409
+                    # 改名不能覆盖已存在的记录，否则目标记录的索引项会残留
+                    if source_issue_number != issue_number and pipe.exists(f'rn_record:{issue_number}'):
+                        return jsonify({"status": "conflict", "error": RN_RENAME_EXISTS_MESSAGE}), 409
+
+                    summary = rn_compare_dictionaries(existing_record or {}, data)
+                    pipe.multi()
+                    operation = write_rn_record(pipe, issue_number, data, old_record=existing_record,
+                                                old_issue_number=source_issue_number)
+                    revision = pipe.execute()[-1]
+                    break
+                except redis.WatchError:
+                    continue  # 记录在读取后被其他请求修改，重新读取后重试
+        else:
+            return jsonify({"error": "记录正被其他用户修改，请稍后重试"}), 409
+
+        message = {
+            'client_id': client_id,
+            'operation': operation,
+            'new_issue_number': issue_number,
+            'rn_record': data,
+            'username': save_username,
+            'summary': summary,
+            'revision': revision
+        }
+        if operation == 'update_with_rename':
+            message['old_issue_number'] = old_issue_number
+        # 本进程的缓存立即失效，其他 worker 通过 rn_channel 收到广播后失效
+        rn_cache.invalidate(issue_number, old_issue_number)
+        redis_client.publish('rn_channel', wire_codec.dumps(message))
+
+        return jsonify({"status": "success", "issue_number": issue_number, "revision": revision,
+                        "version": data['version']})
 
     except Exception as e:
         print(f"Error processing record: {e}")
         return jsonify({"error": "处理记录时出错", "details": str(e)}), 500
 
 
-@app.route('/get_rn_record_by_issue_number', methods=['GET'])
+@bp.route('/get_rn_record_by_issue_number', methods=['GET'])
 def get_rn_record_by_issue_number():
     issue_number = request.args.get('issue_number')
     if not issue_number:
         return jsonify({"error": "issue_number 是必填项"}), 400
 
-    with rw_lock.gen_rlock():
+    data = rn_cache.get(issue_number)
+    if data is None:
+        generation = rn_cache.generation
         data = redis_client.get(f'rn_record:{issue_number}')
+        if data:
+            rn_cache.put(issue_number, data, generation)
 
     if data:
-        rn_record = json.loads(data)
-        return jsonify(rn_record)
+        # Redis 中存的就是记录的 JSON，直接作为响应体返回
+        return current_app.response_class(data, mimetype='application/json')
     return jsonify({"error": "Record not found"}), 404
 
 
-@app.route('/delete_rn_record', methods=['DELETE'])
+@bp.route('/delete_rn_record', methods=['DELETE'])
 def delete_rn_record():
     request_data = request.json
     issue_number = request_data.get('issue_number')
     client_id = request_data.get('client_id')
     del_username_key = request_data.get('username')
+    base_version = request_data.get('base_version')
 
     if not issue_number or not client_id:
         return jsonify({"error": "issue_number 和 client_id 是必填项"}), 400
 
-    del_username = redis_client.hget('kpi_username', del_username_key)
-    if del_username:
-        del_username = del_username.decode('utf-8')
-    else:
+    del_username = user_cache.display_name(del_username_key)
+    if not del_username:
         return jsonify({"error": "未找到对应的中文名字"}), 404
 
-    with rw_lock.gen_wlock():
-        delete_data = redis_client.get(f'rn_record:{issue_number}')
-        if delete_data:
-            delete_data = json.loads(delete_data)
-            summary = rn_compare_dictionaries(delete_data, {})
-            redis_client.delete(f'rn_record:{issue_number}')
-            message = {
-                'client_id': client_id,
-                'operation': 'delete',
-                'issue_number': issue_number,
-                'username': del_username,
-                'summary': summary
-            }
-            redis_client.publish('rn_channel', json.dumps(message))
-            return jsonify({"status": "success"})
-        else:
-            return jsonify({"error": "issue_number不存在"})
+    for _ in range(RN_WRITE_RETRIES):
+        with redis_client.pipeline(transaction=True) as pipe:
+            try:
+                pipe.watch(f'rn_record:{issue_number}')
+                delete_data = pipe.get(f'rn_record:{issue_number}')
+                if not delete_data:
+                    return jsonify({"error": "issue_number不存在"})
+                delete_data = wire_codec.loads(delete_data)
+                if base_version is not None and record_version(delete_data) != base_version:
+                    return jsonify({"status": "conflict", "error": RN_CONFLICT_MESSAGE, "current": delete_data}), 409
+                summary = rn_compare_dictionaries(delete_data, {})
+                pipe.multi()
+                remove_rn_record(pipe, issue_number, delete_data)
+                revision = pipe.execute()[-1]
+                break
+            except redis.WatchError:
+                continue
+    else:
+        return jsonify({"error": "记录正被其他用户修改，请稍后重试"}), 409
+
+    message = {
+        'client_id': client_id,
+        'operation': 'delete',
+        'issue_number': issue_number,
+        'username': del_username,
+        'summary': summary,
+        'revision': revision
+    }
+    rn_cache.invalidate(issue_number)
+    redis_client.publish('rn_channel', wire_codec.dumps(message))
+    return jsonify({"status": "success", "revision": revision})
 
 
-@app.route('/get_all_rn_records', methods=['GET'])
+@bp.route('/get_all_rn_records', methods=['GET'])
 def get_all_rn_records():
-    with rw_lock.gen_rlock():
-        keys = redis_client.keys('rn_record:*')
-        rn_records = []
-        for key in keys:
-            data = redis_client.get(key)
-            rn_record = json.loads(data)
-            rn_records.append(rn_record)
-    return jsonify(rn_records)
+    if 'limit' in request.args or 'cursor' in request.args:
+        return get_rn_records_page()
+
+    fields = parse_fields(request.args.get('fields'))
+    if fields:
+        # 投影结果不进入快照缓存；字段名含中文，ETag 中用其校验和区分不同投影
+        revision = get_rn_revision()
+        etag = f'rn-{revision}-{zlib.crc32(",".join(fields).encode("utf-8")):08x}'
+        response = not_modified(etag)
+        if response is None:
+            response = stream_json_response(iter_rn_records_json(fields=fields))
+            response.set_etag(etag)
+        response.headers['X-RN-Revision'] = str(revision)
+        return response
+
+    snapshot = rn_cache.get_snapshot()
+    if snapshot is not None:
+        revision, body = snapshot
+    else:
+        # 先读修订号再读记录，客户端据此增量同步时最多重复应用少量变更
+        generation = rn_cache.generation
+        revision = get_rn_revision()
+        body = None
+
+    etag = f'rn-{revision}'
+    response = not_modified(etag)
+    if response is None:
+        if body is None:
+            # 逐批读取并流式输出，每个请求只占用一批记录的内存；语料不超过缓存上限时顺便存为快照
+            response = stream_json_response(rn_cache.tee_snapshot(revision, iter_rn_records_json(), generation))
+        else:
+            response = current_app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+    response.headers['X-RN-Revision'] = str(revision)
+    return response
+
+
+def get_rn_records_page():
+    """分页读取：?limit=&cursor=&sort=issue_number|modified&fields=，返回一页记录和下一页的游标"""
+    sort = request.args.get('sort', 'issue_number')
+    limit = request.args.get('limit', RN_PAGE_DEFAULT_LIMIT, type=int)
+    if sort not in ('issue_number', 'modified'):
+        return jsonify({"error": "sort 只能是 issue_number 或 modified"}), 400
+    if not limit or not 0 < limit <= RN_PAGE_MAX_LIMIT:
+        return jsonify({"error": f"limit 必须是 1 到 {RN_PAGE_MAX_LIMIT} 之间的整数"}), 400
+
+    revision = get_rn_revision()
+    try:
+        issue_numbers, next_cursor = rn_page_issue_numbers(sort, request.args.get('cursor'), limit)
+    except ValueError:
+        return jsonify({"error": "cursor 无效"}), 400
+
+    records = load_rn_records_by_issue_numbers(issue_numbers)
+    fields = parse_fields(request.args.get('fields'))
+    if fields:
+        records = [project_record(record, fields) for record in records]
+
+    response = jsonify({
+        "records": records,
+        "next_cursor": next_cursor,
+        "total": redis_client.zcard(RN_SORT_ISSUE_NUMBER_KEY),
+        "revision": revision
+    })
+    response.headers['X-RN-Revision'] = str(revision)
+    return response
+
+
+@bp.route('/rn_records/batch', methods=['POST'])
+def batch_rn_records():
+    """在一个事务中按顺序执行多个保存（新增、修改、改名）和删除操作，只广播一条汇总消息
+
+    operations 中每项为 {"op": "save", "record": {...}, "old_issue_number": 可选}
+    或 {"op": "delete", "issue_number": ...}；任一操作失败则全部不生效。
+    """
+    request_data = request.json or {}
+    client_id = request_data.get('client_id')
+    operations = request_data.get('operations') or []
 
+    batch_username = user_cache.display_name(request_data.get('username'))
+    if not batch_username:
+        return jsonify({"error": "未找到对应的中文名字"}), 404
+    if len(operations) > RN_BATCH_MAX_OPERATIONS:
+        return jsonify({"error": f"单次最多 {RN_BATCH_MAX_OPERATIONS} 个操作"}), 400
+    try:
+        issue_numbers = batch_operation_keys(operations)
+    except ValueError as e:
+        return jsonify({"error": "批量操作无效", "details": str(e)}), 400
+    if not issue_numbers:
+        return jsonify({"status": "success", "count": 0, "revision": get_rn_revision()})
+
+    keys = [f'rn_record:{issue_number}' for issue_number in issue_numbers]
+    for _ in range(RN_WRITE_RETRIES):
+        with redis_client.pipeline(transaction=True) as pipe:
+            try:
+                pipe.watch(*keys)
+                current = {issue_number: wire_codec.loads(data) if data else None
+                           for issue_number, data in zip(issue_numbers, pipe.mget(keys))}
+                try:
+                    changes = plan_rn_batch(operations, current)
+                except BatchOperationError as e:
+                    # index 指出失败的操作，离线队列重放时据此跳过冲突的操作
+                    status_code = 409 if e.conflict else 404
+                    return jsonify({"status": "conflict" if e.conflict else "error", "error": "批量操作失败",
+                                    "details": str(e), "index": e.index, "current": e.current}), status_code
+
+                pipe.multi()
+                for name, issue_number, old_issue_number, old_record, record in changes:
+                    if name == 'delete':
+                        remove_rn_record(pipe, issue_number, old_record)
+                    else:
+                        write_rn_record(pipe, issue_number, record, old_record=old_record,
+                                        old_issue_number=old_issue_number)
+                revision = pipe.execute()[-1]
+                break
+            except redis.WatchError:
+                continue
+    else:
+        return jsonify({"error": "记录正被其他用户修改，请稍后重试"}), 409
+
+    rn_cache.invalidate(*issue_numbers)
+    counts = {}
+    for change in changes:
+        name = BATCH_OPERATION_NAMES[change[0]]
+        counts[name] = counts.get(name, 0) + 1
+    message = {
+        'client_id': client_id,
+        'operation': 'batch',
+        'count': len(changes),
+        'issue_numbers': issue_numbers,
+        'username': batch_username,
+        'summary': "批量操作：" + "，".join(f"{name} {count} 条" for name, count in counts.items()) + "。",
+        'revision': revision
+    }
+    redis_client.publish('rn_channel', wire_codec.dumps(message))
+
+    return jsonify({"status": "success", "count": len(changes), "revision": revision})
+
+
+@bp.route('/rn_records/export', methods=['GET'])
+def export_rn_records():
+    """以 NDJSON 流式导出全部记录，每行一条；边 SCAN 边输出，不在内存中构造完整列表
+
+    SCAN 不是快照，导出期间发生的修改可能部分可见；X-RN-Revision 为开始导出时的修订号。
+    """
+    def generate():
+        for keys in iter_rn_key_batches():
+            yield b''.join(data + b'\n' for data in redis_client.mget(keys) if data is not None)
+
+    response = current_app.response_class(generate(), mimetype='application/x-ndjson')
+    response.headers['X-RN-Revision'] = str(get_rn_revision())
+    return response
+
+
+@bp.route('/rn_records/import', methods=['POST'])
+def import_rn_records():
+    """从 NDJSON 请求体批量导入记录，已存在的问题单号会被覆盖
+
+    每 RN_IMPORT_BATCH_SIZE 条在一个事务中写入（同时维护索引和变更日志），并以 NDJSON 流式返回进度，
+    最后一行为汇总结果。结束时只广播一条 import 消息；Redis 出错或客户端中途断开时，已提交的批次同样广播。
+    """
+    client_id = request.args.get('client_id')
+    import_username = user_cache.display_name(request.args.get('username'))
+    if not import_username:
+        return jsonify({"error": "未找到对应的中文名字"}), 404
+
+    def generate():
+        imported, failed, revision = 0, 0, None
+        failed_lines = []
+        batch = {}
+
+        def flush():
+            nonlocal imported, failed, revision
+            try:
+                batch_revision = import_rn_batch(batch)
+            finally:
+                # 事务出错时无法确定是否已提交，同样使缓存失效
+                rn_cache.invalidate(*batch)
+            if batch_revision is None:
+                failed += len(batch)
+            else:
+                imported += len(batch)
+                revision = batch_revision
+            batch.clear()
+            return wire_codec.dumps({"imported": imported, "failed": failed}) + '\n'
+
+        error = None
+        try:
+            for line_number, line in enumerate(request.stream, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    issue_number, record = parse_import_line(line)
+                except ValueError:
+                    failed += 1
+                    if len(failed_lines) < 100:
+                        failed_lines.append(line_number)
+                    continue
+                # 同一批中重复的问题单号只保留最后一条
+                batch.pop(issue_number, None)
+                batch[issue_number] = record
+                if len(batch) >= RN_IMPORT_BATCH_SIZE:
+                    yield flush()
+            if batch:
+                yield flush()
+        except redis.RedisError as e:
+            error = e
+        finally:
+            # 其他 worker 的缓存和已连接的客户端都靠这条广播失效和增量同步
+            if imported:
+                try:
+                    redis_client.publish('rn_channel', wire_codec.dumps(
+                        import_message(client_id, import_username, imported, revision)))
+                except redis.RedisError as e:
+                    print(f"Error publishing import message: {e}")
+
+        if error is not None:
+            yield wire_codec.dumps({"status": "error", "error": "导入中断", "details": str(error),
+                                    "imported": imported, "failed": failed}) + '\n'
+            return
+
+        yield wire_codec.dumps({"status": "success", "imported": imported, "failed": failed,
+                                "failed_lines": failed_lines, "revision": revision}) + '\n'
+
+    return current_app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@bp.route('/rn_changes', methods=['GET'])
+def get_rn_changes():
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({"error": "since 是必填项"}), 400
+
+    # 在同一个事务中读取修订号和日志，保证三者来自同一时刻
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.get('rn_revision')
+    pipe.xrange('rn_changes', min=f'{since + 1}-0', max='+', count=RN_CHANGES_PAGE_SIZE)
+    pipe.xrange('rn_changes', count=1)
+    revision, entries, oldest = pipe.execute()
+    revision = int(revision or 0)
+
+    # 日志已被截断到 since 之后，或服务器修订号比客户端还旧，只能全量重新加载
+    oldest_revision = int(oldest[0][0].split(b'-')[0]) if oldest else revision + 1
+    if since > revision or (since < revision and oldest_revision > since + 1):
+        return jsonify({"reset": True, "revision": revision, "changes": []})
+
+    changes = []
+    for entry_id, fields in entries:
+        fields = {key.decode('utf-8'): value.decode('utf-8') for key, value in fields.items()}
+        changes.append({
+            'revision': int(entry_id.split(b'-')[0]),
+            'operation': fields['operation'],
+            'issue_number': fields['issue_number'],
+            'old_issue_number': fields['old_issue_number'] or None,
+            'rn_record': wire_codec.loads(fields['rn_record']) if fields['rn_record'] else None
+        })
+
+    return jsonify({
+        "reset": False,
+        "revision": changes[-1]['revision'] if changes else revision,
+        "has_more": len(changes) == RN_CHANGES_PAGE_SIZE,
+        "changes": changes
+    })
+
+
+@bp.route('/search_rn_records', methods=['POST'])
+def search_rn_records():
+    request_data = request.json or {}
+    filters = request_data.get('filters') or []
+
+    try:
+        # 先用索引集合的 SINTER 缩小候选集，再逐条校验全部条件以剔除误命中
+        candidate_keys = rn_candidate_keys(filters)
+        if candidate_keys:
+            issue_numbers = sorted(member.decode('utf-8') for member in redis_client.sinter(candidate_keys))
+            rn_records = load_rn_records_by_issue_numbers(issue_numbers)
+        else:
+            rn_records = load_rn_records_bulk()
+        matched_records = filter_records(rn_records, filters)
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": "过滤条件无效", "details": str(e)}), 400
 
-@app.route('/save_all', methods=['POST'])
+    # 过滤基于完整记录，投影只作用于返回结果
+    fields = parse_fields(request_data.get('fields'))
+    if fields:
+        matched_records = [project_record(record, fields) for record in matched_records]
+    return jsonify(matched_records)
+
+
+@bp.route('/save_all', methods=['POST'])
 def save_all_route():
     request_data = request.json
     table_name = request_data['table_name']
     client_id = request_data.get('client_id')
 
-    with rw_lock.gen_wlock():
-        redis_client.set(f'{table_name}_data', json.dumps(request_data['data']))
-        redis_client.set(f'{table_name}_merged_cells', json.dumps(request_data['merged_cells']))
-
-        message_data = {
-            'table_name': table_name,
-            'client_id': client_id,
-            'message': '数据已更新'
-        }
-        redis_client.publish('table_updates', json.dumps(message_data))
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.set(f'{table_name}_data', wire_codec.dumps(request_data['data']))
+    pipe.set(f'{table_name}_merged_cells', wire_codec.dumps(request_data['merged_cells']))
+    pipe.incr(f'{table_name}_version')
+    version = pipe.execute()[-1]
+
+    message_data = {
+        'table_name': table_name,
+        'client_id': client_id,
+        'message': '数据已更新',
+        'version': version
+    }
+    redis_client.publish('table_updates', wire_codec.dumps(message_data))
 
-    return jsonify({"status": "success"})
+    return jsonify({"status": "success", "version": version})
 
 
-@app.route('/get_all', methods=['POST'])
+@bp.route('/get_all', methods=['POST'])
 def get_all_route():
     request_data = request.json
     table_name = request_data['table_name']
 
-    with rw_lock.gen_rlock():
-        table_data_json = redis_client.get(f'{table_name}_data')
-        merged_cells_json = redis_client.get(f'{table_name}_merged_cells')
-
-        result = {
-            "table_data": json.loads(table_data_json) if table_data_json else [],
-            "merged_cells": json.loads(merged_cells_json) if merged_cells_json else []
-        }
+    # 版本号与数据在同一个事务中读取，避免返回的版本号与内容不一致
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.get(f'{table_name}_version')
+    pipe.get(f'{table_name}_data')
+    pipe.get(f'{table_name}_merged_cells')
+    version, table_data_json, merged_cells_json = pipe.execute()
+    version = int(version or 0)
+    etag = f'{table_name}-{version}'
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    # 存储的就是 JSON，按片段拼接输出，不再解析后重新序列化
+    response = stream_json_response([
+        b'{"status":"success","data":{"table_data":', table_data_json or b'[]',
+        b',"merged_cells":', merged_cells_json or b'[]',
+        b'},"version":%d}' % version
+    ])
+    response.set_etag(etag)
+    return response
+
+
+@bp.route('/patch_table', methods=['POST'])
+def patch_table_route():
+    request_data = request.json
+    table_name = request_data['table_name']
+    client_id = request_data.get('client_id')
+    base_version = request_data.get('base_version')
+    ops = request_data.get('ops') or []
+
+    version_key = f'{table_name}_version'
+    with redis_client.pipeline(transaction=True) as pipe:
+        try:
+            # WATCH 版本号：读取到写入之间若有其他进程修改表格，EXEC 会失败
+            pipe.watch(version_key)
+            current_version = int(pipe.get(version_key) or 0)
+            if base_version != current_version:
+                return jsonify({"status": "conflict", "error": "表格已被其他用户修改",
+                                "version": current_version}), 409
+
+            table_data_json = pipe.get(f'{table_name}_data')
+            merged_cells_json = pipe.get(f'{table_name}_merged_cells')
+            try:
+                table_data, merged_cells = apply_table_patch(
+                    wire_codec.loads(table_data_json) if table_data_json else [],
+                    wire_codec.loads(merged_cells_json) if merged_cells_json else [],
+                    ops
+                )
+            except ValueError as e:
+                return jsonify({"status": "error", "error": "补丁无效", "details": str(e)}), 400
+
+            pipe.multi()
+            pipe.set(f'{table_name}_data', wire_codec.dumps(table_data))
+            pipe.set(f'{table_name}_merged_cells', wire_codec.dumps(merged_cells))
+            pipe.incr(version_key)
+            version = pipe.execute()[-1]
+        except redis.WatchError:
+            return jsonify({"status": "conflict", "error": "表格已被其他用户修改",
+                            "version": get_table_version(table_name)}), 409
+
+    # 只广播补丁本身，其他客户端无需重新下载整张表
+    message_data = {
+        'table_name': table_name,
+        'client_id': client_id,
+        'message': '数据已更新',
+        'base_version': base_version,
+        'version': version,
+        'patch': ops
+    }
+    redis_client.publish('table_updates', wire_codec.dumps(message_data))
 
-    return jsonify({"status": "success", "data": result})
+    return jsonify({"status": "success", "version": version})
 
 
-@app.route('/save_table', methods=['POST'])
+@bp.route('/save_table', methods=['POST'])
 def save_table_route():
     request_data = request.json
     table_name = request_data['table_name']
 
-    with rw_lock.gen_wlock():
-        redis_client.set(f'{table_name}_data', json.dumps(request_data['data']))
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.set(f'{table_name}_data', wire_codec.dumps(request_data['data']))
+    pipe.incr(f'{table_name}_version')
+    version = pipe.execute()[-1]
 
-    return jsonify({"status": "success"})
+    return jsonify({"status": "success", "version": version})
 
 
-@app.route('/get_table', methods=['POST'])
+@bp.route('/get_table', methods=['POST'])
 def get_table_route():
     request_data = request.json
     table_name = request_data['table_name']
 
-    with rw_lock.gen_rlock():
-        table_data_json = redis_client.get(f'{table_name}_data')
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.get(f'{table_name}_version')
+    pipe.get(f'{table_name}_data')
+    version, table_data_json = pipe.execute()
+    version = int(version or 0)
+    etag = f'{table_name}-{version}'
+    response = not_modified(etag)
+    if response is not None:
+        return response
 
-    return jsonify({"status": "success", "data": json.loads(table_data_json) if table_data_json else []})
+    response = stream_json_response([
+        b'{"status":"success","data":', table_data_json or b'[]', b',"version":%d}' % version
+    ])
+    response.set_etag(etag)
+    return response
 
 
-@app.route('/save_merged_cells', methods=['POST'])
+@bp.route('/save_merged_cells', methods=['POST'])
 def save_merged_cells_route():
     request_data = request.json
     table_name = request_data['table_name']
 
-    with rw_lock.gen_wlock():
-        redis_client.set(f'{table_name}_merged_cells', json.dumps(request_data['merged_cells']))
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.set(f'{table_name}_merged_cells', wire_codec.dumps(request_data['merged_cells']))
+    pipe.incr(f'{table_name}_version')
+    version = pipe.execute()[-1]
 
-    return jsonify({"status": "success"})
+    return jsonify({"status": "success", "version": version})
 
 
-@app.route('/get_permissions', methods=['POST'])
+@bp.route('/get_permissions', methods=['POST'])
 def get_permissions_route():
     request_data = request.json
     permission_username = request_data.get('username')
 
-    with rw_lock.gen_rlock():
-        permissions = redis_client.get(f'permissions_{permission_username}')
+    permissions = user_cache.permissions(permission_username)
 
     if permissions is not None:
-        return jsonify({"status": "success", "permissions": int(permissions)})
+        return jsonify({"status": "success", "permissions": permissions})
     else:
         return jsonify({"status": "error", "message": "No permissions found for user"})
 
 
 if __name__ == '__main__':
-    username_list = {
-        'c50039964': '蔡佳文',
-        'c50039960': '赵良媛'
-    }
-
-    for username, name in username_list.items():
-        redis_client.hset('kpi_username', username, name)
-        print({username}, {name})
-
-    user_permissions = {
-        'c50039960': 1,
-        'c50039964': 1,
-        'c50039961': 2,
-        'c50039962': 3,
-        'c50039963': 4,
-        'c50039965': 6,
-        'c50039966': 7
-    }
-    for username, permissions in user_permissions.items():
-        redis_client.set(f'permissions_{username}', permissions)
-
-    app.run(host="0.0.0.0", port=5002)
+    # 开发环境单进程运行；生产环境用 serve.py 启动多个 worker，用户与权限用 seed_data.py 写入
+    config = load_config()
+    if '--rebuild-index' in sys.argv:
+        redis_client = create_redis_client(config)
+        print(f"Rebuilt index for {rebuild_index(redis_client, RN_FETCH_BATCH_SIZE)} records.")
+        print(f"Rebuilt full-text index for {rebuild_fulltext_index(redis_client, RN_FETCH_BATCH_SIZE)} records.")
+        sys.exit(0)
+
+    create_app(config).run(host=config['SERVER_HOST'], port=config['SERVER_PORT'])
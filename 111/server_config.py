@@ -0,0 +1,26 @@
+import os
+
+# 服务端配置项及默认值，均可用同名环境变量覆盖
+DEFAULT_CONFIG = {
+    'REDIS_HOST': 'localhost',
+    'REDIS_PORT': 6379,
+    'REDIS_DB': 0,
+    'REDIS_MAX_CONNECTIONS': 50,
+    'RN_CACHE_MAX_BYTES': 64 * 1024 * 1024,  # 进程内记录缓存的上限，0 表示不缓存
+    'USER_CACHE_TTL': 300,  # 用户中文名与权限的缓存秒数，0 表示不缓存
+    'SERVER_HOST': '0.0.0.0',
+    'SERVER_PORT': 5002,
+    'SERVER_WORKERS': os.cpu_count() or 1,
+    'SERVER_THREADS': 4,
+    'SEED_FILE': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'seed_users.json'),
+}
+
+
+def load_config(**overrides):
+    """读取配置：环境变量优先于默认值，overrides 优先于环境变量"""
+    config = {}
+    for key, default in DEFAULT_CONFIG.items():
+        value = os.environ.get(key)
+        config[key] = default if value is None else type(default)(value)
+    config.update(overrides)
+    return config
@@ -0,0 +1,122 @@
+from table_format import (DEFAULT_STYLE, DEFAULT_ROW_HEIGHT, DEFAULT_COLUMN_WIDTH,
+                          load_table, dump_table, style_from_legacy_cell)
+
+
+def _shift_cells(cells, axis, start, delta, removed_end=None):
+    """平移 axis（0 为行，1 为列）上不小于 start 的单元格；removed_end 不为空时先删除 [start, removed_end) 内的单元格"""
+    shifted = {}
+    for position, value in cells.items():
+        index = position[axis]
+        if removed_end is not None and start <= index < removed_end:
+            continue
+        if index >= (removed_end if removed_end is not None else start):
+            position = (position[0] + delta, position[1]) if axis == 0 else (position[0], position[1] + delta)
+        shifted[position] = value
+    return shifted
+
+
+def _check_index(index, size, name, allow_end=False):
+    """index 必须落在 [0, size) 内；allow_end 为 True 时允许等于 size（插入到末尾）"""
+    if index < 0 or index > size or (index == size and not allow_end):
+        raise ValueError(f"{name} {index} 超出表格范围")
+
+
+def _check_non_negative(value, name='数量'):
+    if value < 0:
+        raise ValueError(f"{name} {value} 不能为负数")
+
+
+def _insert_rows(table, row, count):
+    _check_index(row, table['rows'], '行', allow_end=True)
+    _check_non_negative(count)
+    table['cells'] = _shift_cells(table['cells'], 0, row, count)
+    table['row_heights'][row:row] = [DEFAULT_ROW_HEIGHT] * count
+    table['rows'] += count
+
+
+def _delete_rows(table, row, count):
+    _check_index(row, table['rows'], '行')
+    _check_non_negative(count)
+    count = min(count, table['rows'] - row)
+    table['cells'] = _shift_cells(table['cells'], 0, row, -count, removed_end=row + count)
+    del table['row_heights'][row:row + count]
+    table['rows'] -= count
+
+
+def _insert_columns(table, col, count):
+    _check_index(col, table['columns'], '列', allow_end=True)
+    _check_non_negative(count)
+    table['cells'] = _shift_cells(table['cells'], 1, col, count)
+    table['column_widths'][col:col] = [DEFAULT_COLUMN_WIDTH] * count
+    table['columns'] += count
+
+
+def _delete_columns(table, col, count):
+    _check_index(col, table['columns'], '列')
+    _check_non_negative(count)
+    count = min(count, table['columns'] - col)
+    table['cells'] = _shift_cells(table['cells'], 1, col, -count, removed_end=col + count)
+    del table['column_widths'][col:col + count]
+    table['columns'] -= count
+
+
+def _set_cell(table, op):
+    row, col = int(op['row']), int(op['col'])
+    if not (0 <= row < table['rows'] and 0 <= col < table['columns']):
+        raise ValueError(f"单元格 ({row}, {col}) 超出表格范围")
+    if 'cell' in op:
+        # 兼容旧客户端发送的完整单元格字典
+        text, style = op['cell'].get('text', ''), style_from_legacy_cell(op['cell'])
+    else:
+        text, style = op.get('text', ''), op.get('style', DEFAULT_STYLE)
+    table['cells'][(row, col)] = (text, tuple(style))
+
+
+def _set_row_height(table, row, height):
+    _check_index(row, table['rows'], '行')
+    _check_non_negative(height, '行高')
+    table['row_heights'][row] = height
+
+
+def _set_column_width(table, col, width):
+    _check_index(col, table['columns'], '列')
+    _check_non_negative(width, '列宽')
+    table['column_widths'][col] = width
+
+
+def apply_table_patch(table_data, merged_cells, ops):
+    """按顺序把补丁操作应用到表格数据上，返回紧凑格式的 (table_data, merged_cells)
+
+    table_data 可以是旧格式，应用补丁后统一写成紧凑格式。支持的操作：
+    - {"op": "set_cell", "row", "col", "text", "style"}
+    - {"op": "insert_rows" / "delete_rows", "row", "count"}
+    - {"op": "insert_columns" / "delete_columns", "col", "count"}
+    - {"op": "set_row_height", "row", "height"} / {"op": "set_column_width", "col", "width"}
+    - {"op": "set_merged_cells", "merged_cells"}
+    操作无效时抛出 ValueError。
+    """
+    table = load_table(table_data)
+    for op in ops:
+        try:
+            name = op['op']
+            if name == 'set_cell':
+                _set_cell(table, op)
+            elif name == 'insert_rows':
+                _insert_rows(table, int(op['row']), int(op.get('count', 1)))
+            elif name == 'delete_rows':
+                _delete_rows(table, int(op['row']), int(op.get('count', 1)))
+            elif name == 'insert_columns':
+                _insert_columns(table, int(op['col']), int(op.get('count', 1)))
+            elif name == 'delete_columns':
+                _delete_columns(table, int(op['col']), int(op.get('count', 1)))
+            elif name == 'set_row_height':
+                _set_row_height(table, int(op['row']), int(op['height']))
+            elif name == 'set_column_width':
+                _set_column_width(table, int(op['col']), int(op['width']))
+            elif name == 'set_merged_cells':
+                merged_cells = op['merged_cells']
+            else:
+                raise ValueError(f"未知的补丁操作: {name}")
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"无效的补丁操作 {op}: {e}")
+    return dump_table(table), merged_cells
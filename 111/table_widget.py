@@ -1,6 +1,11 @@
 from PySide6.QtWidgets import QTableWidget, QTableWidgetItem, QAbstractItemView, QMenu, QMessageBox
-from PySide6.QtCore import Qt
-import re
+from PySide6.QtCore import Qt, QTimer
+
+RN_PAGE_SIZE = 200  # 每次向服务器请求的记录数
+FETCH_MORE_THRESHOLD = 20  # 滚动到距底部不足这么多行时加载下一页
+# 列表只加载表格显示的字段和版本号，完整记录在查看/编辑时按需获取；版本号用于删除时检测冲突
+LIST_FIELDS = ['问题单号', '问题描述', 'version']
+PARTIAL_RECORD_ROLE = Qt.UserRole + 1  # 行中的记录只有摘要字段时为 True
 
 class TableWidget(QTableWidget):
     def __init__(self, parent=None, client=None, main_window=None):
@@ -16,69 +21,108 @@ class TableWidget(QTableWidget):
         self.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.doubleClicked.connect(main_window.open_html_viewer)
 
-    def load_table_data(self, filters=None):
-        print("Loading table data...")
-        records = self.client.get_all_rn_records()
-        print(records)
-        print(f"Records fetched: {len(records)}")
+        # 网络请求在工作线程中执行，结果回到 GUI 线程后再更新表格
+        self.tasks = main_window.tasks
 
-        if filters:
-            filtered_records = []
-            for record in records:
-                record_matches = set()  # 用于存储已经过滤的键
-                include_record = True
-
-                for filter_type, filter_key, filter_value in filters:
-                    if filter_key in record_matches:
-                        continue  # 如果该键已经被过滤过，则跳过
-
-                    if filter_type == 'exact':
-                        # 精确匹配
-                        if filter_key in record and re.escape(record[filter_key]) == filter_value:
-                            record_matches.add(filter_key)
-                        else:
-                            include_record = False
-                            break
-
-                    elif filter_type == 'contains':
-                        # 模糊匹配
-                        if filter_key in record and re.search(filter_value, record[filter_key], re.IGNORECASE):
-                            record_matches.add(filter_key)
-                        else:
-                            include_record = False
-                            break
-
-                    elif filter_type == 'free':
-                        # 自由形式搜索，搜索所有键值对
-                        if any(re.search(filter_value, str(value), re.IGNORECASE) for key, value in record.items()):
-                            # 如果有任意一个值匹配
-                            record_matches.add(filter_key)  # 这里的key是None，我们可以跳过这个记录
-                        else:
-                            include_record = False
-                            break
-
-                if include_record:
-                    filtered_records.append(record)
-
-            records = filtered_records
-            print(f"Records after filtering: {len(records)}")
+        # 分页加载状态：sort_key 为 issue_number 或 modified，next_cursor 为 None 表示已全部加载
+        self.sort_key = 'issue_number'
+        self.next_cursor = None
+        self.has_more = False
+        self.fetching = False  # 正在加载下一页
+        self.verticalScrollBar().valueChanged.connect(self.on_scroll)
 
+    def load_table_data(self, filters=None):
+        print("Loading table data...")
         self.setRowCount(0)  # 清空表格内容
-        print("Cleared the table.")
+        self.next_cursor = None
+        self.has_more = False
+        self.fetching = False
 
+        # 搜索和分页共用同一个 key，新的加载会取代尚未返回的旧请求
+        if filters:
+            # 过滤在服务器端完成，只下载命中的记录
+            self.tasks.run('rn_list', self.client.search_rn_records, filters, LIST_FIELDS,
+                           on_done=self.on_search_loaded, on_error=self.on_load_failed)
+            return
+
+        # 先只加载第一页，其余页随滚动按需加载
+        self.has_more = True
+        self.fetch_more()
+
+    def show_records(self, records, next_cursor=None):
+        """显示一份记录列表（如本地缓存），取代尚未返回的加载请求；next_cursor 不为 None 时其余页随滚动从该游标加载"""
+        self.tasks.cancel('rn_list')
+        self.setRowCount(0)
+        self.next_cursor = None
+        self.fetching = False
+        self.append_records(records)
+        self.next_cursor = next_cursor
+        self.has_more = next_cursor is not None
+        QTimer.singleShot(0, self.fill_viewport)
+
+    def fetch_more(self):
+        """在工作线程中加载下一页记录；上一页还没返回时不重复请求"""
+        if not self.has_more or self.fetching:
+            return
+        self.fetching = True
+        self.tasks.run('rn_list', self.client.get_rn_records_page, self.next_cursor, RN_PAGE_SIZE,
+                       self.sort_key, LIST_FIELDS, on_done=self.on_page_loaded, on_error=self.on_load_failed)
+
+    def on_page_loaded(self, page):
+        """追加一页记录；表格还没有填满可见区域时继续加载"""
+        self.fetching = False
+        if page is None:
+            self.has_more = False
+            return
+        self.append_records(page['records'])
+        # 新加载的页可能包含离线队列中已修改或删除的记录
+        self.main_window.apply_pending_changes()
+        self.next_cursor = page.get('next_cursor')
+        self.has_more = self.next_cursor is not None
+        print(f"Loaded {self.rowCount()} of {page.get('total')} records.")
+        QTimer.singleShot(0, self.fill_viewport)
+
+    def on_search_loaded(self, records):
+        print(f"Records after filtering: {len(records)}")
+        self.append_records(records)
+
+    def on_load_failed(self, message):
+        self.fetching = False
+        self.has_more = False
+        print(f"Error loading table data: {message}")
+
+    def fill_viewport(self):
+        if self.has_more and self.verticalScrollBar().maximum() == 0:
+            self.fetch_more()
+
+    def on_scroll(self, value):
+        scroll_bar = self.verticalScrollBar()
+        if self.has_more and value >= scroll_bar.maximum() - FETCH_MORE_THRESHOLD:
+            self.fetch_more()
+
+    def append_records(self, records):
+        """追加记录到表格末尾；增量同步期间可能已插入的记录不重复添加"""
+        existing = set()
+        if self.next_cursor is not None:
+            existing = {self.item(row, 0).text() for row in range(self.rowCount()) if self.item(row, 0)}
+
+        self.setUpdatesEnabled(False)
         for record in records:
+            issue_number = record.get('问题单号', '')
+            if issue_number in existing:
+                continue
             row_position = self.rowCount()
             self.insertRow(row_position)
-            print(f"Inserting row at position {row_position}: {record}")
-            issue_number_item = QTableWidgetItem(record.get('问题单号', ''))
+            issue_number_item = QTableWidgetItem(issue_number)
             description_item = QTableWidgetItem(record.get('问题描述', ''))
 
-            # 将记录保存到每行的 UserRole 中
+            # 将记录（可能只有摘要字段）保存到每行的 UserRole 中
             issue_number_item.setData(Qt.UserRole, record)
+            issue_number_item.setData(PARTIAL_RECORD_ROLE, True)
 
             self.setItem(row_position, 0, issue_number_item)
             self.setItem(row_position, 1, description_item)
-        print("Table data loaded successfully.")
+        self.setUpdatesEnabled(True)
 
     def show_context_menu(self, position):
         menu = QMenu()
@@ -0,0 +1,131 @@
+import itertools
+import traceback
+from concurrent.futures import Future
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal, Slot
+
+
+class _TaskSignals(QObject):
+    # 在工作线程中发出，TaskRunner 位于 GUI 线程，连接自动排队到 GUI 线程执行
+    finished = Signal(int, object)
+    failed = Signal(int, str)
+
+
+class _Task(QRunnable):
+    def __init__(self, task_id, fn, args, kwargs):
+        super().__init__()
+        # 由 TaskRunner 持有引用，完成或取消后释放；不交给线程池删除，tryTake 取消后仍可安全访问
+        self.setAutoDelete(False)
+        self.task_id = task_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = _TaskSignals()
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            traceback.print_exc()
+            self.signals.failed.emit(self.task_id, str(e))
+        else:
+            self.signals.finished.emit(self.task_id, result)
+
+
+class TaskRunner(QObject):
+    """在 QThreadPool 的工作线程中执行阻塞的网络请求，结果通过 Qt 信号回到 GUI 线程再调用回调
+
+    111/task_runner.py 与 cccc/function/task_runner.py 是同一份实现，修改时两处保持一致。
+    同一 key 的新请求会取代旧请求：旧请求若还在排队则直接取消，已在执行的网络请求无法中断，完成后丢弃其结果。
+    busy_changed 在有无未完成请求之间切换时发出，用于显示忙碌指示。
+    """
+    busy_changed = Signal(bool)
+
+    def __init__(self, parent=None, thread_pool=None):
+        super().__init__(parent)
+        self.thread_pool = thread_pool or QThreadPool.globalInstance()
+        self._ids = itertools.count(1)
+        self._tasks = {}  # task_id -> (任务或 Future, key, 成功回调, 失败回调)
+        self._latest = {}  # key -> 最新的 task_id
+        # Future 的完成回调在其线程池的线程中执行，经由这个信号对象回到 GUI 线程
+        self._future_signals = _TaskSignals(self)
+        self._future_signals.finished.connect(self._on_finished)
+        self._future_signals.failed.connect(self._on_failed)
+
+    def run(self, key, fn, *args, on_done=None, on_error=None, **kwargs):
+        """提交 fn(*args, **kwargs)；key 为 None 的请求互不取代（如写操作）"""
+        if key is not None:
+            self.cancel(key)
+        task_id = next(self._ids)
+        task = _Task(task_id, fn, args, kwargs)
+        task.signals.finished.connect(self._on_finished)
+        task.signals.failed.connect(self._on_failed)
+        self._track(task_id, task, key, on_done, on_error)
+        self.thread_pool.start(task)
+        return task_id
+
+    def run_future(self, key, future, on_done=None, on_error=None):
+        """等待已经提交的 Future（如 DataClient 各方法的返回值），完成后在 GUI 线程调用回调；key 的含义同 run"""
+        if key is not None:
+            self.cancel(key)
+        task_id = next(self._ids)
+        self._track(task_id, future, key, on_done, on_error)
+
+        def done(future):
+            if future.cancelled():
+                return
+            error = future.exception()
+            if error is not None:
+                self._future_signals.failed.emit(task_id, str(error))
+            else:
+                self._future_signals.finished.emit(task_id, future.result())
+
+        future.add_done_callback(done)
+        return task_id
+
+    def _track(self, task_id, handle, key, on_done, on_error):
+        was_busy = self.is_busy()
+        self._tasks[task_id] = (handle, key, on_done, on_error)
+        if key is not None:
+            self._latest[key] = task_id
+        if not was_busy:
+            self.busy_changed.emit(True)
+
+    def cancel(self, key):
+        """取消 key 对应的未完成请求，之后不会再调用它的回调"""
+        task_id = self._latest.pop(key, None)
+        if task_id is None or task_id not in self._tasks:
+            return
+        handle = self._tasks[task_id][0]
+        if isinstance(handle, Future):
+            cancelled = handle.cancel()
+        else:
+            cancelled = self.thread_pool.tryTake(handle)
+        if cancelled:
+            self._finish(task_id)
+        else:
+            # 已在执行，保留记录以便完成时计数，回调置空
+            self._tasks[task_id] = (handle, None, None, None)
+
+    def is_busy(self):
+        return bool(self._tasks)
+
+    @Slot(int, object)
+    def _on_finished(self, task_id, result):
+        entry = self._finish(task_id)
+        if entry and entry[2]:
+            entry[2](result)
+
+    @Slot(int, str)
+    def _on_failed(self, task_id, message):
+        entry = self._finish(task_id)
+        if entry and entry[3]:
+            entry[3](message)
+
+    def _finish(self, task_id):
+        entry = self._tasks.pop(task_id, None)
+        if entry and entry[1] is not None and self._latest.get(entry[1]) == task_id:
+            del self._latest[entry[1]]
+        if entry and not self._tasks:
+            self.busy_changed.emit(False)
+        return entry
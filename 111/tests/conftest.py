@@ -0,0 +1,50 @@
+import os
+import sys
+
+import fakeredis
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server  # noqa: E402
+from server_config import load_config  # noqa: E402
+
+USERNAME = 'u1'
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    fake = fakeredis.FakeRedis()
+    monkeypatch.setattr(server, 'create_redis_client', lambda config: fake)
+    fake.hset('kpi_username', USERNAME, '测试用户')
+    fake.set(f'permissions_{USERNAME}', 1)
+    return fake
+
+
+@pytest.fixture
+def async_redis_server():
+    fake_server = fakeredis.FakeServer()
+    fakeredis.FakeRedis(server=fake_server).hset('kpi_username', USERNAME, '测试用户')
+    return fake_server
+
+
+@pytest.fixture
+def async_app(monkeypatch, async_redis_server):
+    """Redis 替换为 fakeredis 的 ASGI 应用；同步检查数据时用 FakeRedis(server=async_redis_server)"""
+    async_server = pytest.importorskip('async_server')
+    monkeypatch.setattr(async_server, 'create_redis_client',
+                        lambda config: fakeredis.FakeAsyncRedis(server=async_redis_server))
+    return async_server.create_app(load_config(RN_CACHE_MAX_BYTES=0, USER_CACHE_TTL=0))
+
+
+@pytest.fixture
+def client(redis_client):
+    # 不启动缓存失效的订阅线程，每个请求直接读 Redis
+    app = server.create_app(load_config(RN_CACHE_MAX_BYTES=0, USER_CACHE_TTL=0))
+    return app.test_client()
+
+
+def make_record(issue_number, **fields):
+    record = {'issue_number': issue_number, '问题单号': issue_number, 'username': USERNAME, 'client_id': 'c1'}
+    record.update(fields)
+    return record
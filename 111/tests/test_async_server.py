@@ -0,0 +1,131 @@
+import asyncio
+import gzip
+
+import fakeredis
+
+import wire_codec
+from conftest import USERNAME, make_record
+from user_cache import USER_UPDATES_CHANNEL, AsyncUserCache, listen_user_updates
+
+
+def request(async_app, method, path, **kwargs):
+    async def run():
+        response = await getattr(async_app.test_client(), method)(path, **kwargs)
+        return response.status_code, await response.get_json()
+    return asyncio.run(run())
+
+
+def batch(async_app, operations):
+    return request(async_app, 'post', '/rn_records/batch',
+                   json={'operations': operations, 'client_id': 'c1', 'username': USERNAME})
+
+
+def test_batch_applies_operations_in_one_transaction(async_app, async_redis_server):
+    status, result = batch(async_app, [
+        {'op': 'save', 'record': make_record('A1'), 'base_version': 0},
+        {'op': 'save', 'record': make_record('B2')},
+        {'op': 'save', 'record': make_record('C3'), 'old_issue_number': 'B2', 'base_version': 1},
+    ])
+    assert (status, result['count']) == (200, 3)
+    redis_client = fakeredis.FakeRedis(server=async_redis_server)
+    assert sorted(key.decode('utf-8') for key in redis_client.keys('rn_record:*')) == ['rn_record:A1', 'rn_record:C3']
+    assert wire_codec.loads(redis_client.get('rn_record:C3'))['version'] == 2
+
+
+def test_batch_conflict_reports_failed_operation(async_app, async_redis_server):
+    batch(async_app, [{'op': 'save', 'record': make_record('A1')}])
+    status, result = batch(async_app, [
+        {'op': 'save', 'record': make_record('B2')},
+        {'op': 'delete', 'issue_number': 'A1', 'base_version': 5},
+    ])
+    assert (status, result['index'], result['current']['version']) == (409, 1, 1)
+    # 整批回滚
+    assert not fakeredis.FakeRedis(server=async_redis_server).exists('rn_record:B2')
+
+    status, result = batch(async_app, [{'op': 'delete', 'issue_number': 'Z9'}])
+    assert (status, result['index']) == (404, 0)
+
+
+def test_get_all_rn_records_pages_and_projects(async_app):
+    batch(async_app, [{'op': 'save', 'record': make_record(issue_number, 问题描述=f'描述{issue_number}')}
+                         for issue_number in ('C3', 'A1', 'B2')])
+
+    pages, cursor = [], None
+    while True:
+        query = {'limit': 2, 'fields': '问题描述'}
+        if cursor:
+            query['cursor'] = cursor
+        status, page = request(async_app, 'get', '/get_all_rn_records', query_string=query)
+        assert status == 200 and page['total'] == page['revision'] == 3
+        pages.append(page['records'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert pages == [[{'问题单号': 'A1', '问题描述': '描述A1'}, {'问题单号': 'B2', '问题描述': '描述B2'}],
+                     [{'问题单号': 'C3', '问题描述': '描述C3'}]]
+
+    status, page = request(async_app, 'get', '/get_all_rn_records', query_string={'limit': 1, 'sort': 'modified'})
+    assert status == 200 and len(page['records']) == 1 and page['next_cursor']
+
+    status, records = request(async_app, 'get', '/get_all_rn_records', query_string={'fields': '问题描述'})
+    assert sorted(records, key=lambda record: record['问题单号'])[0] == {'问题单号': 'A1', '问题描述': '描述A1'}
+
+    status, _ = request(async_app, 'get', '/get_all_rn_records', query_string={'limit': 0})
+    assert status == 400
+
+
+def test_user_cache_invalidated_by_user_updates(async_redis_server):
+    async def run():
+        redis_client = fakeredis.FakeAsyncRedis(server=async_redis_server)
+        cache = AsyncUserCache(redis_client, ttl=300)
+        listener = asyncio.create_task(listen_user_updates(redis_client, cache))
+        while (await redis_client.pubsub_numsub(USER_UPDATES_CHANNEL))[0][1] == 0:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+
+        assert await cache.display_name(USERNAME) == '测试用户'
+        await redis_client.hset('kpi_username', USERNAME, '新名字')
+        assert await cache.display_name(USERNAME) == '测试用户'
+
+        await redis_client.publish(USER_UPDATES_CHANNEL, wire_codec.dumps({'usernames': [USERNAME]}))
+        for _ in range(100):
+            if await cache.display_name(USERNAME) == '新名字':
+                break
+            await asyncio.sleep(0.01)
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+        await redis_client.aclose()
+        return await cache.display_name(USERNAME)
+    assert asyncio.run(run()) == '新名字'
+
+
+def test_get_all_rn_records_streams_and_caches_snapshot(async_app):
+    import async_server
+    async_server.rn_cache.max_bytes = 1024 * 1024
+    async_server.rn_cache.reset(enabled=True)  # 相当于已订阅 rn_channel
+    batch(async_app, [{'op': 'save', 'record': make_record(issue_number)} for issue_number in ('A1', 'B2')])
+
+    async def get_all():
+        response = await async_app.test_client().get('/get_all_rn_records', headers={'Accept-Encoding': 'gzip'})
+        body = await response.get_data()
+        if response.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return response.headers['X-RN-Revision'], sorted(record['问题单号'] for record in wire_codec.loads(body))
+
+    assert asyncio.run(get_all()) == ('2', ['A1', 'B2'])
+    assert async_server.rn_cache.get_snapshot()[0] == 2
+    assert asyncio.run(get_all()) == ('2', ['A1', 'B2'])
+
+    batch(async_app, [{'op': 'save', 'record': make_record('C3')}])
+    assert async_server.rn_cache.get_snapshot() is None
+    assert asyncio.run(get_all()) == ('3', ['A1', 'B2', 'C3'])
+
+
+def test_search_rn_records_projects_fields(async_app):
+    batch(async_app, [{'op': 'save', 'record': make_record(issue_number, 严重级别='严重', 问题描述=issue_number)}
+                      for issue_number in ('A1', 'B2')])
+    status, records = request(async_app, 'post', '/search_rn_records', json={
+        'filters': [['exact', '严重级别', '严重']], 'fields': ['问题描述']})
+    assert status == 200
+    assert sorted(records, key=lambda record: record['问题单号']) == [{'问题单号': 'A1', '问题描述': 'A1'},
+                                                                {'问题单号': 'B2', '问题描述': 'B2'}]
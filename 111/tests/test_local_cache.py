@@ -0,0 +1,37 @@
+from local_cache import LocalCache
+
+SERVER_URL = 'http://server'
+
+
+def cache(tmp_path):
+    return LocalCache(str(tmp_path / 'cache.db'), SERVER_URL)
+
+
+def test_partial_pages_are_loaded_with_their_cursor(tmp_path):
+    local_cache = cache(tmp_path)
+    assert local_cache.load_rn_records() is None
+    local_cache.add_rn_page([{'问题单号': 'B2'}, {'问题单号': 'A1'}], None, 'B2', revision=7)
+    # 重启后仍能读出已缓存的页，并从记下的游标继续
+    assert LocalCache(str(tmp_path / 'cache.db'), SERVER_URL).load_rn_records() == \
+        (7, [{'问题单号': 'A1'}, {'问题单号': 'B2'}], 'B2')
+
+    local_cache.add_rn_page([{'问题单号': 'C3'}], 'B2', None)
+    assert local_cache.load_rn_records() == (7, [{'问题单号': 'A1'}, {'问题单号': 'B2'}, {'问题单号': 'C3'}], None)
+
+
+def test_page_after_a_gap_is_not_cached(tmp_path):
+    local_cache = cache(tmp_path)
+    local_cache.add_rn_page([{'问题单号': 'A1'}], None, 'A1', revision=1)
+    local_cache.add_rn_page([{'问题单号': 'D4'}], 'C3', None)
+    assert local_cache.load_rn_records() == (1, [{'问题单号': 'A1'}], 'A1')
+
+
+def test_changes_extend_the_cache_and_a_broken_chain_clears_it(tmp_path):
+    local_cache = cache(tmp_path)
+    local_cache.add_rn_page([{'问题单号': 'A1'}, {'问题单号': 'B2'}], None, 'B2', revision=1)
+    local_cache.apply_rn_changes(1, 3, [{'operation': 'delete', 'issue_number': 'A1'},
+                                        {'operation': 'post', 'rn_record': {'问题单号': 'Z9'}}])
+    assert local_cache.load_rn_records() == (3, [{'问题单号': 'B2'}, {'问题单号': 'Z9'}], 'B2')
+
+    local_cache.apply_rn_changes(5, 6, [])
+    assert local_cache.load_rn_records() is None
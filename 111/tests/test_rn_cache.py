@@ -0,0 +1,33 @@
+from rn_cache import RecordCache
+
+
+def enabled_cache(max_bytes=100):
+    cache = RecordCache(max_bytes)
+    cache.reset(enabled=True)
+    return cache
+
+
+def test_tee_snapshot_stores_complete_body():
+    cache = enabled_cache()
+    assert b''.join(cache.tee_snapshot(3, iter([b'[', b'{}', b']']), cache.generation)) == b'[{}]'
+    assert cache.get_snapshot() == (3, b'[{}]')
+
+
+def test_tee_snapshot_is_single_flight():
+    cache = enabled_cache()
+    first = cache.tee_snapshot(1, iter([b'[', b'1', b']']), cache.generation)
+    assert next(first) == b'['
+    # 第一个请求仍在收集，并发的冷请求只转发
+    assert b''.join(cache.tee_snapshot(2, iter([b'[2]']), cache.generation)) == b'[2]'
+    assert cache.get_snapshot() is None
+    assert b''.join(first) == b'1]'
+    assert cache.get_snapshot() == (1, b'[1]')
+
+
+def test_tee_snapshot_releases_on_disconnect():
+    cache = enabled_cache()
+    first = cache.tee_snapshot(1, iter([b'[', b']']), cache.generation)
+    next(first)
+    first.close()
+    assert b''.join(cache.tee_snapshot(2, iter([b'[2]']), cache.generation)) == b'[2]'
+    assert cache.get_snapshot() == (2, b'[2]')
@@ -0,0 +1,76 @@
+import asyncio
+
+import fakeredis
+import redis
+
+import server
+import wire_codec
+from conftest import USERNAME, make_record
+
+
+def import_records(client, lines):
+    body = ''.join(line + '\n' for line in lines).encode('utf-8')
+    response = client.post(f'/rn_records/import?client_id=c1&username={USERNAME}', data=body,
+                           content_type='application/x-ndjson')
+    return [wire_codec.loads(line) for line in response.get_data().splitlines()]
+
+
+def test_export_import_round_trip(client, redis_client):
+    for issue_number in ('A1', 'B2', 'C3'):
+        client.post('/save_rn_record', json=make_record(issue_number, 问题描述=f'描述{issue_number}'))
+    exported = client.get('/rn_records/export').get_data().splitlines()
+    records = sorted((wire_codec.loads(line) for line in exported), key=lambda record: record['问题单号'])
+    assert [record['问题单号'] for record in records] == ['A1', 'B2', 'C3']
+
+    redis_client.flushdb()
+    redis_client.hset('kpi_username', USERNAME, '测试用户')
+    progress = import_records(client, [wire_codec.dumps(record) for record in records] + ['not json', '{}'])
+    summary = progress[-1]
+    assert (summary['status'], summary['imported'], summary['failed']) == ('success', 3, 2)
+    assert summary['failed_lines'] == [4, 5]
+    for record in records:
+        stored = wire_codec.loads(redis_client.get(f"rn_record:{record['问题单号']}"))
+        assert stored['问题描述'] == record['问题描述']
+    # 导入同样维护索引和变更日志
+    assert redis_client.zcard('rn_sort:issue_number') == 3
+    assert len(client.get('/rn_changes?since=0').get_json()['changes']) == 3
+
+
+def test_import_broadcasts_committed_batches_when_redis_fails(client, redis_client, monkeypatch):
+    monkeypatch.setattr(server, 'RN_IMPORT_BATCH_SIZE', 1)
+    original = server.import_rn_batch
+    calls = []
+
+    def failing_import(records):
+        calls.append(records)
+        if len(calls) > 1:
+            raise redis.ConnectionError('connection lost')
+        return original(records)
+
+    monkeypatch.setattr(server, 'import_rn_batch', failing_import)
+    pubsub = redis_client.pubsub()
+    pubsub.subscribe('rn_channel')
+    pubsub.get_message(timeout=1)
+
+    progress = import_records(client, [wire_codec.dumps(make_record('A1')), wire_codec.dumps(make_record('B2'))])
+    assert progress[-1]['status'] == 'error'
+    assert progress[-1]['imported'] == 1
+    message = pubsub.get_message(timeout=1)
+    assert wire_codec.loads(message['data'])['operation'] == 'import'
+    assert wire_codec.loads(message['data'])['count'] == 1
+
+
+def test_async_server_export_import_round_trip(async_app, async_redis_server):
+    async def run():
+        client = async_app.test_client()
+        lines = [wire_codec.dumps(make_record(issue_number)) for issue_number in ('A1', 'B2')] + ['bad']
+        response = await client.post(f'/rn_records/import?client_id=c1&username={USERNAME}',
+                                     data='\n'.join(lines).encode('utf-8'))
+        progress = [wire_codec.loads(line) for line in (await response.get_data()).splitlines()]
+        response = await client.get('/rn_records/export')
+        return progress, (await response.get_data()).splitlines()
+
+    progress, exported = asyncio.run(run())
+    assert (progress[-1]['imported'], progress[-1]['failed'], progress[-1]['failed_lines']) == (2, 1, [3])
+    assert sorted(wire_codec.loads(line)['问题单号'] for line in exported) == ['A1', 'B2']
+    assert fakeredis.FakeRedis(server=async_redis_server).zcard('rn_sort:issue_number') == 2
@@ -0,0 +1,93 @@
+import server
+from conftest import USERNAME, make_record
+from rn_index import RN_SORT_ISSUE_NUMBER_KEY, RN_SORT_MODIFIED_KEY, index_key, rebuild_index
+from rn_fulltext import gram_key
+from server_config import load_config
+
+
+def save(client, record, **extra):
+    return client.post('/save_rn_record', json=dict(record, **extra))
+
+
+def members(redis_client, key):
+    return {member.decode('utf-8') for member in redis_client.smembers(key)}
+
+
+def test_save_sets_version_and_indexes(client, redis_client):
+    response = save(client, make_record('A1', 严重级别='严重', 问题描述='网络中断'), base_version=0)
+    assert response.status_code == 200
+    assert response.get_json()['version'] == 1
+    assert members(redis_client, index_key('严重级别', '严重')) == {'A1'}
+    assert members(redis_client, gram_key('网络中')) == {'A1'}
+    assert redis_client.zrange(RN_SORT_ISSUE_NUMBER_KEY, 0, -1) == [b'A1']
+
+    response = save(client, make_record('A1', 严重级别='一般', 问题描述='网络中断'), base_version=1)
+    assert response.get_json()['version'] == 2
+    assert members(redis_client, index_key('严重级别', '严重')) == set()
+    assert members(redis_client, index_key('严重级别', '一般')) == {'A1'}
+
+
+def test_save_rejects_stale_base_version(client):
+    save(client, make_record('A1'), base_version=0)
+    response = save(client, make_record('A1', 问题描述='x'), base_version=0)
+    assert response.status_code == 409
+    assert response.get_json()['current']['version'] == 1
+
+
+def test_rename_moves_indexes(client, redis_client):
+    save(client, make_record('A9', 严重级别='一般', 问题描述='掉话'))
+    response = save(client, make_record('B9', 严重级别='一般', 问题描述='掉话'), old_issue_number='A9')
+    assert response.status_code == 200
+    assert redis_client.get('rn_record:A9') is None
+    assert members(redis_client, index_key('严重级别', '一般')) == {'B9'}
+    assert members(redis_client, gram_key('掉话')) == {'B9'}
+    assert redis_client.zrange(RN_SORT_ISSUE_NUMBER_KEY, 0, -1) == [b'B9']
+
+
+def test_rename_onto_existing_record_is_rejected(client, redis_client):
+    save(client, make_record('A9', 严重级别='一般'))
+    save(client, make_record('B2', 严重级别='严重'))
+    response = save(client, make_record('B2', 严重级别='一般'), old_issue_number='A9')
+    assert response.status_code == 409
+    assert members(redis_client, index_key('严重级别', '一般')) == {'A9'}
+    assert members(redis_client, index_key('严重级别', '严重')) == {'B2'}
+
+
+def test_batch_rename_onto_existing_record_is_rejected(client, redis_client):
+    save(client, make_record('A9'))
+    save(client, make_record('B2'))
+    response = client.post('/rn_records/batch', json={
+        'username': USERNAME, 'client_id': 'c1',
+        'operations': [{'op': 'save', 'record': make_record('B2'), 'old_issue_number': 'A9'}]
+    })
+    assert response.status_code == 409
+    assert response.get_json()['index'] == 0
+    assert redis_client.exists('rn_record:A9', 'rn_record:B2') == 2
+
+
+def test_delete_removes_indexes_and_logs_change(client, redis_client):
+    save(client, make_record('A1', 严重级别='严重', 问题描述='网络中断'))
+    response = client.delete('/delete_rn_record', json={'issue_number': 'A1', 'client_id': 'c1',
+                                                        'username': USERNAME, 'base_version': 1})
+    assert response.status_code == 200
+    assert members(redis_client, index_key('严重级别', '严重')) == set()
+    assert members(redis_client, gram_key('网络中')) == set()
+    changes = client.get('/rn_changes?since=0').get_json()['changes']
+    assert [change['operation'] for change in changes] == ['post', 'delete']
+
+
+def test_missing_sort_index_is_backfilled_at_startup(redis_client):
+    redis_client.set('rn_record:B2', '{"问题单号": "B2", "严重级别": "严重"}')
+    redis_client.set('rn_record:A1', '{"问题单号": "A1"}')
+    client = server.create_app(load_config(RN_CACHE_MAX_BYTES=0, USER_CACHE_TTL=0)).test_client()
+    page = client.get('/get_all_rn_records?limit=10').get_json()
+    assert [record['问题单号'] for record in page['records']] == ['A1', 'B2']
+    assert redis_client.smembers(index_key('严重级别', '严重')) == {b'B2'}
+
+
+def test_rebuild_index_drops_stale_modified_members(redis_client):
+    redis_client.set('rn_record:A1', '{"问题单号": "A1"}')
+    redis_client.set('rn_record:B2', '{"问题单号": "B2"}')
+    redis_client.zadd(RN_SORT_MODIFIED_KEY, {'A1': 100, 'Z9': 200})
+    assert rebuild_index(redis_client) == 2
+    assert redis_client.zrange(RN_SORT_MODIFIED_KEY, 0, -1, withscores=True) == [(b'B2', 0), (b'A1', 100)]
@@ -0,0 +1,55 @@
+import pytest
+import requests
+
+import http_session
+from conftest import USERNAME, make_record
+from rn_client import RN_Client
+
+SERVER_URL = 'http://rn-server'
+
+
+@pytest.fixture
+def network(client, monkeypatch):
+    """把 RN_Client 的请求转给 Flask 测试客户端；online 为 False 时模拟连不上服务器"""
+    state = {'online': True}
+
+    def request(method, url, idempotent=False, timeout=None, **kwargs):
+        if not state['online']:
+            raise requests.ConnectionError('offline')
+        result = client.open(url[len(SERVER_URL):], method=method, query_string=kwargs.get('params'),
+                             json=kwargs.get('json'))
+        response = requests.Response()
+        response.status_code = result.status_code
+        response._content = result.get_data()
+        response.url = url
+        return response
+
+    monkeypatch.setattr(http_session, 'request', request)
+    return state
+
+
+def test_replay_drops_conflicting_operations_and_reports_server_state(client, network, tmp_path):
+    client.post('/save_rn_record', json=make_record('A1', 问题描述='原始'))
+    client.post('/save_rn_record', json=make_record('B2'))
+    rn_client = RN_Client(SERVER_URL, 'c2', USERNAME, cache_path=str(tmp_path / 'cache.db'))
+    assert rn_client.check_permissions()
+
+    network['online'] = False
+    assert rn_client.save_rn_record({'问题单号': 'A1', '问题描述': '离线'}, base_version=1)['status'] == 'queued'
+    assert rn_client.save_rn_record({'问题单号': 'C3'}, old_issue_number='B2', base_version=1)['status'] == 'queued'
+    assert rn_client.save_rn_record({'问题单号': 'D4'}, base_version=0)['status'] == 'queued'
+    assert rn_client.replay_pending_writes()['remaining'] == 3
+
+    # 离线期间其他用户修改了 A1、删除了 B2
+    network['online'] = True
+    client.post('/save_rn_record', json=make_record('A1', 问题描述='在线', base_version=1))
+    client.delete('/delete_rn_record', json={'issue_number': 'B2', 'client_id': 'c1', 'username': USERNAME})
+
+    result = rn_client.replay_pending_writes()
+    assert (result['applied'], result['remaining']) == (1, 0)
+    a1, rename = result['conflicts']
+    assert a1['current']['问题描述'] == '在线'
+    assert a1['records']['A1']['问题描述'] == '在线'
+    # 改名冲突时新旧单号都返回服务器上的状态，界面据此恢复
+    assert rename['records'] == {'C3': None, 'B2': None}
+    assert client.get('/get_rn_record_by_issue_number?issue_number=D4').status_code == 200
@@ -0,0 +1,49 @@
+import re
+
+import server
+from conftest import make_record
+from rn_fulltext import RN_FULLTEXT_SCHEMA, RN_FULLTEXT_SCHEMA_KEY, gram_key
+from server_config import load_config
+
+
+def search(client, *filters):
+    filters = [[filter_type, key, re.escape(value)] for filter_type, key, value in filters]
+    return client.post('/search_rn_records', json={'filters': filters}).get_json()
+
+
+def issue_numbers(records):
+    return sorted(record['问题单号'] for record in records)
+
+
+def test_free_text_matches_indexed_and_metadata_fields(client):
+    client.post('/save_rn_record', json=make_record('A1', 问题描述='网络中断'))
+    client.post('/save_rn_record', json=make_record('B2', 问题描述='掉话', username='u1'))
+    assert issue_numbers(search(client, ('free', '', '网络'))) == ['A1']
+    # 用户名等元数据字段同样可以自由搜索
+    assert issue_numbers(search(client, ('free', '', 'u1'))) == ['A1', 'B2']
+    assert issue_numbers(search(client, ('free', '', 'c1'))) == ['A1', 'B2']
+
+
+def test_contains_and_exact_filters(client):
+    client.post('/save_rn_record', json=make_record('A1', 严重级别='严重', 根因分析='硬件故障'))
+    client.post('/save_rn_record', json=make_record('B2', 严重级别='一般', 根因分析='软件故障'))
+    assert issue_numbers(search(client, ('contains', '根因分析', '故障'))) == ['A1', 'B2']
+    assert issue_numbers(search(client, ('contains', '根因分析', '故障'), ('exact', '严重级别', '一般'))) == ['B2']
+
+
+def test_outdated_fulltext_index_is_rebuilt_at_startup(redis_client):
+    redis_client.set('rn_record:A1', '{"问题单号": "A1", "username": "u1"}')
+    server.create_app(load_config(RN_CACHE_MAX_BYTES=0, USER_CACHE_TTL=0))
+    assert int(redis_client.get(RN_FULLTEXT_SCHEMA_KEY)) == RN_FULLTEXT_SCHEMA
+    assert redis_client.smembers(gram_key('u1')) == {b'A1'}
+
+
+def test_filter_values_are_matched_literally(client):
+    client.post('/save_rn_record', json=make_record('A1', 问题描述='(a+)+$ 出现'))
+    for value in ['(', '(a+)+$', '[']:
+        # 客户端发来未转义或恶意的正则也只按字面匹配
+        response = client.post('/search_rn_records', json={'filters': [['contains', '问题描述', value]]})
+        assert response.status_code == 200
+    assert issue_numbers(search(client, ('contains', '问题描述', '(a+)+$'))) == ['A1']
+    response = client.post('/search_rn_records', json={'filters': [['free', '', 5]]})
+    assert response.status_code == 400
@@ -0,0 +1,17 @@
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 111 与 cccc 客户端各自从自己的目录导入这些模块，两份必须逐字节一致，修改时同时更新
+SHARED_MODULES = [
+    ('111/task_runner.py', 'cccc/function/task_runner.py'),
+    ('111/table_format.py', 'cccc/function/table_format.py'),
+]
+
+
+@pytest.mark.parametrize('path, copy_path', SHARED_MODULES)
+def test_shared_module_copies_are_identical(path, copy_path):
+    with open(os.path.join(ROOT, path), 'rb') as f, open(os.path.join(ROOT, copy_path), 'rb') as copy:
+        assert f.read() == copy.read(), f'{copy_path} 与 {path} 不一致'
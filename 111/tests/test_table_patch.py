@@ -0,0 +1,72 @@
+import pytest
+
+import wire_codec
+from table_format import DEFAULT_STYLE
+from table_patch import apply_table_patch
+
+
+def table(rows=1, columns=1):
+    data, _ = apply_table_patch([], [], [{'op': 'insert_rows', 'row': 0, 'count': rows},
+                                         {'op': 'insert_columns', 'col': 0, 'count': columns}])
+    return data
+
+
+def test_set_cell_and_structure_ops():
+    data, merged = apply_table_patch(table(2, 2), [], [
+        {'op': 'set_cell', 'row': 1, 'col': 1, 'text': 'x', 'style': DEFAULT_STYLE},
+        {'op': 'insert_rows', 'row': 0, 'count': 1},
+        {'op': 'delete_columns', 'col': 0, 'count': 1},
+        {'op': 'set_merged_cells', 'merged_cells': [[0, 0, 2, 1]]},
+    ])
+    assert (data['rows'], data['columns']) == (3, 1)
+    assert data['cells'] == [[2, 0, 'x', 0]]
+    assert len(data['row_heights']) == 3
+    assert merged == [[0, 0, 2, 1]]
+
+
+@pytest.mark.parametrize('op', [
+    {'op': 'insert_rows', 'row': 0, 'count': -3},
+    {'op': 'insert_rows', 'row': 2, 'count': 1},
+    {'op': 'delete_rows', 'row': -1, 'count': 1},
+    {'op': 'delete_rows', 'row': 1, 'count': 1},
+    {'op': 'delete_columns', 'col': 0, 'count': -1},
+    {'op': 'set_cell', 'row': -1, 'col': 0, 'text': 'x'},
+    {'op': 'set_cell', 'row': 0, 'col': 1, 'text': 'x'},
+    {'op': 'set_row_height', 'row': -1, 'height': 30},
+    {'op': 'set_column_width', 'col': 1, 'width': 30},
+    {'op': 'set_column_width', 'col': 0, 'width': -30},
+    {'op': 'unknown'},
+    {'op': 'set_cell', 'row': 0},
+])
+def test_invalid_ops_are_rejected(op):
+    with pytest.raises(ValueError):
+        apply_table_patch(table(), [], [op])
+
+
+def patch(client, base_version, ops):
+    return client.post('/patch_table', json={'table_name': 't', 'client_id': 'c1',
+                                             'base_version': base_version, 'ops': ops})
+
+
+def test_patch_table_route(client, redis_client):
+    response = patch(client, 0, [{'op': 'insert_rows', 'row': 0, 'count': 2},
+                                 {'op': 'insert_columns', 'col': 0, 'count': 1},
+                                 {'op': 'set_cell', 'row': 1, 'col': 0, 'text': 'x'}])
+    assert response.get_json() == {'status': 'success', 'version': 1}
+    assert wire_codec.loads(redis_client.get('t_data'))['cells'] == [[1, 0, 'x', 0]]
+
+    # 基于旧版本的补丁被拒绝，数据不变
+    response = patch(client, 0, [{'op': 'delete_rows', 'row': 0}])
+    assert response.status_code == 409
+    assert response.get_json()['version'] == 1
+    assert wire_codec.loads(redis_client.get('t_data'))['rows'] == 2
+
+
+def test_patch_table_route_rejects_invalid_ops(client, redis_client):
+    patch(client, 0, [{'op': 'insert_rows', 'row': 0, 'count': 1}])
+    for op in ({'op': 'insert_rows', 'row': 0, 'count': -3}, {'op': 'delete_rows', 'row': -1},
+               {'op': 'set_row_height', 'row': -1, 'height': 10}):
+        response = patch(client, 1, [op])
+        assert response.status_code == 400
+    assert int(redis_client.get('t_version')) == 1
+    assert wire_codec.loads(redis_client.get('t_data'))['row_heights'] == [20]
@@ -0,0 +1,145 @@
+import asyncio
+import threading
+import time
+
+import redis
+import wire_codec
+
+# 用户中文名或权限变化时广播的频道，消息为 {"usernames": [...]}
+USER_UPDATES_CHANNEL = 'user_updates'
+
+
+class UserCache:
+    """进程内缓存 kpi_username 中文名与 permissions_{用户}，条目在 ttl 秒后过期
+
+    user_updates 频道的广播会立即使对应用户失效，TTL 只是订阅断开时的兜底。
+    不存在的用户同样缓存（值为 None），避免无效用户名反复访问 Redis。
+    """
+
+    def __init__(self, redis_client, ttl):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self._names = {}
+        self._permissions = {}
+        self._lock = threading.Lock()
+
+    def display_name(self, username):
+        return self._lookup(self._names, username, self._load_display_name)
+
+    def permissions(self, username):
+        return self._lookup(self._permissions, username, self._load_permissions)
+
+    def invalidate(self, usernames=None):
+        """使指定用户失效，usernames 为空时清空全部"""
+        with self._lock:
+            if usernames is None:
+                self._names.clear()
+                self._permissions.clear()
+                return
+            for username in usernames:
+                self._names.pop(username, None)
+                self._permissions.pop(username, None)
+
+    def _lookup(self, entries, username, load):
+        now = time.monotonic()
+        entry = self._cached(entries, username, now)
+        if entry is not None:
+            return entry[0]
+        return self._store(entries, username, load(username), now)
+
+    def _cached(self, entries, username, now):
+        """返回未过期的 (value, expires)，没有或已过期时返回 None"""
+        with self._lock:
+            entry = entries.get(username)
+        return entry if entry is not None and entry[1] > now else None
+
+    def _store(self, entries, username, value, now):
+        if self.ttl > 0:
+            with self._lock:
+                entries[username] = (value, now + self.ttl)
+        return value
+
+    def _load_display_name(self, username):
+        name = self.redis_client.hget('kpi_username', username or '')
+        return name.decode('utf-8') if name else None
+
+    def _load_permissions(self, username):
+        permissions = self.redis_client.get(f'permissions_{username}')
+        return int(permissions) if permissions is not None else None
+
+
+class AsyncUserCache(UserCache):
+    """UserCache 的 asyncio 版本，供 async_server.py 使用，redis_client 为 redis.asyncio 客户端"""
+
+    async def display_name(self, username):
+        return await self._lookup(self._names, username, self._load_display_name)
+
+    async def permissions(self, username):
+        return await self._lookup(self._permissions, username, self._load_permissions)
+
+    async def _lookup(self, entries, username, load):
+        now = time.monotonic()
+        entry = self._cached(entries, username, now)
+        if entry is not None:
+            return entry[0]
+        return self._store(entries, username, await load(username), now)
+
+    async def _load_display_name(self, username):
+        name = await self.redis_client.hget('kpi_username', username or '')
+        return name.decode('utf-8') if name else None
+
+    async def _load_permissions(self, username):
+        permissions = await self.redis_client.get(f'permissions_{username}')
+        return int(permissions) if permissions is not None else None
+
+
+def publish_user_update(redis_client, usernames):
+    """通知各服务端进程和客户端：这些用户的中文名或权限已变化"""
+    redis_client.publish(USER_UPDATES_CHANNEL, wire_codec.dumps({'usernames': list(usernames)}))
+
+
+def start_user_invalidation_listener(redis_client, cache, retry_interval=1):
+    """在后台线程订阅 user_updates，收到广播后使对应用户失效；断线期间可能漏掉广播，重连时清空缓存"""
+    def listen():
+        while True:
+            pubsub = redis_client.pubsub()
+            try:
+                pubsub.subscribe(USER_UPDATES_CHANNEL)
+                for message in pubsub.listen():
+                    if message['type'] == 'subscribe':
+                        cache.invalidate()
+                    elif message['type'] == 'message':
+                        try:
+                            cache.invalidate(wire_codec.loads(message['data'])['usernames'])
+                        except (ValueError, KeyError, TypeError):
+                            cache.invalidate()
+            except redis.RedisError as e:
+                print(f"{USER_UPDATES_CHANNEL} subscription lost: {e}")
+            finally:
+                pubsub.close()
+            time.sleep(retry_interval)
+
+    thread = threading.Thread(target=listen, name='user-cache-invalidation', daemon=True)
+    thread.start()
+    return thread
+
+
+async def listen_user_updates(redis_client, cache, retry_interval=1):
+    """start_user_invalidation_listener 的 asyncio 版本，作为后台任务运行直到被取消"""
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(USER_UPDATES_CHANNEL)
+            async for message in pubsub.listen():
+                if message['type'] == 'subscribe':
+                    cache.invalidate()
+                elif message['type'] == 'message':
+                    try:
+                        cache.invalidate(wire_codec.loads(message['data'])['usernames'])
+                    except (ValueError, KeyError, TypeError):
+                        cache.invalidate()
+        except redis.RedisError as e:
+            print(f"{USER_UPDATES_CHANNEL} subscription lost: {e}")
+        finally:
+            await pubsub.aclose()
+        await asyncio.sleep(retry_interval)
@@ -0,0 +1,62 @@
+import gzip
+import json
+import zlib
+
+# orjson / zstandard 为可选依赖，未安装时退回标准库 json / gzip
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+
+
+def dumps(obj):
+    """序列化为 JSON 字符串，中文直接输出为 UTF-8 而不是 \\uXXXX 转义"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def negotiate_encoding(accept_encodings):
+    """根据请求的 Accept-Encoding 选择压缩算法，优先 zstd，其次 gzip"""
+    if zstandard is not None and accept_encodings['zstd'] > 0:
+        return 'zstd'
+    if accept_encodings['gzip'] > 0:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def compress_stream(chunks, encoding):
+    """逐块压缩流式响应，不需要先拿到完整的响应体"""
+    compressor = stream_compressor(encoding)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_compressor(encoding):
+    """返回逐块压缩用的 compressobj，compress(chunk) 之后以 flush() 结束"""
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits=31 输出 gzip 格式
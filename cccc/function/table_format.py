@@ -0,0 +1,83 @@
+TABLE_FORMAT_VERSION = 2
+
+# 样式为 [前景色, 背景色, 对齐方式, 加粗, 字号]，0 号样式固定为默认样式
+DEFAULT_STYLE = ['#000000', '#ffffff', 129, False, 10]  # 129 = Qt.AlignLeft | Qt.AlignVCenter
+DEFAULT_ROW_HEIGHT = 20
+DEFAULT_COLUMN_WIDTH = 100
+
+
+def is_compact(table_data):
+    return isinstance(table_data, dict) and table_data.get('format') == TABLE_FORMAT_VERSION
+
+
+def style_from_legacy_cell(cell):
+    font = cell.get('font', {})
+    return [cell.get('foreground', DEFAULT_STYLE[0]), cell.get('background', DEFAULT_STYLE[1]),
+            cell.get('alignment', DEFAULT_STYLE[2]), font.get('bold', DEFAULT_STYLE[3]),
+            font.get('size', DEFAULT_STYLE[4])]
+
+
+def load_table(table_data):
+    """把存储的表格数据（新旧两种格式）解析成便于修改的结构
+
+    返回 {'rows', 'columns', 'row_heights', 'column_widths', 'cells'}，
+    其中 cells 为 {(row, col): (text, style)}，style 为元组。
+    """
+    if is_compact(table_data):
+        styles = [tuple(style) for style in table_data['styles']]
+        return {
+            'rows': table_data['rows'],
+            'columns': table_data['columns'],
+            'row_heights': list(table_data['row_heights']),
+            'column_widths': list(table_data['column_widths']),
+            'cells': {(row, col): (text, styles[style_id]) for row, col, text, style_id in table_data['cells']}
+        }
+
+    # 旧格式：每行一个 {列号: 完整单元格} 字典，行高列宽重复存放在每个单元格里
+    table_data = table_data or []
+    columns = max((len(row_data) for row_data in table_data), default=0)
+    row_heights = [DEFAULT_ROW_HEIGHT] * len(table_data)
+    column_widths = [DEFAULT_COLUMN_WIDTH] * columns
+    cells = {}
+    for row, row_data in enumerate(table_data):
+        for col_str, cell in row_data.items():
+            col = int(col_str)
+            if col >= columns:
+                column_widths.extend([DEFAULT_COLUMN_WIDTH] * (col + 1 - columns))
+                columns = col + 1
+            cells[(row, col)] = (cell.get('text', ''), tuple(style_from_legacy_cell(cell)))
+            row_heights[row] = cell.get('row_height', row_heights[row])
+            column_widths[col] = cell.get('column_width', column_widths[col])
+    return {
+        'rows': len(table_data),
+        'columns': columns,
+        'row_heights': row_heights,
+        'column_widths': column_widths,
+        'cells': cells
+    }
+
+
+def dump_table(table):
+    """把 load_table 的结构编码为紧凑格式：样式去重编号，省略默认样式的空单元格"""
+    default_style = tuple(DEFAULT_STYLE)
+    styles = [DEFAULT_STYLE]
+    style_ids = {default_style: 0}
+    cells = []
+    for (row, col), (text, style) in sorted(table['cells'].items()):
+        style = tuple(style)
+        if text == '' and style == default_style:
+            continue
+        style_id = style_ids.get(style)
+        if style_id is None:
+            style_id = style_ids[style] = len(styles)
+            styles.append(list(style))
+        cells.append([row, col, text, style_id])
+    return {
+        'format': TABLE_FORMAT_VERSION,
+        'rows': table['rows'],
+        'columns': table['columns'],
+        'row_heights': table['row_heights'],
+        'column_widths': table['column_widths'],
+        'styles': styles,
+        'cells': cells
+    }
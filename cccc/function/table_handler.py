@@ -7,6 +7,9 @@ from openpyxl.utils import get_column_letter
 import sys
 from server.client import DataClient
 from function.table import TableWidget
+from function.task_runner import TaskRunner
+# 紧凑表格格式：样式去重后按编号引用，行高列宽单独存放，省略默认样式的空单元格
+from function.table_format import TABLE_FORMAT_VERSION, DEFAULT_STYLE, load_table
 import json
 
 class TableHandler:
@@ -14,62 +17,258 @@ class TableHandler:
         self.table_widget = table_widget
         self.db_handler = db_handler
         self.can_save_data = can_save_data  # 新增属性来控制保存操作的权限
+        self.version = None  # 本地表格对应的服务器版本号，补丁以此为基准
+        self.saving = False  # 保存请求未返回前忽略再次保存
+        self.shown_from_cache = False  # 表格当前显示的是本地缓存，尚未与服务器核对
+        self.loaded_texts = {}  # 上次加载时各单元格的文本，保存冲突时据此判断他人改过哪些单元格
+        # 网络请求在工作线程中执行；请求期间禁用表格，避免加载结果覆盖或保存遗漏这段时间的编辑
+        self.tasks = TaskRunner(table_widget)
+        self.tasks.busy_changed.connect(table_widget.get_table().setDisabled)
+        self._tracking = False
+        self._reset_change_tracking()
+        self._connect_change_tracking()
 
     def save_data(self):
         if not self.can_save_data:
             QMessageBox.warning(self.table_widget, "保存失败", "您没有权限保存数据。")
             return
-        data, merged_cells = self._collect_table_data()
-        result = self.db_handler.save_all(data, merged_cells)
+        if self.saving:
+            return
+        self.saving = True
+        if self.version is not None and not self.needs_full_save:
+            self.tasks.run_future(None, self.db_handler.patch_table(self.version, self._collect_patch_ops()),
+                                  on_done=self._on_patch_saved, on_error=self._on_save_failed)
+        else:
+            self._save_all()
+
+    def _on_patch_saved(self, result):
+        if result.get("status") == "conflict":
+            # 服务器上的表格已被他人修改：不能整表覆盖他人的修改，重新加载后把本地修改的单元格重新应用上去
+            self.saving = False
+            self._reload_after_conflict()
+        else:
+            self._on_saved(result)
+
+    def _reload_after_conflict(self):
+        table = self.table_widget.get_table()
+        if (self.structure_ops or self.needs_full_save
+                or self._collect_all_merged_cells(table) != self.saved_merged_cells):
+            # 行列增删、排序和合并单元格改变了坐标，无法可靠地重新应用，保留本地内容由用户决定
+            QMessageBox.warning(self.table_widget, "保存失败",
+                                "表格已被其他用户修改，本地的行列增删、排序或合并单元格无法自动合并。"
+                                "请记下本地修改后刷新表格，再重新修改并保存。")
+            return
+        cells = {}
+        for row, col in self.dirty_cells:
+            if row < table.rowCount() and col < table.columnCount():
+                item = table.item(row, col)
+                cells[(row, col)] = (item.text(), self._cell_style(item)) if item else ('', DEFAULT_STYLE)
+        loaded_texts = self.loaded_texts
+        row_heights = {row: table.rowHeight(row) for row in self.dirty_rows if row < table.rowCount()}
+        column_widths = {col: table.columnWidth(col) for col in self.dirty_columns if col < table.columnCount()}
+        self.tasks.run_future('load', self.db_handler.get_all(),
+                              on_done=lambda response: self._reapply_local_edits(
+                                  response, cells, row_heights, column_widths, loaded_texts),
+                              on_error=lambda message: self._reapply_local_edits(
+                                  {"error": message}, cells, row_heights, column_widths, loaded_texts))
+
+    def _reapply_local_edits(self, response, cells, row_heights, column_widths, loaded_texts):
+        """在重新加载的服务器表格上重新应用本地修改，修改仍记为未保存，由用户检查后再次保存"""
+        if response.get("status") != "success":
+            # 加载失败时保留本地表格，不退回默认数据
+            QMessageBox.warning(self.table_widget, "保存失败",
+                                f"表格已被其他用户修改，重新加载失败：{response.get('error', '未知错误')}。本地修改已保留。")
+            return
+        self._apply_table_response(response)
+        table = self.table_widget.get_table()
+        overwritten, dropped = [], []
+        for (row, col), (text, style) in sorted(cells.items()):
+            if row >= table.rowCount() or col >= table.columnCount():
+                dropped.append((row, col))
+                continue
+            server_text = self.loaded_texts.get((row, col), '')
+            if server_text != loaded_texts.get((row, col), '') and server_text != text:
+                overwritten.append((row, col))
+            table.setItem(row, col, self._styled_item(text, style))
+        for row, height in row_heights.items():
+            if row < table.rowCount():
+                table.setRowHeight(row, height)
+        for col, width in column_widths.items():
+            if col < table.columnCount():
+                table.setColumnWidth(col, width)
+
+        message = f"表格已被其他用户修改，已重新加载服务器上的表格并重新应用了你修改的 {len(cells)} 个单元格，请检查后再次保存。"
+        if overwritten:
+            message += "\n以下单元格在服务器上已有不同的内容，保存后会被你的修改覆盖：" + self._format_cells(overwritten)
+        if dropped:
+            message += "\n以下单元格已不在表格范围内，修改未能应用：" + self._format_cells(dropped)
+        QMessageBox.warning(self.table_widget, "保存冲突", message)
+
+    def _on_saved(self, result):
+        self.saving = False
         if result.get("status") == "success":
+            self.version = result.get("version")
+            table = self.table_widget.get_table()
+            self.loaded_texts = {(row, col): table.item(row, col).text() for row in range(table.rowCount())
+                                 for col in range(table.columnCount()) if table.item(row, col)}
+            self._reset_change_tracking()
             QMessageBox.information(self.table_widget, "保存成功", "表格数据已保存到数据库")
         else:
             QMessageBox.warning(self.table_widget, "保存失败", result.get("error", "未知错误"))
 
+    def _on_save_failed(self, message):
+        self.saving = False
+        QMessageBox.warning(self.table_widget, "保存失败", message)
+
+    def _save_all(self):
+        # 表格内容只能在 GUI 线程读取，收集完成后再交给工作线程发送
+        data, merged_cells = self._collect_table_data()
+        self.tasks.run_future(None, self.db_handler.save_all(data, merged_cells),
+                              on_done=self._on_saved, on_error=self._on_save_failed)
+
+    def _reset_change_tracking(self):
+        self.dirty_cells = set()  # 自上次加载/保存以来修改过的 (row, col)
+        self.dirty_rows = set()  # 修改过行高的行
+        self.dirty_columns = set()  # 修改过列宽的列
+        self.structure_ops = []  # 按发生顺序记录的插入/删除行列操作
+        self.needs_full_save = False  # 排序等无法用补丁表达的修改
+        table = self.table_widget.get_table()
+        self.saved_merged_cells = self._collect_all_merged_cells(table)
+
+    def _connect_change_tracking(self):
+        table = self.table_widget.get_table()
+        model = table.model()
+        model.dataChanged.connect(self._on_data_changed)
+        model.rowsInserted.connect(lambda parent, first, last: self._on_rows_inserted(first, last))
+        model.rowsRemoved.connect(lambda parent, first, last: self._on_rows_removed(first, last))
+        model.columnsInserted.connect(lambda parent, first, last: self._on_columns_inserted(first, last))
+        model.columnsRemoved.connect(lambda parent, first, last: self._on_columns_removed(first, last))
+        model.layoutChanged.connect(self._on_layout_changed)
+        table.verticalHeader().sectionResized.connect(self._on_row_resized)
+        table.horizontalHeader().sectionResized.connect(self._on_column_resized)
+        self._tracking = True
+
+    def _on_data_changed(self, top_left, bottom_right, roles=None):
+        if not self._tracking:
+            return
+        for row in range(top_left.row(), bottom_right.row() + 1):
+            for col in range(top_left.column(), bottom_right.column() + 1):
+                self.dirty_cells.add((row, col))
+
+    def _on_rows_inserted(self, first, last):
+        if not self._tracking:
+            return
+        count = last - first + 1
+        self.dirty_cells = {(row + count if row >= first else row, col) for row, col in self.dirty_cells}
+        self.dirty_rows = {row + count if row >= first else row for row in self.dirty_rows}
+        self.structure_ops.append({'op': 'insert_rows', 'row': first, 'count': count})
+
+    def _on_rows_removed(self, first, last):
+        if not self._tracking:
+            return
+        count = last - first + 1
+        self.dirty_cells = {(row - count if row > last else row, col)
+                            for row, col in self.dirty_cells if not first <= row <= last}
+        self.dirty_rows = {row - count if row > last else row for row in self.dirty_rows if not first <= row <= last}
+        self.structure_ops.append({'op': 'delete_rows', 'row': first, 'count': count})
+
+    def _on_columns_inserted(self, first, last):
+        if not self._tracking:
+            return
+        count = last - first + 1
+        self.dirty_cells = {(row, col + count if col >= first else col) for row, col in self.dirty_cells}
+        self.dirty_columns = {col + count if col >= first else col for col in self.dirty_columns}
+        self.structure_ops.append({'op': 'insert_columns', 'col': first, 'count': count})
+
+    def _on_columns_removed(self, first, last):
+        if not self._tracking:
+            return
+        count = last - first + 1
+        self.dirty_cells = {(row, col - count if col > last else col)
+                            for row, col in self.dirty_cells if not first <= col <= last}
+        self.dirty_columns = {col - count if col > last else col
+                              for col in self.dirty_columns if not first <= col <= last}
+        self.structure_ops.append({'op': 'delete_columns', 'col': first, 'count': count})
+
+    def _on_layout_changed(self, *args):
+        if self._tracking:
+            self.needs_full_save = True
+
+    def _on_row_resized(self, row, old_size, new_size):
+        if self._tracking:
+            self.dirty_rows.add(row)
+
+    def _on_column_resized(self, col, old_size, new_size):
+        if self._tracking:
+            self.dirty_columns.add(col)
+
+    def _collect_patch_ops(self):
+        """只收集自上次加载/保存以来的修改，补丁大小与修改量成正比"""
+        table = self.table_widget.get_table()
+        ops = list(self.structure_ops)
+        for row, col in sorted(self.dirty_cells):
+            if row >= table.rowCount() or col >= table.columnCount():
+                continue
+            item = table.item(row, col)
+            ops.append({
+                'op': 'set_cell', 'row': row, 'col': col,
+                'text': item.text() if item else '',
+                'style': self._cell_style(item) if item else DEFAULT_STYLE
+            })
+        for row in sorted(self.dirty_rows):
+            if row < table.rowCount():
+                ops.append({'op': 'set_row_height', 'row': row, 'height': table.rowHeight(row)})
+        for col in sorted(self.dirty_columns):
+            if col < table.columnCount():
+                ops.append({'op': 'set_column_width', 'col': col, 'width': table.columnWidth(col)})
+        # 合并单元格没有变化信号，只在本地比较；列表很小，变化时整体替换
+        merged_cells = self._collect_all_merged_cells(table)
+        if self.structure_ops or merged_cells != self.saved_merged_cells:
+            ops.append({'op': 'set_merged_cells', 'merged_cells': merged_cells})
+        return ops
+
+    def _collect_all_merged_cells(self, table):
+        merged_cells = []
+        for row in range(table.rowCount()):
+            merged_cells += self._collect_merged_cells_info(table, row)
+        return merged_cells
+
     def _collect_table_data(self):
         table = self.table_widget.get_table()
-        data = []
+        styles = [DEFAULT_STYLE]
+        style_ids = {tuple(DEFAULT_STYLE): 0}
+        cells = []
         merged_cells = []
         for row in range(table.rowCount()):
-            row_data = {}
             for col in range(table.columnCount()):
                 item = table.item(row, col)
-                if item:
-                    row_data[str(col)] = self._parse_cell(item)
-                else:
-                    row_data[str(col)] = self._empty_cell_data()
-            data.append(row_data)
+                if not item:
+                    continue
+                text = item.text()
+                style = tuple(self._cell_style(item))
+                if not text and style_ids.get(style) == 0:
+                    continue  # 默认样式的空单元格不写入
+                style_id = style_ids.get(style)
+                if style_id is None:
+                    style_id = style_ids[style] = len(styles)
+                    styles.append(list(style))
+                cells.append([row, col, text, style_id])
             merged_cells += self._collect_merged_cells_info(table, row)
+        data = {
+            'format': TABLE_FORMAT_VERSION,
+            'rows': table.rowCount(),
+            'columns': table.columnCount(),
+            'row_heights': [table.rowHeight(row) for row in range(table.rowCount())],
+            'column_widths': [table.columnWidth(col) for col in range(table.columnCount())],
+            'styles': styles,
+            'cells': cells
+        }
         return data, merged_cells
 
-    def _parse_cell(self, item):
+    def _cell_style(self, item):
         font = item.font()
-        return {
-            'text': item.text(),
-            'foreground': item.foreground().color().name(),
-            'background': item.background().color().name(),
-            'alignment': item.textAlignment(),
-            'font': {
-                'bold': font.bold(),
-                'size': font.pointSize()
-            },
-            'row_height': item.tableWidget().rowHeight(item.row()),
-            'column_width': item.tableWidget().columnWidth(item.column())
-        }
-
-    def _empty_cell_data(self):
-        return {
-            'text': '',
-            'foreground': QColor(Qt.black).name(),
-            'background': QColor(Qt.white).name(),
-            'alignment': int(Qt.AlignLeft | Qt.AlignVCenter),
-            'font': {
-                'bold': False,
-                'size': 10
-            },
-            'row_height': 20,  # 默认高度
-            'column_width': 100  # 默认宽度
-        }
+        return [item.foreground().color().name(), item.background().color().name(),
+                int(item.textAlignment()), font.bold(), font.pointSize()]
 
     def _collect_merged_cells_info(self, table, row):
         merged_cells = []
@@ -83,50 +282,103 @@ class TableHandler:
                 })
         return merged_cells
 
-    def load_table_data(self):
-        response = self.db_handler.get_all()
+    def load_table_data(self, on_loaded=None):
+        """在工作线程中读取表格，返回后填充；重复加载时只处理最后一次的结果
+
+        首次加载时如有本地缓存，先立即显示缓存，再以其 ETag 发送条件请求核对。
+        """
+        if self.version is None:
+            cached = self.db_handler.get_cached_all()
+            if cached is not None:
+                self._apply_table_response(cached)
+                self.shown_from_cache = True
+        self.tasks.run_future('load', self.db_handler.get_all(),
+                              on_done=lambda response: self._on_table_loaded(response, on_loaded),
+                              on_error=lambda message: self._on_table_loaded({"error": message}, on_loaded))
+
+    def _on_table_loaded(self, response, on_loaded=None):
+        shown_from_cache, self.shown_from_cache = self.shown_from_cache, False
+        if shown_from_cache and response.get("status") != "success":
+            # 连不上服务器时继续显示缓存，而不是退回默认数据
+            QMessageBox.warning(self.table_widget, "加载失败", response.get("error", "未知错误"))
+        elif not shown_from_cache or response.get("version") != self.version:
+            # 服务器上的版本与已显示的缓存相同时无需重新填充
+            self._apply_table_response(response)
+        if on_loaded:
+            on_loaded(response)
+
+    def _apply_table_response(self, response):
+        self._tracking = False
         if response.get("status") == "success":
             data = response.get("data", {})
             table_data = data.get("table_data", [])
             merged_cells = data.get("merged_cells", [])
+            self.version = response.get("version")
 
             if table_data:
                 self.populate_table(table_data, merged_cells)
+                self.loaded_texts = self._cell_texts(table_data)
             else:
                 self.populate_table_with_default_data()
+                # 默认数据不在服务器上，首次保存必须整表写入
+                self.version = None
         else:
             QMessageBox.warning(self.table_widget, "加载失败", response.get("error", "未知错误"))
             self.populate_table_with_default_data()
+            self.version = None
+        self._reset_change_tracking()
+        self._tracking = True
 
 
     def populate_table(self, table_data, merged_cells):
+        # 新旧两种格式都经 load_table 解析；旧格式数据照常显示，下次保存时自动写成紧凑格式
+        table_data = load_table(table_data)
         table = self.table_widget.get_table()
         table.clearContents()
-        table.setRowCount(len(table_data))
-        table.setColumnCount(max(len(row) for row in table_data) if table_data else 0)
-        for row_idx, row_data in enumerate(table_data):
-            for col_idx_str, cell_data in row_data.items():
-                col_idx = int(col_idx_str)
-                item = QTableWidgetItem(cell_data['text'])
-                item.setForeground(QColor(cell_data['foreground']))
-                item.setBackground(QColor(cell_data['background']))
-                item.setTextAlignment(cell_data['alignment'])
-                font = QFont()
-                font.setBold(cell_data['font']['bold'])
-                font.setPointSize(cell_data['font']['size'])
-                item.setFont(font)
-                table.setItem(row_idx, col_idx, item)
-                table.setRowHeight(row_idx, cell_data['row_height'])
-                table.setColumnWidth(col_idx, cell_data['column_width'])
+        table.setRowCount(table_data['rows'])
+        table.setColumnCount(table_data['columns'])
+        for row_idx, height in enumerate(table_data['row_heights']):
+            table.setRowHeight(row_idx, height)
+        for col_idx, width in enumerate(table_data['column_widths']):
+            table.setColumnWidth(col_idx, width)
+        cells = table_data['cells']
+        for row_idx in range(table_data['rows']):
+            for col_idx in range(table_data['columns']):
+                text, style = cells.get((row_idx, col_idx), ('', DEFAULT_STYLE))
+                table.setItem(row_idx, col_idx, self._styled_item(text, style))
         for cell in merged_cells:
             table.setSpan(cell['row'], cell['col'], cell['row_span'], cell['col_span'])
 
+    @staticmethod
+    def _cell_texts(table_data):
+        return {position: text for position, (text, _) in load_table(table_data)['cells'].items() if text}
+
+    @staticmethod
+    def _format_cells(cells):
+        return "、".join(f"({row + 1}, {col + 1})" for row, col in cells)
+
+    @staticmethod
+    def _styled_item(text, style):
+        foreground, background, alignment, bold, size = style
+        item = QTableWidgetItem(text)
+        item.setForeground(QColor(foreground))
+        item.setBackground(QColor(background))
+        item.setTextAlignment(alignment)
+        font = QFont()
+        font.setBold(bold)
+        font.setPointSize(size)
+        item.setFont(font)
+        return item
+
     def refresh_data(self):
         table = self.table_widget.get_table()
         if table.rowCount() > 0:
             table.removeRow(table.rowCount() - 1)
-        self.load_table_data()
-        QMessageBox.information(self.table_widget, "刷新成功", "表格数据已刷新")
+        self.load_table_data(on_loaded=self._on_refreshed)
+
+    def _on_refreshed(self, response):
+        if response.get("status") == "success":
+            QMessageBox.information(self.table_widget, "刷新成功", "表格数据已刷新")
 
     def export_to_excel(self):
         table = self.table_widget.get_table()
@@ -1,5 +1,5 @@
 import sys
-from PySide6.QtWidgets import QMainWindow, QVBoxLayout, QWidget,QMessageBox, QPushButton, QHBoxLayout, QApplication,QColorDialog,QInputDialog
+from PySide6.QtWidgets import QMainWindow, QVBoxLayout, QWidget,QMessageBox, QPushButton, QHBoxLayout, QApplication,QColorDialog,QInputDialog, QProgressBar
 from server.client import DataClient
 from function.table import TableWidget
 from function.table_handler import TableHandler
@@ -8,8 +8,12 @@ import threading
 from redis import Redis, ConnectionPool
 import redis
 import json
+import os
 import uuid
 
+# 表格的本地快照缓存，启动时先显示缓存再发送条件请求
+LOCAL_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.table_client_cache.sqlite3')
+
 class UpdateListener(QThread):
     update_signal = Signal(str)
 
@@ -38,11 +42,11 @@ class UpdateListener(QThread):
         self.wait()
 
 
-# def check_bit(user_flag, n):
-#     if user_flag & (1 << (n - 1)):
-#         return True
-#     else:
-#         return False
+def check_bit(user_flag, n):
+    if user_flag & (1 << (n - 1)):
+        return True
+    else:
+        return False
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -51,9 +55,10 @@ class MainWindow(QMainWindow):
         server_url = "http://127.0.0.1:5002"
         table_name = "test_collection"
         self.client_id = str(uuid.uuid4())
+        self.username = "c50039960"
 
-        self.db_handler = DataClient(server_url, table_name, self.client_id)
-        # flag = check_bit(self.db_handler.get_permissions("c50039960"), 1)  # 权限检查
+        self.db_handler = DataClient(server_url, table_name, self.client_id, cache_path=LOCAL_CACHE_PATH)
+        # 权限与表格数据互不依赖，启动时并行请求，权限返回后再调整保存权限
         flag=True
         self.table_widget = TableWidget(editable=flag)
         self.table_handler = TableHandler(self.table_widget, self.db_handler, can_save_data=flag)
@@ -62,12 +67,13 @@ class MainWindow(QMainWindow):
         layout.addWidget(self.table_widget)
 
         button_layout = QHBoxLayout()
-        save_button = QPushButton("Save Data")
-        save_button.clicked.connect(self.table_handler.save_data)
-        button_layout.addWidget(save_button)
+        self.save_button = QPushButton("Save Data")
+        self.save_button.clicked.connect(self.table_handler.save_data)
+        button_layout.addWidget(self.save_button)
 
         refresh_button = QPushButton("Refresh Data")
         refresh_button.clicked.connect(self.table_handler.refresh_data)
+        refresh_button.clicked.connect(self.load_permissions)
         button_layout.addWidget(refresh_button)
 
         export_button = QPushButton("Export to Excel")
@@ -79,13 +85,37 @@ class MainWindow(QMainWindow):
         container.setLayout(layout)
         self.setCentralWidget(container)
 
+        # 有未完成的网络请求时在状态栏显示忙碌指示
+        self.busy_indicator = QProgressBar()
+        self.busy_indicator.setRange(0, 0)
+        self.busy_indicator.setTextVisible(False)
+        self.busy_indicator.setMaximumWidth(120)
+        self.busy_indicator.setVisible(False)
+        self.statusBar().addPermanentWidget(self.busy_indicator)
+        self.table_handler.tasks.busy_changed.connect(self.busy_indicator.setVisible)
+
         # 启动更新监听线程
         self.update_listener = UpdateListener(server_url, table_name, self.client_id)
         self.update_listener.update_signal.connect(self.display_update_notification)
         self.update_listener.start()
 
         self.table_handler.load_table_data()
-
+        self.load_permissions()
+
+    def load_permissions(self):
+        self.table_handler.tasks.run_future('permissions', self.db_handler.get_permissions(self.username),
+                                            on_done=self.apply_permissions)
+
+    def apply_permissions(self, permissions):
+        if permissions is None:
+            # 无法确认权限时先禁止保存并提示，而不是当作有权限或无权限处理
+            flag = False
+            self.statusBar().showMessage("无法连接服务器确认权限，暂时不能保存；点击 Refresh Data 重试")
+        else:
+            flag = check_bit(permissions, 1)  # 权限检查
+            self.statusBar().clearMessage()
+        self.table_handler.can_save_data = flag
+        self.save_button.setEnabled(flag)
 
     @Slot(str)
     def display_update_notification(self, message):
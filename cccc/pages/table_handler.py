@@ -7,6 +7,7 @@ from openpyxl.utils import get_column_letter
 import sys
 from server.client import DataClient
 from pages.table_search import TableWidget
+from function.table_format import DEFAULT_STYLE, load_table
 import json
 
 class TableHandler:
@@ -20,7 +21,7 @@ class TableHandler:
             QMessageBox.warning(self.table_widget, "保存失败", "您没有权限保存数据。")
             return
         data, merged_cells = self._collect_table_data()
-        result = self.db_handler.save_all(data, merged_cells)
+        result = self.db_handler.save_all(data, merged_cells).result()
         if result.get("status") == "success":
             QMessageBox.information(self.table_widget, "保存成功", "表格数据已保存到数据库")
         else:
@@ -84,7 +85,7 @@ class TableHandler:
         return merged_cells
 
     def load_table_data(self):
-        response = self.db_handler.get_all()
+        response = self.db_handler.get_all().result()
         if response.get("status") == "success":
             data = response.get("data", {})
             table_data = data.get("table_data", [])
@@ -100,24 +101,29 @@ class TableHandler:
 
 
     def populate_table(self, table_data, merged_cells):
+        # 表格可能由新窗口以紧凑格式保存，新旧两种格式都经 load_table 解析
+        table_data = load_table(table_data)
         table = self.table_widget.get_table()
         table.clearContents()
-        table.setRowCount(len(table_data))
-        table.setColumnCount(max(len(row) for row in table_data) if table_data else 0)
-        for row_idx, row_data in enumerate(table_data):
-            for col_idx_str, cell_data in row_data.items():
-                col_idx = int(col_idx_str)
-                item = QTableWidgetItem(cell_data['text'])
-                item.setForeground(QColor(cell_data['foreground']))
-                item.setBackground(QColor(cell_data['background']))
-                item.setTextAlignment(cell_data['alignment'])
+        table.setRowCount(table_data['rows'])
+        table.setColumnCount(table_data['columns'])
+        for row_idx, height in enumerate(table_data['row_heights']):
+            table.setRowHeight(row_idx, height)
+        for col_idx, width in enumerate(table_data['column_widths']):
+            table.setColumnWidth(col_idx, width)
+        for row_idx in range(table_data['rows']):
+            for col_idx in range(table_data['columns']):
+                text, style = table_data['cells'].get((row_idx, col_idx), ('', DEFAULT_STYLE))
+                foreground, background, alignment, bold, size = style
+                item = QTableWidgetItem(text)
+                item.setForeground(QColor(foreground))
+                item.setBackground(QColor(background))
+                item.setTextAlignment(alignment)
                 font = QFont()
-                font.setBold(cell_data['font']['bold'])
-                font.setPointSize(cell_data['font']['size'])
+                font.setBold(bold)
+                font.setPointSize(size)
                 item.setFont(font)
                 table.setItem(row_idx, col_idx, item)
-                table.setRowHeight(row_idx, cell_data['row_height'])
-                table.setColumnWidth(col_idx, cell_data['column_width'])
         for cell in merged_cells:
             table.setSpan(cell['row'], cell['col'], cell['row_span'], cell['col_span'])
 
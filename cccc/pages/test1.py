@@ -53,7 +53,7 @@ class RN_summary_Window(QMainWindow):
         self.client_id = str(uuid.uuid4())
 
         self.db_handler = DataClient(server_url, table_name, self.client_id)
-        flag = check_bit(self.db_handler.get_permissions("c50039960"), 1)  # 权限检查
+        flag = check_bit(self.db_handler.get_permissions("c50039960").result(), 1)  # 权限检查
         self.table_widget = TableWidget(editable=flag)
         self.table_handler = TableHandler(self.table_widget, self.db_handler, can_save_data=flag)
 
@@ -1,41 +1,150 @@
 import requests
 import json
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from server.local_cache import SnapshotCache
+
+# orjson 为可选依赖，未安装时退回标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+POOL_MAXSIZE = 10  # keep-alive 连接数，与 executor 的线程数一致
+RETRY_ATTEMPTS = 3  # 只读请求最多尝试的次数
+RETRY_BACKOFF = 0.2  # 第 n 次重试前等待 RETRY_BACKOFF * 2 ** (n - 1) 秒
+RETRY_STATUSES = frozenset({502, 503, 504})
+# 各接口的 (连接超时, 读取超时)；整表保存和读取的数据量大，读取超时更长
+DEFAULT_TIMEOUT = (3.05, 10)
+ENDPOINT_TIMEOUTS = {
+    "save_all": (3.05, 30),
+    "save_table": (3.05, 30),
+    "get_all": (3.05, 30),
+    "get_table": (3.05, 30),
+}
+# 只读接口，失败时可以安全重试（部分读接口使用 POST）
+IDEMPOTENT_ENDPOINTS = frozenset({"get_permissions", "get_all", "get_table", "get_merged_cells"})
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _decode_json(content):
+    return orjson.loads(content) if orjson is not None else json.loads(content)
+
+
+def _get_session():
+    """进程内共享的 Session，所有 DataClient 及其工作线程复用同一个 keep-alive 连接池"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
 
 class DataClient:
-    def __init__(self, server_url, table_name, client_id):
+    """表格服务的客户端；各请求方法立即返回 concurrent.futures.Future，不阻塞调用线程
+
+    调用方可以同时发起多个互不依赖的请求，用 Future.result() 等待或由 TaskRunner.run_future 回到 GUI 线程处理结果。
+    """
+    def __init__(self, server_url, table_name, client_id, cache_path=None):
         self.client_id = client_id
         self.server_url = server_url
         self.table_name = table_name
-        self.executor = ThreadPoolExecutor(max_workers=10)
+        self.executor = ThreadPoolExecutor(max_workers=POOL_MAXSIZE)
+        self._etag_cache = {}  # endpoint -> (ETag, 上次的响应)，用于条件请求
+        # 可选的本地持久化，重启后仍能立即显示上次的表格并发送条件请求
+        self.snapshot_cache = SnapshotCache(cache_path) if cache_path else None
 
-    def _async_request(self, method, endpoint, payload=None, params=None):
+    def _async_request(self, method, endpoint, payload=None, params=None, conditional=False):
         url = f"{self.server_url}/{endpoint}"
+        cached = self._cached_response(endpoint) if conditional else None
+        headers = {'If-None-Match': cached[0]} if cached else {}
         try:
-            if method.upper() == "GET":
-                response = requests.get(url, params=params, timeout=10)
-            else:
-                response = requests.post(url, json=payload, timeout=10)
+            response = self._send(method, endpoint, url, payload, params, headers)
+            if cached and response.status_code == 304:
+                # 服务器数据未变化，直接使用本地副本
+                return cached[1]
+            if response.status_code == 409:
+                # 版本冲突，由调用方根据返回的当前版本决定如何处理
+                return _decode_json(response.content)
+            # requests 默认带上 gzip（以及已安装 zstandard 时的 zstd）的 Accept-Encoding 并自动解压
             response.raise_for_status()
-            return response.json()
+            result = _decode_json(response.content)
+            etag = response.headers.get('ETag')
+            if conditional and etag and result.get("status") == "success":
+                self._etag_cache[endpoint] = (etag, result)
+                if self.snapshot_cache is not None:
+                    self.snapshot_cache.put(self._snapshot_key(endpoint), etag, response.content)
+            return result
         except requests.RequestException as e:
             print(f"HTTP request failed: {e}")
             return {"error": str(e), "status": "request_error"}
-        except json.JSONDecodeError as e:
+        except ValueError as e:  # json.JSONDecodeError 与 orjson.JSONDecodeError 均为 ValueError 子类
             print(f"Error decoding JSON response: {e}")
             return {"error": "Invalid JSON response", "status": "response_error"}
 
+    def _cached_response(self, endpoint):
+        """返回 endpoint 上次成功响应的 (ETag, 响应)，内存中没有时读取本地缓存"""
+        cached = self._etag_cache.get(endpoint)
+        if cached is None and self.snapshot_cache is not None:
+            snapshot = self.snapshot_cache.get(self._snapshot_key(endpoint))
+            if snapshot is not None:
+                try:
+                    cached = self._etag_cache[endpoint] = (snapshot[0], _decode_json(snapshot[1]))
+                except ValueError:
+                    cached = None
+        return cached
+
+    def _snapshot_key(self, endpoint):
+        return f"{self.server_url}|{self.table_name}|{endpoint}"
+
+    def get_cached_all(self):
+        """同步返回上次 get_all 的响应（内存或本地缓存），没有时返回 None；不发送请求"""
+        cached = self._cached_response("get_all")
+        return cached[1] if cached else None
+
+    def _send(self, method, endpoint, url, payload, params, headers):
+        """通过共享 Session 发送请求；只读接口在连接失败、超时和 502/503/504 时按指数退避重试"""
+        timeout = ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+        attempts = RETRY_ATTEMPTS if endpoint in IDEMPOTENT_ENDPOINTS else 1
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+            try:
+                if method.upper() == "GET":
+                    response = _get_session().get(url, params=params, headers=headers, timeout=timeout)
+                else:
+                    response = _get_session().post(url, json=payload, headers=headers, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == attempts - 1:
+                    raise
+                continue
+            if response.status_code not in RETRY_STATUSES or attempt == attempts - 1:
+                return response
+            response.close()
+
     def get_permissions(self, username):
-        params = {'username': username}
-        future = self.executor.submit(self._async_request, "GET", "get_permissions", params=params)
-        result = future.result()
-        if "status" in result and result["status"] == "success":
-            permissions = result.get("permissions")
-            if permissions is not None:
-                return int(permissions)
-            else:
-                print("Permissions not found for user:", username)
-                return 0
+        """结果为权限位（int），用户不存在时为 0，请求失败时为 None"""
+        return self.executor.submit(self._get_permissions, username)
+
+    def _get_permissions(self, username):
+        # 服务器的 /get_permissions 只接受 POST
+        result = self._async_request("POST", "get_permissions", payload={'username': username})
+        status = result.get("status")
+        if status in ("request_error", "response_error"):
+            return None
+        permissions = result.get("permissions") if status == "success" else None
+        if permissions is None:
+            print("Permissions not found for user:", username)
+            return 0
+        return int(permissions)
 
     def save_all(self, data, merged_cells):
         payload = {
@@ -44,42 +153,46 @@ class DataClient:
             "merged_cells": merged_cells,
             "client_id": self.client_id
         }
-        future = self.executor.submit(self._async_request, "POST", "save_all", payload=payload)
-        return future.result()
+        return self.executor.submit(self._async_request, "POST", "save_all", payload=payload)
 
     def get_all(self):
-        future = self.executor.submit(self._async_request, "POST", "get_all", payload={"table_name": self.table_name})
-        return future.result()
+        return self.executor.submit(self._async_request, "POST", "get_all",
+                                    payload={"table_name": self.table_name}, conditional=True)
+
+    def patch_table(self, base_version, ops):
+        payload = {
+            "table_name": self.table_name,
+            "client_id": self.client_id,
+            "base_version": base_version,
+            "ops": ops
+        }
+        return self.executor.submit(self._async_request, "POST", "patch_table", payload=payload)
 
     def save_table(self, data):
         payload = {
             "table_name": self.table_name,
             "data": data
         }
-        future = self.executor.submit(self._async_request, "POST", "save_table", payload=payload)
-        return future.result()
+        return self.executor.submit(self._async_request, "POST", "save_table", payload=payload)
 
     def get_table(self):
-        future = self.executor.submit(self._async_request, "POST", "get_table", payload={"table_name": self.table_name})
-        return future.result()
+        return self.executor.submit(self._async_request, "POST", "get_table",
+                                    payload={"table_name": self.table_name}, conditional=True)
 
     def save_merged_cells(self, merged_cells):
         payload = {
             "table_name": self.table_name,
             "merged_cells": merged_cells
         }
-        future = self.executor.submit(self._async_request, "POST", "save_merged_cells", payload=payload)
-        return future.result()
+        return self.executor.submit(self._async_request, "POST", "save_merged_cells", payload=payload)
 
     def get_merged_cells(self):
-        future = self.executor.submit(self._async_request, "POST", "get_merged_cells", payload={"table_name": self.table_name})
-        return future.result()
+        return self.executor.submit(self._async_request, "POST", "get_merged_cells", payload={"table_name": self.table_name})
 
     def append_table(self, data):
         payload = {
             "table_name": self.table_name,
             "data": data
         }
-        future = self.executor.submit(self._async_request, "POST", "append_table", payload=payload)
-        return future.result()
+        return self.executor.submit(self._async_request, "POST", "append_table", payload=payload)
 
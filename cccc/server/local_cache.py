@@ -0,0 +1,28 @@
+import sqlite3
+import threading
+
+
+class SnapshotCache:
+    """把条件请求的 (ETag, 响应体) 保存到本地 SQLite
+
+    客户端重启后可以先显示上次的数据，再带上 ETag 发送条件请求，数据未变化时服务器只返回 304。
+    可以在多个线程中同时调用。
+    """
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS snapshots '
+                               '(key TEXT PRIMARY KEY, etag TEXT NOT NULL, body BLOB NOT NULL)')
+
+    def get(self, key):
+        """返回 (ETag, 响应体)，没有缓存时返回 None"""
+        with self._lock:
+            row = self._conn.execute('SELECT etag, body FROM snapshots WHERE key = ?', (key,)).fetchone()
+        return (row[0], bytes(row[1])) if row else None
+
+    def put(self, key, etag, body):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO snapshots (key, etag, body) VALUES (?, ?, ?)',
+                               (key, etag, body))
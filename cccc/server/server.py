@@ -1,23 +1,50 @@
+import os
 import redis
 import json
 from flask import Flask, request, jsonify
-from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
 
 app = Flask(__name__)
-executor = ThreadPoolExecutor(max_workers=10)
 
 redis_client = redis.Redis(host='localhost', port=6379, db=0)  
 
+# 批量读取 rn_record 时每批 SCAN/MGET 的键数量
+RN_FETCH_BATCH_SIZE = int(os.environ.get('RN_FETCH_BATCH_SIZE', 500))
+
+# 新记录 ID 的自增计数器，以及单次最多预留的 ID 数
+RN_RECORD_ID_KEY = 'rn_record_id_seq'
+RN_RECORD_ID_MAX_RESERVE = 10000
+
+# 把计数器推进到不小于 ARGV[1]，与并发的 INCR 互不冲突
+advance_rn_record_id = redis_client.register_script("""
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local target = tonumber(ARGV[1])
+if target > current then
+    redis.call('SET', KEYS[1], target)
+    return target
+end
+return current
+""")
+
 class RedisHandler:
 
-    def load_all_rn_records(self):
-        keys = redis_client.keys('rn_record:*')
+    def __init__(self):
+        # 本进程是否已确认计数器存在；服务器不一定经 __main__ 启动，首次分配 ID 前再检查
+        self._rn_record_id_counter_ready = False
+
+    def load_all_rn_records(self, batch_size=RN_FETCH_BATCH_SIZE):
+        # 增量 SCAN 收集键，避免 KEYS 阻塞 Redis；再用流水线批量 MGET 读取
+        keys = list(redis_client.scan_iter(match='rn_record:*', count=batch_size))
+        if not keys:
+            return []
+        pipe = redis_client.pipeline(transaction=False)
+        for start in range(0, len(keys), batch_size):
+            pipe.mget(keys[start:start + batch_size])
         rn_records = []
-        for key in keys:
-            data = redis_client.get(key)
-            rn_record = json.loads(data)
-            rn_records.append(rn_record)
+        for values in pipe.execute():
+            for data in values:
+                if data is not None:  # SCAN 与 MGET 之间被删除的键
+                    rn_records.append(json.loads(data))
         return rn_records
 
     def save_rn_record(self, rn_record_id, rn_record_data):
@@ -28,12 +55,37 @@ class RedisHandler:
         redis_client.delete(f'rn_record:{rn_record_id}')
 
     def get_new_rn_record_id(self):
-        keys = redis_client.keys('rn_record:*')
-        if keys:
-            max_id = max(int(key.split(b':')[-1]) for key in keys)
-            return max_id + 1
-        else:
-            return 1
+        self.ensure_rn_record_id_counter()
+        return redis_client.incr(RN_RECORD_ID_KEY)
+
+    def reserve_rn_record_ids(self, count):
+        """一次预留 count 个连续的 ID，返回 (first_id, last_id)，批量导入时无需逐条请求"""
+        self.ensure_rn_record_id_counter()
+        last_id = redis_client.incrby(RN_RECORD_ID_KEY, count)
+        return last_id - count + 1, last_id
+
+    def advance_rn_record_id(self, rn_record_id):
+        """客户端自带 ID 保存时，保证计数器之后不会再分配到这个 ID"""
+        self.ensure_rn_record_id_counter()
+        advance_rn_record_id(keys=[RN_RECORD_ID_KEY], args=[rn_record_id])
+
+    def ensure_rn_record_id_counter(self):
+        """每个进程首次使用计数器前执行一次迁移；迁移本身是幂等的，多个进程同时执行也不会让计数器倒退"""
+        if not self._rn_record_id_counter_ready:
+            self.migrate_rn_record_id_counter()
+            self._rn_record_id_counter_ready = True
+
+    def migrate_rn_record_id_counter(self, batch_size=RN_FETCH_BATCH_SIZE):
+        """计数器不存在时，用现有 rn_record:<数字> 键的最大 ID 初始化它；已存在则直接返回当前值"""
+        current = redis_client.get(RN_RECORD_ID_KEY)
+        if current is not None:
+            return int(current)
+        max_id = 0
+        for key in redis_client.scan_iter(match='rn_record:*', count=batch_size):
+            suffix = key.split(b':', 1)[1]
+            if suffix.isdigit():
+                max_id = max(max_id, int(suffix))
+        return advance_rn_record_id(keys=[RN_RECORD_ID_KEY], args=[max_id])
 
     def get_rn_record_by_id(self, rn_record_id):
         data =redis_client.get(f'rn_record:{rn_record_id}')
@@ -73,6 +125,8 @@ class RedisHandler:
 
     def set_permissions(self, username: str, permissions: int):
         redis_client.set(f'permissions_{username}', permissions)
+        # 通知各服务端进程和客户端丢弃该用户的权限缓存
+        redis_client.publish('user_updates', json.dumps({'usernames': [username]}))
 
     def get_permissions(self, username: str):
         permissions = redis_client.get(f'permissions_{username}')
@@ -86,6 +140,7 @@ class RedisHandler:
     def clear_permissions(self, usernames):
         for username in usernames:
             redis_client.delete(f'permissions_{username}')
+        redis_client.publish('user_updates', json.dumps({'usernames': list(usernames)}))
         print("Permissions cleared successfully for all provided users.")
 
 redis_handler = RedisHandler()
@@ -95,43 +150,40 @@ def save_all_route():
     request_data = request.json
     table_name = request_data['table_name'] 
     client_id = request_data.get('client_id') 
-    future = executor.submit(redis_handler.save_all, table_name, request_data['data'], request_data['merged_cells'], client_id)
-    future.result()
+    redis_handler.save_all(table_name, request_data['data'], request_data['merged_cells'], client_id)
     return jsonify({"status": "success"})
 
 @app.route("/get_all", methods=["POST"])
 def get_all_route():
     request_data = request.json
     table_name = request_data['table_name']
-    result = executor.submit(redis_handler.get_all, table_name).result()
+    result = redis_handler.get_all(table_name)
     return jsonify({"status": "success", "data": result})
 
 @app.route("/save_table", methods=["POST"])
 def save_table_route():
     request_data = request.json
     table_name = request_data['table_name']
-    future = executor.submit(redis_handler.save_table, table_name, request_data['data'])
-    future.result()
+    redis_handler.save_table(table_name, request_data['data'])
     return jsonify({"status": "success"})
 
 @app.route("/get_table", methods=["POST"])
 def get_table_route():
     request_data = request.json
     table_name = request_data['table_name']
-    result = executor.submit(redis_handler.get_table, table_name).result()
+    result = redis_handler.get_table(table_name)
     return jsonify({"status": "success", "data": result})
 
 @app.route("/save_merged_cells", methods=["POST"])
 def save_merged_cells_route():
     request_data = request.json
     table_name = request_data['table_name']
-    future = executor.submit(redis_handler.save_merged_cells, table_name, request_data['merged_cells'])
-    future.result()
+    redis_handler.save_merged_cells(table_name, request_data['merged_cells'])
     return jsonify({"status": "success"})
 
-@app.route("/get_permissions", methods=["GET"])
+@app.route("/get_permissions", methods=["GET", "POST"])
 def get_permissions_route():
-    username = request.args.get('username')
+    username = (request.get_json(silent=True) or request.args).get('username')
     permissions = redis_handler.get_permissions(username)
     if permissions is not None:
         return jsonify({"status": "success", "permissions": permissions})
@@ -140,18 +192,24 @@ def get_permissions_route():
 
 @app.route('/rn_records', methods=['GET'])
 def get_all_rn_records():
-    future = executor.submit(redis_handler.load_all_rn_records)
-    rn_records = future.result()
+    rn_records = redis_handler.load_all_rn_records()
     return jsonify(rn_records)
 
 @app.route('/rn_record/<int:rn_record_id>', methods=['GET'])
 def get_rn_record_by_id(rn_record_id):
-    future = executor.submit(redis_handler.get_rn_record_by_id, rn_record_id)
-    rn_record = future.result()
+    rn_record = redis_handler.get_rn_record_by_id(rn_record_id)
     if rn_record:
         return jsonify(rn_record)
     return jsonify({"error": "Record not found"}), 404
 
+def parse_rn_record_id(value):
+    """客户端自带的 ID 必须是正整数（或全为数字的字符串），否则返回 None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)
+    return value if isinstance(value, int) and value > 0 else None
+
 @app.route('/rn_record', methods=['POST'])
 def save_rn_record():
     data = request.json
@@ -159,15 +217,24 @@ def save_rn_record():
         rn_record_id = redis_handler.get_new_rn_record_id()
         data['id'] = rn_record_id
     else:
-        rn_record_id = data['id']
-    future = executor.submit(redis_handler.save_rn_record, rn_record_id, data)
-    future.result()
+        rn_record_id = parse_rn_record_id(data['id'])
+        if rn_record_id is None:
+            return jsonify({"status": "error", "message": "id 必须是正整数"}), 400
+        redis_handler.advance_rn_record_id(rn_record_id)
+    redis_handler.save_rn_record(rn_record_id, data)
     return jsonify({"status": "success", "rn_record_id": rn_record_id})
 
+@app.route('/rn_record_ids', methods=['POST'])
+def reserve_rn_record_ids():
+    count = request.json.get('count', 1)
+    if not isinstance(count, int) or not 0 < count <= RN_RECORD_ID_MAX_RESERVE:
+        return jsonify({"status": "error", "message": f"count 必须是 1 到 {RN_RECORD_ID_MAX_RESERVE} 之间的整数"}), 400
+    first_id, last_id = redis_handler.reserve_rn_record_ids(count)
+    return jsonify({"status": "success", "first_id": first_id, "last_id": last_id})
+
 @app.route('/rn_record/<int:rn_record_id>', methods=['DELETE'])
 def delete_rn_record(rn_record_id):
-    future = executor.submit(redis_handler.delete_rn_record, rn_record_id)
-    future.result()
+    redis_handler.delete_rn_record(rn_record_id)
     return jsonify({"status": "success"})
 
 
@@ -183,5 +250,6 @@ if __name__ == '__main__':
         'c50039966': 7
     }
     redis_handler.set_multiple_permissions(user_permissions)
+    print(f"RN record id counter at {redis_handler.migrate_rn_record_id_counter()}.")
 
     app.run(host="0.0.0.0", port=5002)
@@ -1,23 +1,31 @@
+import os
 import redis
 import json
 from flask import Flask, request, jsonify
-from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
 import json
 app = Flask(__name__)
-executor = ThreadPoolExecutor(max_workers=10)
 
 redis_client = redis.Redis(host='localhost', port=6379, db=0)  
 
+# 批量读取 rn_record 时每批 SCAN/MGET 的键数量
+RN_FETCH_BATCH_SIZE = int(os.environ.get('RN_FETCH_BATCH_SIZE', 500))
+
 class RedisHandler:
 
-    def load_all_rn_records(self):
-        keys = redis_client.keys('rn_record:*')
+    def load_all_rn_records(self, batch_size=RN_FETCH_BATCH_SIZE):
+        # 增量 SCAN 收集键，避免 KEYS 阻塞 Redis；再用流水线批量 MGET 读取
+        keys = list(redis_client.scan_iter(match='rn_record:*', count=batch_size))
+        if not keys:
+            return []
+        pipe = redis_client.pipeline(transaction=False)
+        for start in range(0, len(keys), batch_size):
+            pipe.mget(keys[start:start + batch_size])
         rn_records = []
-        for key in keys:
-            data = redis_client.get(key)
-            rn_record = json.loads(data)
-            rn_records.append(rn_record)
+        for values in pipe.execute():
+            for data in values:
+                if data is not None:  # SCAN 与 MGET 之间被删除的键
+                    rn_records.append(json.loads(data))
         return rn_records
 
     def save_rn_record(self, issue_number, rn_record_data):
@@ -67,6 +75,8 @@ class RedisHandler:
 
     def set_permissions(self, username: str, permissions: int):
         redis_client.set(f'permissions_{username}', permissions)
+        # 通知各服务端进程和客户端丢弃该用户的权限缓存
+        redis_client.publish('user_updates', json.dumps({'usernames': [username]}))
 
     def get_permissions(self, username: str):
         permissions = redis_client.get(f'permissions_{username}')
@@ -80,6 +90,7 @@ class RedisHandler:
     def clear_permissions(self, usernames):
         for username in usernames:
             redis_client.delete(f'permissions_{username}')
+        redis_client.publish('user_updates', json.dumps({'usernames': list(usernames)}))
         print("Permissions cleared successfully for all provided users.")
 
     def publish_message(self, channel, message):
@@ -92,38 +103,35 @@ def save_all_route():
     request_data = request.json
     table_name = request_data['table_name'] 
     client_id = request_data.get('client_id') 
-    future = executor.submit(redis_handler.save_all, table_name, request_data['data'], request_data['merged_cells'], client_id)
-    future.result()
+    redis_handler.save_all(table_name, request_data['data'], request_data['merged_cells'], client_id)
     return jsonify({"status": "success"})
 
 @app.route("/get_all", methods=["POST"])
 def get_all_route():
     request_data = request.json
     table_name = request_data['table_name']
-    result = executor.submit(redis_handler.get_all, table_name).result()
+    result = redis_handler.get_all(table_name)
     return jsonify({"status": "success", "data": result})
 
 @app.route("/save_table", methods=["POST"])
 def save_table_route():
     request_data = request.json
     table_name = request_data['table_name']
-    future = executor.submit(redis_handler.save_table, table_name, request_data['data'])
-    future.result()
+    redis_handler.save_table(table_name, request_data['data'])
     return jsonify({"status": "success"})
 
 @app.route("/get_table", methods=["POST"])
 def get_table_route():
     request_data = request.json
     table_name = request_data['table_name']
-    result = executor.submit(redis_handler.get_table, table_name).result()
+    result = redis_handler.get_table(table_name)
     return jsonify({"status": "success", "data": result})
 
 @app.route("/save_merged_cells", methods=["POST"])
 def save_merged_cells_route():
     request_data = request.json
     table_name = request_data['table_name']
-    future = executor.submit(redis_handler.save_merged_cells, table_name, request_data['merged_cells'])
-    future.result()
+    redis_handler.save_merged_cells(table_name, request_data['merged_cells'])
     return jsonify({"status": "success"})
 
 @app.route("/get_permissions", methods=["GET"])
@@ -137,14 +145,12 @@ def get_permissions_route():
 
 @app.route('/rn_records', methods=['GET'])
 def get_all_rn_records():
-    future = executor.submit(redis_handler.load_all_rn_records)
-    rn_records = future.result()
+    rn_records = redis_handler.load_all_rn_records()
     return jsonify(rn_records)
 
 @app.route('/rn_record/<string:issue_number>', methods=['GET'])
 def get_rn_record_by_issue_number(issue_number):
-    future = executor.submit(redis_handler.get_rn_record_by_issue_number, issue_number)
-    rn_record = future.result()
+    rn_record = redis_handler.get_rn_record_by_issue_number(issue_number)
     if rn_record:
         return jsonify(rn_record)
     return jsonify({"error": "Record not found"}), 404
@@ -174,8 +180,7 @@ def save_rn_record():
                 # 如果旧的单号和新的单号相同，这是一次普通的数据更新
                 existing_record = redis_handler.get_rn_record_by_issue_number(issue_number)
                 if existing_record:
-                    future = executor.submit(redis_handler.save_rn_record, issue_number, data)
-                    future.result()
+                    redis_handler.save_rn_record(issue_number, data)
 
                     # 广播消息，标识这是一个普通的更新操作
                     message = {
@@ -194,8 +199,7 @@ def save_rn_record():
                 if existing_record:
                     # 删除旧记录，保存新记录
                     redis_handler.delete_rn_record(old_issue_number)
-                    future = executor.submit(redis_handler.save_rn_record, issue_number, data)
-                    future.result()
+                    redis_handler.save_rn_record(issue_number, data)
 
                     # 广播消息，标识这是一个单号名称修改的操作
                     message = {
@@ -214,8 +218,7 @@ def save_rn_record():
             existing_record = redis_handler.get_rn_record_by_issue_number(issue_number)
             if existing_record:
                 # 如果单号名称未发生变化，执行普通更新操作
-                future = executor.submit(redis_handler.save_rn_record, issue_number, data)
-                future.result()
+                redis_handler.save_rn_record(issue_number, data)
 
                 # 广播消息，标识这是一个普通的更新操作
                 message = {
@@ -228,8 +231,7 @@ def save_rn_record():
                 redis_handler.publish_message('rn_channel', json.dumps(message))
             else:
                 # 如果是一个新的记录
-                future = executor.submit(redis_handler.save_rn_record, issue_number, data)
-                future.result()
+                redis_handler.save_rn_record(issue_number, data)
 
                 # 广播消息，标识这是一个新增操作
                 message = {
@@ -260,8 +262,7 @@ def delete_rn_record(issue_number):
     if not client_id:
         return jsonify({"error": "client_id 是必填项"}), 400
 
-    future = executor.submit(redis_handler.delete_rn_record, issue_number)
-    future.result()
+    redis_handler.delete_rn_record(issue_number)
 
     # 广播消息，直接使用 issue_number
     message = {
@@ -277,8 +278,7 @@ def delete_rn_record(issue_number):
 
 @app.route('/rn_record_exists/<string:issue_number>', methods=['GET'])
 def check_issue_number_exists(issue_number):
-    future = executor.submit(redis_handler.issue_number_exists, issue_number)
-    exists = future.result()
+    exists = redis_handler.issue_number_exists(issue_number)
     return jsonify({"exists": exists})
 
 